@@ -1,11 +1,15 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, send_from_directory
-from database import get_db, init_db, get_database_path
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, send_from_directory, g, has_app_context, Response, stream_with_context
+from database import get_db, init_db, close_request_db, get_pool_stats, get_cache_version, bump_cache_version, refresh_meal_plan_dish_totals
+from database import write_snapshot, take_scheduled_snapshot, SNAPSHOT_INTERVAL_SECONDS, SYNC_TABLE_KEYS
 from datetime import datetime, date, timedelta
 from werkzeug.utils import secure_filename
-import json, os, math
+import codecs, csv, io, json, os, math, re, tempfile, threading, time, zlib
+from bisect import bisect_right
+from operator import itemgetter
 from collections import defaultdict
 from urllib.request import urlopen
 from urllib.parse import urlencode
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY', os.urandom(24).hex())
@@ -19,7 +23,9 @@ except (PermissionError, OSError):
     app.config['UPLOAD_FOLDER'] = default_upload_folder
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
-_PRAYER_CACHE = {}
+_SETTINGS_CACHE = {'snapshot': (None, {})}
+_WEIGHT_INDEX_CACHE = {'snapshot': (None, None)}
+_RECURRING_PROJECTION_CACHE = {'snapshot': (None, {})}
 
 GYM_PROGRESS_TABLES = [
     'user_profile',
@@ -75,16 +81,31 @@ CHESS_DAILY_CHECKLIST_KEYS = [
 ]
 
 init_db()
+app.teardown_appcontext(close_request_db)
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def get_settings():
+    cached = g.get('_settings')
+    if cached is not None:
+        return dict(cached)
     conn = get_db()
-    rows = conn.execute('SELECT setting_key, setting_value FROM app_settings').fetchall()
+    version = get_cache_version(conn, 'app_settings')
+    cached_version, settings = _SETTINGS_CACHE['snapshot']
+    if cached_version != version:
+        rows = conn.execute('SELECT setting_key, setting_value FROM app_settings').fetchall()
+        settings = {r['setting_key']: r['setting_value'] for r in rows}
+        _SETTINGS_CACHE['snapshot'] = (version, settings)
     conn.close()
-    return {r['setting_key']: r['setting_value'] for r in rows}
+    g._settings = settings
+    return dict(settings)
+
+def invalidate_settings_cache(conn):
+    # Call inside the writing transaction so other workers see the bump with the data.
+    bump_cache_version(conn, 'app_settings')
+    g.pop('_settings', None)
 
 
 def table_exists(conn, table_name):
@@ -108,22 +129,326 @@ def dump_tables(conn, table_names):
     return payload
 
 
-def restore_table_rows(conn, table_name, rows):
-    if not table_exists(conn, table_name):
-        return
-    valid_columns = get_table_columns(conn, table_name)
-    if not valid_columns:
-        return
-    for row in rows:
-        row_dict = dict(row)
-        insert_cols = [col for col in valid_columns if col in row_dict]
+RESTORE_BATCH_ROWS = 500
+RESTORE_READ_BYTES = 64 * 1024
+
+_JSON_WHITESPACE = re.compile(r'[ \t\r\n]*')
+
+def iter_backup_rows(stream):
+    # Incremental reader for {"table": [row, ...], ...} uploads: one row is
+    # decoded at a time, so memory tracks the read chunk rather than the file.
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    scan_once = json.JSONDecoder().scan_once
+    skip_whitespace = _JSON_WHITESPACE.match
+    buf = ''
+    pos = 0
+    eof = False
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = stream.read(RESTORE_READ_BYTES)
+        eof = not chunk
+        buf = buf[pos:] + text_decoder.decode(chunk, final=eof)
+        pos = 0
+
+    def peek():
+        nonlocal pos
+        while True:
+            pos = skip_whitespace(buf, pos).end()
+            if pos < len(buf):
+                return buf[pos]
+            if eof:
+                return ''
+            fill()
+
+    def take(expected):
+        nonlocal pos
+        char = peek()
+        if not char or char not in expected:
+            raise ValueError(f'Expected one of {expected!r} in backup JSON')
+        pos += 1
+        return char
+
+    def read_value():
+        nonlocal pos
+        peek()
+        while True:
+            try:
+                value, end = scan_once(buf, pos)
+                # A number at the buffer edge may be truncated ("12" of "12.5").
+                if eof or (end < len(buf) and buf[end] not in '0123456789.eE+-'):
+                    pos = end
+                    return value
+            except (StopIteration, json.JSONDecodeError):
+                if eof:
+                    raise ValueError('Malformed backup JSON')
+            fill()
+
+    take('{')
+    if peek() == '}':
+        take('}')
+    else:
+        while True:
+            table = read_value()
+            if not isinstance(table, str):
+                raise ValueError('Backup keys must be table names')
+            take(':')
+            if peek() == '[':
+                take('[')
+                if peek() == ']':
+                    take(']')
+                else:
+                    while True:
+                        yield table, read_value()
+                        if take(',]') == ']':
+                            break
+            else:
+                read_value()
+            if take(',}') == '}':
+                break
+    if peek():
+        raise ValueError('Unexpected data after backup JSON')
+
+def _restore_row_getter(columns):
+    if len(columns) == 1:
+        column = columns[0]
+        return lambda row: (row[column],)
+    return itemgetter(*columns) if columns else None
+
+def bulk_restore_rows(conn, rows, tables, collect=None):
+    # One prepared INSERT per (table, column set), flushed in executemany batches.
+    columns_by_table = {}
+    plans = {}
+    pending = {}
+    counts = defaultdict(int)
+
+    def flush(table):
+        insert_cols, batch = pending.pop(table, (None, []))
+        if batch:
+            conn.executemany(
+                f"INSERT INTO {table} ({','.join(insert_cols)}) VALUES ({','.join('?' for _ in insert_cols)})",
+                batch,
+            )
+            counts[table] += len(batch)
+
+    for table, row in rows:
+        if collect is not None and table in collect:
+            collect[table].append(row)
+            continue
+        if table not in tables:
+            continue
+        if not isinstance(row, dict):
+            raise ValueError(f'Rows for {table} must be JSON objects')
+        plan_key = (table, tuple(row))
+        plan = plans.get(plan_key)
+        if plan is None:
+            if table not in columns_by_table:
+                columns_by_table[table] = get_table_columns(conn, table) if table_exists(conn, table) else []
+            insert_cols = tuple(col for col in columns_by_table[table] if col in row)
+            plan = plans[plan_key] = (insert_cols, _restore_row_getter(insert_cols))
+        insert_cols, getter = plan
         if not insert_cols:
             continue
-        placeholders = ','.join(['?'] * len(insert_cols))
-        conn.execute(
-            f"INSERT INTO {table_name} ({','.join(insert_cols)}) VALUES ({placeholders})",
-            tuple(row_dict.get(col) for col in insert_cols),
+        current_cols, batch = pending.get(table, (insert_cols, []))
+        if current_cols != insert_cols or len(batch) >= RESTORE_BATCH_ROWS:
+            flush(table)
+            batch = []
+        batch.append(getter(row))
+        pending[table] = (insert_cols, batch)
+    for table in list(pending):
+        flush(table)
+    return dict(counts)
+
+def foreign_key_violations(conn, tables):
+    violations = {}
+    for table in tables:
+        if table_exists(conn, table):
+            count = len(conn.execute(f'PRAGMA foreign_key_check({table})').fetchall())
+            if count:
+                violations[table] = count
+    return violations
+
+def format_restore_report(counts, started):
+    total = sum(counts.values())
+    detail = ', '.join(f'{table}: {count:,}' for table, count in sorted(counts.items(), key=lambda item: -item[1]))
+    summary = f'{total:,} rows in {time.perf_counter() - started:.1f}s'
+    return f'{summary} ({detail})' if detail else summary
+
+
+GYM_SYNC_CURSOR_PREFIX = 'gym_sync_cursor_'
+
+def parse_sync_since(raw):
+    raw = (raw or '').strip()
+    if not raw:
+        return 0
+    if not raw.isdigit():
+        raise ValueError('since must be a non-negative integer')
+    return int(raw)
+
+def load_sync_clock(conn):
+    row = conn.execute('SELECT counter, instance_id FROM sync_clock WHERE id = 1').fetchone()
+    return row['counter'], row['instance_id']
+
+def build_gym_sync_pack(conn, since=0):
+    # Read the clock first: anything written after it has a higher version and
+    # is either in this pack or in the next one.
+    cursor, instance_id = load_sync_clock(conn)
+    payload = {}
+    for table in GYM_SYNC_TABLES:
+        columns = [col for col in get_table_columns(conn, table) if col not in ('id', 'version')]
+        payload[table] = [dict(row) for row in conn.execute(
+            f"SELECT {','.join(columns)} FROM {table} WHERE version > ? ORDER BY version",
+            (since,),
+        ).fetchall()]
+    key_params = ','.join('?' for _ in GYM_SYNC_SETTING_KEYS)
+    payload['app_settings'] = [dict(row) for row in conn.execute(
+        f'SELECT setting_key, setting_value, updated_at FROM app_settings WHERE setting_key IN ({key_params}) AND version > ? ORDER BY version',
+        (*GYM_SYNC_SETTING_KEYS, since),
+    ).fetchall()]
+    payload['deleted'] = [dict(row) for row in conn.execute(
+        f"SELECT table_name AS 'table', row_key AS 'key', updated_at FROM sync_tombstones WHERE table_name IN ({','.join('?' for _ in GYM_SYNC_TABLES)}) AND version > ? ORDER BY version",
+        (*GYM_SYNC_TABLES, since),
+    ).fetchall()]
+    # A list so the streaming restore reader hands it over like any other table.
+    payload['sync'] = [{'instance': instance_id, 'since': since, 'cursor': cursor}]
+    return payload
+
+def _sync_upsert_sql(table, key, columns):
+    data_cols = [col for col in columns if col not in (key, 'created_at', 'updated_at')]
+    values = [f'COALESCE(:{col}, CURRENT_TIMESTAMP)' if col == 'created_at' else f':{col}' for col in columns]
+    changed = ' OR '.join(f'{table}.{col} IS NOT excluded.{col}' for col in data_cols) or '0'
+    assignments = ''.join(f'{col} = excluded.{col}, ' for col in data_cols)
+    # Last writer wins on updated_at; unstamped rows (older packs) win ties
+    # against live rows but lose to any tombstone. Rows whose data already
+    # matches are left alone so re-imports write nothing.
+    return f'''
+        INSERT INTO {table} ({','.join(columns)})
+        SELECT {','.join(values)}
+        WHERE NOT EXISTS (
+            SELECT 1 FROM sync_tombstones
+            WHERE table_name = '{table}' AND row_key = :{key}
+              AND (:updated_at IS NULL OR updated_at > :updated_at)
         )
+        ON CONFLICT({key}) DO UPDATE SET {assignments}updated_at = COALESCE(excluded.updated_at, {table}.updated_at)
+        WHERE ({changed}) AND COALESCE(excluded.updated_at, {table}.updated_at) >= {table}.updated_at
+    '''
+
+def _sync_insert_missing_sql(table, columns):
+    # Older packs carry body_stats rows without a sync_id; insert each one
+    # unless an identical row is already here.
+    data_cols = [col for col in columns if col not in ('created_at', 'updated_at')]
+    values = [f'COALESCE(:{col}, CURRENT_TIMESTAMP)' if col == 'created_at' else f':{col}' for col in columns]
+    same = ' AND '.join(f'{col} IS :{col}' for col in data_cols)
+    return f'''
+        INSERT INTO {table} ({','.join(columns)})
+        SELECT {','.join(values)}
+        WHERE NOT EXISTS (SELECT 1 FROM {table} WHERE {same})
+    '''
+
+def _apply_sync_delete(conn, table, key, row_key, deleted_at):
+    local = conn.execute(f'SELECT updated_at FROM {table} WHERE {key} = ?', (row_key,)).fetchone()
+    if local is not None:
+        if deleted_at is not None and local['updated_at'] is not None and local['updated_at'] > deleted_at:
+            return False
+        conn.execute(f'DELETE FROM {table} WHERE {key} = ?', (row_key,))
+        if deleted_at is not None:
+            conn.execute(
+                'UPDATE sync_tombstones SET updated_at = ? WHERE table_name = ? AND row_key = ?',
+                (deleted_at, table, row_key),
+            )
+        return True
+    tombstone = conn.execute(
+        'SELECT updated_at FROM sync_tombstones WHERE table_name = ? AND row_key = ?',
+        (table, row_key),
+    ).fetchone()
+    if deleted_at is None or (tombstone is not None and tombstone['updated_at'] >= deleted_at):
+        return False
+    # Keep the delete so it travels on to the next instance.
+    conn.execute('UPDATE sync_clock SET counter = counter + 1 WHERE id = 1')
+    conn.execute(
+        '''INSERT OR REPLACE INTO sync_tombstones (table_name, row_key, updated_at, version)
+           VALUES (?, ?, ?, (SELECT counter FROM sync_clock WHERE id = 1))''',
+        (table, row_key, deleted_at),
+    )
+    return False
+
+def merge_gym_sync_rows(conn, rows):
+    # Idempotent upsert of a gym sync pack; returns (written counts, unchanged rows, pack metadata).
+    synced = {table: SYNC_TABLE_KEYS[table] for table in GYM_SYNC_TABLES + ['app_settings']}
+    columns_by_table = {}
+    statements = {}
+    counts = defaultdict(int)
+    unchanged = 0
+    meta = {}
+
+    for table, row in rows:
+        if table == 'sync':
+            if isinstance(row, dict):
+                meta = row
+            continue
+        if not isinstance(row, dict):
+            raise ValueError(f'Rows for {table} must be JSON objects')
+        if table == 'deleted':
+            target = row.get('table')
+            if target not in GYM_SYNC_TABLES or row.get('key') is None:
+                continue
+            if _apply_sync_delete(conn, target, synced[target], str(row['key']), row.get('updated_at')):
+                counts['deleted'] += 1
+            else:
+                unchanged += 1
+            continue
+        if table not in synced:
+            continue
+        key = synced[table]
+        if table == 'app_settings' and row.get('setting_key') not in GYM_SYNC_SETTING_KEYS:
+            continue
+        if table not in columns_by_table:
+            columns_by_table[table] = [col for col in get_table_columns(conn, table) if col not in ('id', 'version')]
+        columns = tuple(col for col in columns_by_table[table] if col in row or col == 'updated_at')
+        missing_key = row.get(key) is None
+        if missing_key and key != 'sync_id':
+            raise ValueError(f'Rows for {table} need a {key}')
+        plan_key = (table, columns, missing_key)
+        sql = statements.get(plan_key)
+        if sql is None:
+            if missing_key:
+                sql = _sync_insert_missing_sql(table, tuple(col for col in columns if col != key))
+            else:
+                sql = _sync_upsert_sql(table, key, columns)
+            statements[plan_key] = sql
+        params = {col: row.get(col) for col in columns if not (missing_key and col == key)}
+        written = conn.execute(sql, params).rowcount
+        if written > 0:
+            counts[table] += written
+        else:
+            unchanged += 1
+    return dict(counts), unchanged, meta
+
+def record_gym_sync_source(conn, meta):
+    # Remember how far each source has been read so the next pack can start there.
+    source = meta.get('instance')
+    cursor = meta.get('cursor')
+    if not source or not isinstance(cursor, int):
+        return []
+    cursor_key = f'{GYM_SYNC_CURSOR_PREFIX}{source}'
+    row = conn.execute('SELECT setting_value FROM app_settings WHERE setting_key = ?', (cursor_key,)).fetchone()
+    previous = int(row['setting_value']) if row and str(row['setting_value']).isdigit() else None
+    notes = []
+    since = meta.get('since') if isinstance(meta.get('since'), int) else 0
+    if previous is not None and since > previous:
+        notes.append(f'this pack starts after {since} but the last import from {source} stopped at {previous}, so changes in between are missing')
+    latest = max(cursor, previous or 0)
+    if latest != previous:
+        conn.execute('INSERT OR REPLACE INTO app_settings (setting_key, setting_value) VALUES (?, ?)', (cursor_key, str(latest)))
+    notes.append(f'next pack from {source}: since={latest}')
+    return notes
+
+def load_gym_sync_sources(settings):
+    sources = []
+    for setting_key, value in settings.items():
+        if setting_key.startswith(GYM_SYNC_CURSOR_PREFIX):
+            sources.append({'instance': setting_key[len(GYM_SYNC_CURSOR_PREFIX):], 'cursor': value})
+    return sorted(sources, key=lambda item: item['instance'])
 
 
 def ensure_todos_parent_column(conn):
@@ -184,29 +509,371 @@ def combine_date_and_time(day_obj, hhmm):
 def format_hhmm(dt_obj):
     return dt_obj.strftime('%H:%M') if dt_obj else '--:--'
 
-def fetch_prayer_timings(day_obj, latitude, longitude, method=2):
-    cache_key = (day_obj.isoformat(), latitude, longitude, method)
-    cached = _PRAYER_CACHE.get(cache_key)
-    if cached:
-        return cached
+# ===== PRAYER TIMES =====
+# Request paths only read the prayer_times table. A background thread per
+# worker keeps a rolling window filled for every configured location/method
+# using whichever fetcher backend is selected.
+PRAYER_NAMES = ['Fajr', 'Dhuhr', 'Asr', 'Maghrib', 'Isha']
+PRAYER_PREFETCH_DAYS = int(os.getenv('PRAYER_PREFETCH_DAYS', '30'))
+PRAYER_PREFETCH_INTERVAL_SECONDS = int(os.getenv('PRAYER_PREFETCH_INTERVAL', '21600'))
+PRAYER_PREFETCH_RETRY_SECONDS = int(os.getenv('PRAYER_PREFETCH_RETRY', '120'))
+DEEN_PRAYER_METHODS = [2, 4]
+_PRAYER_PREFETCH = {
+    'backend': os.getenv('PRAYER_TIMES_BACKEND', 'aladhan').strip().lower(),
+    'thread': None,
+    'wake': threading.Event(),
+    'lock': threading.Lock(),
+    'last_run': None,
+    'last_error': None,
+}
+
+def normalize_prayer_location(latitude, longitude):
+    return f"{float(latitude):.4f}", f"{float(longitude):.4f}"
+
+def _clean_prayer_time(value):
+    if not value:
+        return None
+    return str(value).strip().split(' ')[0]
+
+def fetch_aladhan_prayer_timings(start_date, days, latitude, longitude, method):
+    end_date = start_date + timedelta(days=days - 1)
     params = urlencode({
         'latitude': latitude,
         'longitude': longitude,
         'method': method,
     })
-    url = f"https://api.aladhan.com/v1/timings/{day_obj.isoformat()}?{params}"
-    with urlopen(url, timeout=5) as response:
-        payload = json.loads(response.read().decode('utf-8'))
-    timings = payload.get('data', {}).get('timings', {})
-    result = {
-        'Fajr': timings.get('Fajr'),
-        'Dhuhr': timings.get('Dhuhr'),
-        'Asr': timings.get('Asr'),
-        'Maghrib': timings.get('Maghrib'),
-        'Isha': timings.get('Isha'),
+    results = {}
+    month_cursor = date(start_date.year, start_date.month, 1)
+    while month_cursor <= end_date:
+        url = f"https://api.aladhan.com/v1/calendar/{month_cursor.year}/{month_cursor.month}?{params}"
+        with urlopen(url, timeout=10) as response:
+            payload = json.loads(response.read().decode('utf-8'))
+        for entry in payload.get('data') or []:
+            try:
+                day_obj = datetime.strptime(entry['date']['gregorian']['date'], '%d-%m-%Y').date()
+            except (KeyError, TypeError, ValueError):
+                continue
+            if start_date <= day_obj <= end_date:
+                timings = entry.get('timings') or {}
+                results[day_obj.isoformat()] = {name: _clean_prayer_time(timings.get(name)) for name in PRAYER_NAMES}
+        month_cursor = add_months(month_cursor, 1)
+    return results
+
+# Offline backend: solar position per the PrayTimes.org formulation, with the
+# same angle-based high-latitude fallback and Shafi Asr that Aladhan defaults to.
+PRAYER_CALC_METHODS = {
+    1: {'name': 'Karachi', 'fajr_angle': 18.0, 'isha_angle': 18.0},
+    2: {'name': 'ISNA', 'fajr_angle': 15.0, 'isha_angle': 15.0},
+    3: {'name': 'MWL', 'fajr_angle': 18.0, 'isha_angle': 17.0},
+    4: {'name': 'Umm al-Qura', 'fajr_angle': 18.5, 'isha_minutes': 90, 'ramadan_isha_minutes': 120},
+    5: {'name': 'Egyptian', 'fajr_angle': 19.5, 'isha_angle': 17.5},
+}
+SUN_RISE_SET_ANGLE = 0.833
+
+def _dsin(d):
+    return math.sin(math.radians(d))
+
+def _dcos(d):
+    return math.cos(math.radians(d))
+
+def _fix_angle(a):
+    return a - 360.0 * math.floor(a / 360.0)
+
+def _fix_hour(h):
+    return h - 24.0 * math.floor(h / 24.0)
+
+def _julian_day(day_obj):
+    year, month = day_obj.year, day_obj.month
+    if month <= 2:
+        year -= 1
+        month += 12
+    a = math.floor(year / 100)
+    b = 2 - a + math.floor(a / 4)
+    return math.floor(365.25 * (year + 4716)) + math.floor(30.6001 * (month + 1)) + day_obj.day + b - 1524.5
+
+def _sun_position(jd):
+    d = jd - 2451545.0
+    g = _fix_angle(357.529 + 0.98560028 * d)
+    q = _fix_angle(280.459 + 0.98564736 * d)
+    l = _fix_angle(q + 1.915 * _dsin(g) + 0.020 * _dsin(2 * g))
+    e = 23.439 - 0.00000036 * d
+    ra = math.degrees(math.atan2(_dcos(e) * _dsin(l), _dcos(l))) / 15.0
+    equation = q / 15.0 - _fix_hour(ra)
+    declination = math.degrees(math.asin(_dsin(e) * _dsin(l)))
+    return declination, equation
+
+def resolve_prayer_timezone():
+    # PRAYER_TIMEZONE pins the zone for the whole deployment; otherwise use the
+    # one saved next to the prayer location. Never the server's own zone: the
+    # Docker image and Render both run in UTC wherever the user is.
+    tz_name = os.getenv('PRAYER_TIMEZONE', '').strip()
+    if not tz_name:
+        conn = get_db()
+        row = conn.execute("SELECT setting_value FROM app_settings WHERE setting_key='notif_timezone'").fetchone()
+        conn.close()
+        tz_name = ((row['setting_value'] if row else '') or '').strip()
+    if not tz_name:
+        raise LookupError('No timezone set for prayer times (Settings > Notifications, or PRAYER_TIMEZONE)')
+    try:
+        return ZoneInfo(tz_name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise LookupError(f'Unknown prayer timezone: {tz_name}')
+
+def _hijri_month(day_obj):
+    # Tabular (arithmetic) Islamic calendar. Umm al-Qura is sighting-adjusted,
+    # so a Ramadan start or end can land a day apart from it.
+    l = day_obj.toordinal() + 1721425 - 1948440 + 10632
+    n = (l - 1) // 10631
+    l = l - 10631 * n + 354
+    j = ((10985 - l) // 5316) * ((50 * l) // 17719) + (l // 5670) * ((43 * l) // 15238)
+    l = l - ((30 - j) // 15) * ((17719 * j) // 50) - (j // 16) * ((15238 * j) // 43) + 29
+    return (24 * l) // 709
+
+def _prayer_utc_offset_hours(day_obj, zone):
+    noon = datetime(day_obj.year, day_obj.month, day_obj.day, 12, tzinfo=zone)
+    return noon.utcoffset().total_seconds() / 3600.0
+
+def _format_prayer_hour(value):
+    if value is None or math.isnan(value):
+        return None
+    value = _fix_hour(value + 0.5 / 60.0)
+    hours = int(math.floor(value))
+    minutes = int(math.floor((value - hours) * 60.0))
+    return f'{hours:02d}:{minutes:02d}'
+
+def _compute_prayer_hours(jd, latitude, longitude, params):
+    # jd is already shifted to local solar noon's day by the caller.
+    sin_lat, cos_lat = _dsin(latitude), _dcos(latitude)
+
+    def mid_day(t):
+        return _fix_hour(12.0 - _sun_position(jd + t)[1])
+
+    def sun_angle_time(angle, t, ccw=False):
+        declination = _sun_position(jd + t)[0]
+        cos_arg = (-_dsin(angle) - _dsin(declination) * sin_lat) / (_dcos(declination) * cos_lat)
+        if cos_arg < -1.0 or cos_arg > 1.0:
+            return float('nan')
+        delta = math.degrees(math.acos(cos_arg)) / 15.0
+        return mid_day(t) + (-delta if ccw else delta)
+
+    def asr_time(factor, t):
+        declination = _sun_position(jd + t)[0]
+        angle = -math.degrees(math.atan(1.0 / (factor + math.tan(math.radians(abs(latitude - declination))))))
+        return sun_angle_time(angle, t)
+
+    fajr = sun_angle_time(params['fajr_angle'], 5 / 24.0, ccw=True)
+    sunrise = sun_angle_time(SUN_RISE_SET_ANGLE, 6 / 24.0, ccw=True)
+    dhuhr = mid_day(12 / 24.0)
+    asr = asr_time(1, 13 / 24.0)
+    sunset = sun_angle_time(SUN_RISE_SET_ANGLE, 18 / 24.0)
+    if 'isha_minutes' in params:
+        isha = sunset + params['isha_minutes'] / 60.0
+    else:
+        isha = sun_angle_time(params['isha_angle'], 18 / 24.0)
+
+    if not math.isnan(sunrise) and not math.isnan(sunset):
+        night = _fix_hour(sunrise - sunset)
+        fajr_portion = params['fajr_angle'] / 60.0 * night
+        if math.isnan(fajr) or _fix_hour(sunrise - fajr) > fajr_portion:
+            fajr = sunrise - fajr_portion
+        if 'isha_angle' in params:
+            isha_portion = params['isha_angle'] / 60.0 * night
+            if math.isnan(isha) or _fix_hour(isha - sunset) > isha_portion:
+                isha = sunset + isha_portion
+
+    return {'Fajr': fajr, 'Dhuhr': dhuhr, 'Asr': asr, 'Maghrib': sunset, 'Isha': isha}
+
+def calculate_prayer_timings(start_date, days, latitude, longitude, method, zone=None):
+    params = PRAYER_CALC_METHODS.get(int(method))
+    if params is None:
+        raise ValueError(f'Prayer method {method} is not supported by the astronomical backend')
+    zone = zone or resolve_prayer_timezone()
+    latitude = float(latitude)
+    longitude = float(longitude)
+    longitude_hours = longitude / 15.0
+    results = {}
+    day_obj = start_date
+    for _ in range(int(days)):
+        jd = _julian_day(day_obj) - longitude / (15.0 * 24.0)
+        shift = _prayer_utc_offset_hours(day_obj, zone) - longitude_hours
+        day_params = params
+        if 'ramadan_isha_minutes' in params and _hijri_month(day_obj) == 9:
+            day_params = dict(params, isha_minutes=params['ramadan_isha_minutes'])
+        hours = _compute_prayer_hours(jd, latitude, longitude, day_params)
+        results[day_obj.isoformat()] = {name: _format_prayer_hour(hours[name] + shift) for name in PRAYER_NAMES}
+        day_obj += timedelta(days=1)
+    return results
+
+def calculate_prayer_timings_year(year, latitude, longitude, method, zone=None):
+    start_date = date(year, 1, 1)
+    return calculate_prayer_timings(start_date, (date(year + 1, 1, 1) - start_date).days, latitude, longitude, method, zone)
+
+PRAYER_TIMINGS_FETCHERS = {
+    'aladhan': fetch_aladhan_prayer_timings,
+    'astronomical': calculate_prayer_timings,
+}
+OFFLINE_PRAYER_BACKENDS = {'astronomical'}
+
+def register_prayer_timings_fetcher(name, fetcher):
+    # fetcher(start_date, days, latitude, longitude, method) -> {iso_date: {'Fajr': 'HH:MM', ...}}
+    PRAYER_TIMINGS_FETCHERS[name] = fetcher
+
+def set_prayer_timings_backend(name):
+    if name not in PRAYER_TIMINGS_FETCHERS:
+        raise KeyError(f'Unknown prayer timings backend: {name}')
+    _PRAYER_PREFETCH['backend'] = name
+
+def get_prayer_timings_fetcher():
+    return PRAYER_TIMINGS_FETCHERS.get(_PRAYER_PREFETCH['backend']) or fetch_aladhan_prayer_timings
+
+def store_prayer_timings(conn, latitude, longitude, method, timings_by_date, source):
+    lat_key, lon_key = normalize_prayer_location(latitude, longitude)
+    conn.executemany('''
+        INSERT OR REPLACE INTO prayer_times
+            (latitude, longitude, method, prayer_date, fajr, dhuhr, asr, maghrib, isha, source, fetched_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ''', [
+        (lat_key, lon_key, int(method), day_iso,
+         timings.get('Fajr'), timings.get('Dhuhr'), timings.get('Asr'), timings.get('Maghrib'), timings.get('Isha'),
+         source)
+        for day_iso, timings in timings_by_date.items()
+    ])
+
+def fetch_prayer_timings(day_obj, latitude, longitude, method=2):
+    lat_key, lon_key = normalize_prayer_location(latitude, longitude)
+    conn = get_db()
+    row = conn.execute('''
+        SELECT fajr, dhuhr, asr, maghrib, isha FROM prayer_times
+        WHERE latitude=? AND longitude=? AND method=? AND prayer_date=?
+    ''', (lat_key, lon_key, int(method), day_obj.isoformat())).fetchone()
+    conn.close()
+    if not row:
+        window_start = date.today() - timedelta(days=1)
+        if window_start <= day_obj <= window_start + timedelta(days=PRAYER_PREFETCH_DAYS + 1):
+            request_prayer_prefetch()
+        # Dates outside the prefetch window, or a location the prefetcher hasn't
+        # reached yet, are calculated locally rather than left blank.
+        try:
+            return calculate_prayer_timings(day_obj, 1, lat_key, lon_key, method)[day_obj.isoformat()]
+        except ValueError as exc:
+            raise LookupError(f'No cached prayer timings for {day_obj.isoformat()} ({lat_key}, {lon_key}, method {method}): {exc}')
+    return {
+        'Fajr': row['fajr'],
+        'Dhuhr': row['dhuhr'],
+        'Asr': row['asr'],
+        'Maghrib': row['maghrib'],
+        'Isha': row['isha'],
     }
-    _PRAYER_CACHE[cache_key] = result
-    return result
+
+def get_prayer_prefetch_targets(conn):
+    rows = conn.execute('''
+        SELECT setting_key, setting_value FROM app_settings
+        WHERE setting_key IN ('notif_latitude', 'notif_longitude', 'notif_prayer_method')
+    ''').fetchall()
+    values = {row['setting_key']: (row['setting_value'] or '').strip() for row in rows}
+    if not values.get('notif_latitude') or not values.get('notif_longitude'):
+        return []
+    try:
+        lat_key, lon_key = normalize_prayer_location(values['notif_latitude'], values['notif_longitude'])
+    except ValueError:
+        return []
+    methods = set(DEEN_PRAYER_METHODS)
+    method_value = values.get('notif_prayer_method') or '4'
+    if method_value.isdigit():
+        methods.add(int(method_value))
+    return [(lat_key, lon_key, method) for method in sorted(methods)]
+
+def prefetch_prayer_times(days=None, today=None):
+    days = days or PRAYER_PREFETCH_DAYS
+    window_start = (today or date.today()) - timedelta(days=1)
+    window_end = window_start + timedelta(days=days + 1)
+    fetcher = get_prayer_timings_fetcher()
+    source = _PRAYER_PREFETCH['backend']
+    stored = 0
+    conn = get_db()
+    try:
+        for lat_key, lon_key, method in get_prayer_prefetch_targets(conn):
+            existing = {
+                row['prayer_date'] for row in conn.execute('''
+                    SELECT prayer_date FROM prayer_times
+                    WHERE latitude=? AND longitude=? AND method=? AND prayer_date BETWEEN ? AND ?
+                ''', (lat_key, lon_key, method, window_start.isoformat(), window_end.isoformat())).fetchall()
+            }
+            missing = [
+                window_start + timedelta(days=i)
+                for i in range((window_end - window_start).days + 1)
+                if (window_start + timedelta(days=i)).isoformat() not in existing
+            ]
+            if not missing:
+                continue
+            timings_by_date = fetcher(missing[0], (missing[-1] - missing[0]).days + 1, lat_key, lon_key, method)
+            store_prayer_timings(conn, lat_key, lon_key, method, timings_by_date, source)
+            invalidate_notification_queue(conn)
+            conn.commit()
+            stored += len(timings_by_date)
+        conn.execute('DELETE FROM prayer_times WHERE prayer_date < ?', ((window_start - timedelta(days=30)).isoformat(),))
+        conn.commit()
+    finally:
+        conn.close()
+    return stored
+
+def _prayer_prefetch_loop():
+    while True:
+        _PRAYER_PREFETCH['wake'].clear()
+        try:
+            prefetch_prayer_times()
+            _PRAYER_PREFETCH['last_error'] = None
+        except Exception as exc:
+            _PRAYER_PREFETCH['last_error'] = str(exc)
+        _PRAYER_PREFETCH['last_run'] = datetime.now()
+        if _PRAYER_PREFETCH['last_error']:
+            # Don't let cache misses on every page load hammer an unreachable upstream.
+            time.sleep(PRAYER_PREFETCH_RETRY_SECONDS)
+        _PRAYER_PREFETCH['wake'].wait(PRAYER_PREFETCH_INTERVAL_SECONDS)
+
+def start_prayer_prefetcher():
+    with _PRAYER_PREFETCH['lock']:
+        thread = _PRAYER_PREFETCH['thread']
+        if thread and thread.is_alive():
+            return
+        thread = threading.Thread(target=_prayer_prefetch_loop, name='prayer-prefetch', daemon=True)
+        _PRAYER_PREFETCH['thread'] = thread
+        thread.start()
+
+def request_prayer_prefetch():
+    start_prayer_prefetcher()
+    _PRAYER_PREFETCH['wake'].set()
+
+# ===== DATABASE SNAPSHOTS =====
+_DB_SNAPSHOTS = {
+    'thread': None,
+    'lock': threading.Lock(),
+    'last_run': None,
+    'last_path': None,
+    'last_error': None,
+}
+
+def _snapshot_loop():
+    while True:
+        try:
+            path = take_scheduled_snapshot()
+            if path:
+                _DB_SNAPSHOTS['last_path'] = path
+            _DB_SNAPSHOTS['last_error'] = None
+        except Exception as exc:
+            _DB_SNAPSHOTS['last_error'] = str(exc)
+        _DB_SNAPSHOTS['last_run'] = datetime.now()
+        # Re-check at least hourly; the age check keeps restarts from resetting the schedule.
+        time.sleep(min(SNAPSHOT_INTERVAL_SECONDS, 3600))
+
+def start_snapshot_scheduler():
+    with _DB_SNAPSHOTS['lock']:
+        thread = _DB_SNAPSHOTS['thread']
+        if thread and thread.is_alive():
+            return
+        thread = threading.Thread(target=_snapshot_loop, name='db-snapshots', daemon=True)
+        _DB_SNAPSHOTS['thread'] = thread
+        thread.start()
 
 def build_deen_prayer_times(day_obj, latitude, longitude):
     # Deen page uses a dedicated practical setup:
@@ -229,9 +896,149 @@ def build_deen_prayer_times(day_obj, latitude, longitude):
         'isha': isha_value,
     }
 
+# ===== NOTIFICATION QUEUE =====
+# Reminders are materialized into notification_queue by the write paths that
+# affect them; rendering only reads the next window. Water and prayer rows
+# belong to a single day, so the whole queue is rebuilt once per day (or when
+# settings/prayer timings change) via notification_queue_builds.
+NOTIFICATION_SOURCE_SETTINGS = [
+    ('water', 'notif_water_hourly'),
+    ('prayer_start', 'notif_prayer_before_start'),
+    ('prayer_end', 'notif_prayer_before_end'),
+    ('todo', 'notif_todos_upcoming'),
+    ('date', 'notif_special_dates'),
+]
+
+def _queue_notification(conn, source_type, source_key, item_type, title, message, link, notify_at, queue_date=None, source_id=None):
+    conn.execute('''
+        INSERT OR REPLACE INTO notification_queue
+            (source_type, source_key, source_id, queue_date, item_type, title, message, link, notify_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (source_type, source_key, source_id, queue_date, item_type, title, message, link,
+          notify_at.strftime('%Y-%m-%d %H:%M:%S')))
+
+def sync_water_notifications(conn, log_date):
+    conn.execute("DELETE FROM notification_queue WHERE source_type='water' AND queue_date=?", (log_date,))
+    day = datetime.strptime(log_date, '%Y-%m-%d').date()
+    rows = conn.execute(
+        'SELECT hour_label, slot_index, target_ml FROM water_hourly WHERE log_date=? AND completed=0',
+        (log_date,)
+    ).fetchall()
+    for row in rows:
+        _queue_notification(
+            conn, 'water', f"{log_date}#{row['slot_index']}#{row['hour_label']}", 'water',
+            'Water reminder', f"Drink {row['target_ml']}ml ({row['hour_label']})", '/water',
+            combine_date_and_time(day, row['hour_label']), queue_date=log_date,
+        )
+
+def sync_prayer_notifications(conn, settings, day_obj=None):
+    day_obj = day_obj or date.today()
+    day_iso = day_obj.isoformat()
+    conn.execute("DELETE FROM notification_queue WHERE source_type IN ('prayer_start', 'prayer_end') AND queue_date=?", (day_iso,))
+    latitude = (settings.get('notif_latitude') or '').strip()
+    longitude = (settings.get('notif_longitude') or '').strip()
+    if not latitude or not longitude:
+        return
+    try:
+        method = int(settings.get('notif_prayer_method', '4') or '4')
+        todays = fetch_prayer_timings(day_obj, latitude, longitude, method)
+        tomorrow = fetch_prayer_timings(day_obj + timedelta(days=1), latitude, longitude, method)
+        prayer_starts = {name: combine_date_and_time(day_obj, todays[name]) for name in PRAYER_NAMES}
+        prayer_ends = {
+            'Fajr': prayer_starts['Dhuhr'],
+            'Dhuhr': prayer_starts['Asr'],
+            'Asr': prayer_starts['Maghrib'],
+            'Maghrib': prayer_starts['Isha'],
+            'Isha': combine_date_and_time(day_obj + timedelta(days=1), tomorrow['Fajr'])
+        }
+    except Exception:
+        return
+    prayer_log = conn.execute('SELECT * FROM prayer_logs WHERE prayer_date=?', (day_iso,)).fetchone()
+    for prayer_name in PRAYER_NAMES:
+        if prayer_log and prayer_log[prayer_name.lower()]:
+            continue
+        _queue_notification(
+            conn, 'prayer_start', f'{day_iso}#{prayer_name}', 'prayer',
+            f'{prayer_name} starts soon', f'10 minutes until {prayer_name}', '/deen',
+            prayer_starts[prayer_name] - timedelta(minutes=10), queue_date=day_iso,
+        )
+        _queue_notification(
+            conn, 'prayer_end', f'{day_iso}#{prayer_name}', 'prayer',
+            f'{prayer_name} window ending soon', f'15 minutes left before {prayer_name} time ends', '/deen',
+            prayer_ends[prayer_name] - timedelta(minutes=15), queue_date=day_iso,
+        )
+
+def sync_todo_notifications(conn, todo_ids=None):
+    if todo_ids is None:
+        conn.execute("DELETE FROM notification_queue WHERE source_type='todo'")
+        rows = conn.execute(
+            'SELECT id, title, due_date, due_time FROM todos WHERE status != "completed" AND due_date IS NOT NULL'
+        ).fetchall()
+    else:
+        todo_ids = [int(tid) for tid in todo_ids]
+        if not todo_ids:
+            return
+        placeholders = ','.join('?' for _ in todo_ids)
+        conn.execute(f"DELETE FROM notification_queue WHERE source_type='todo' AND source_id IN ({placeholders})", todo_ids)
+        rows = conn.execute(
+            f'SELECT id, title, due_date, due_time FROM todos WHERE id IN ({placeholders}) AND status != "completed" AND due_date IS NOT NULL',
+            todo_ids
+        ).fetchall()
+    for row in rows:
+        try:
+            due_dt = combine_date_and_time(datetime.strptime(row['due_date'], '%Y-%m-%d').date(), row['due_time'] or '09:00')
+        except ValueError:
+            continue
+        _queue_notification(
+            conn, 'todo', str(row['id']), 'todo',
+            'Upcoming todo', f"{row['title']} due at {due_dt.strftime('%H:%M')} on {row['due_date']}", '/todos',
+            due_dt, source_id=row['id'],
+        )
+
+def prune_todo_notifications(conn):
+    conn.execute("DELETE FROM notification_queue WHERE source_type='todo' AND source_id NOT IN (SELECT id FROM todos)")
+
+def sync_date_notifications(conn, date_ids=None):
+    if date_ids is None:
+        conn.execute("DELETE FROM notification_queue WHERE source_type='date'")
+        rows = conn.execute(
+            'SELECT id, title, event_date FROM important_dates WHERE event_date >= date("now", "-1 day")'
+        ).fetchall()
+    else:
+        date_ids = [int(did) for did in date_ids]
+        if not date_ids:
+            return
+        placeholders = ','.join('?' for _ in date_ids)
+        conn.execute(f"DELETE FROM notification_queue WHERE source_type='date' AND source_id IN ({placeholders})", date_ids)
+        rows = conn.execute(
+            f'SELECT id, title, event_date FROM important_dates WHERE id IN ({placeholders})',
+            date_ids
+        ).fetchall()
+    for row in rows:
+        try:
+            event_day = datetime.strptime(row['event_date'], '%Y-%m-%d').date()
+        except ValueError:
+            continue
+        _queue_notification(
+            conn, 'date', str(row['id']), 'date',
+            'Special date reminder', f"{row['title']} is tomorrow", '/important-dates',
+            datetime(event_day.year, event_day.month, event_day.day) - timedelta(hours=24), source_id=row['id'],
+        )
+
+def rebuild_notification_queue(conn, settings):
+    today_iso = date.today().isoformat()
+    conn.execute('DELETE FROM notification_queue')
+    sync_water_notifications(conn, today_iso)
+    sync_prayer_notifications(conn, settings)
+    sync_todo_notifications(conn)
+    sync_date_notifications(conn)
+    conn.execute('DELETE FROM notification_queue_builds')
+    conn.execute('INSERT OR REPLACE INTO notification_queue_builds (queue_date, built_at) VALUES (?, CURRENT_TIMESTAMP)', (today_iso,))
+
+def invalidate_notification_queue(conn):
+    conn.execute('DELETE FROM notification_queue_builds')
+
 def build_notifications_context(settings):
-    notifications = []
-    now = datetime.now()
     enabled = setting_is_true(settings, 'notif_enabled', 'true')
     if not enabled:
         return {
@@ -241,128 +1048,46 @@ def build_notifications_context(settings):
             'notifications_settings': settings,
         }
 
+    now = datetime.now()
+    today_iso = date.today().isoformat()
     conn = get_db()
+    if not conn.execute('SELECT 1 FROM notification_queue_builds WHERE queue_date=?', (today_iso,)).fetchone():
+        rebuild_notification_queue(conn, settings)
+        conn.commit()
 
-    # Water reminders every scheduled slot, upcoming over next 24h.
-    if setting_is_true(settings, 'notif_water_hourly', 'true'):
-        today = date.today().isoformat()
-        water_rows = conn.execute(
-            'SELECT hour_label, target_ml, completed FROM water_hourly WHERE log_date=? ORDER BY slot_index, hour_label',
-            (today,)
-        ).fetchall()
-        for row in water_rows:
-            if row['completed']:
-                continue
-            slot_dt = combine_date_and_time(date.today(), row['hour_label'])
-            if slot_dt < now - timedelta(minutes=5):
-                continue
-            if slot_dt > now + timedelta(hours=24):
-                continue
-            notifications.append({
-                'type': 'water',
-                'title': 'Water reminder',
-                'message': f"Drink {row['target_ml']}ml ({row['hour_label']})",
-                'at': slot_dt,
-                'link': '/water'
+    source_types = [source for source, key in NOTIFICATION_SOURCE_SETTINGS if setting_is_true(settings, key, 'true')]
+    items = []
+    unread_count = 0
+    if source_types:
+        placeholders = ','.join('?' for _ in source_types)
+        window = (
+            (now - timedelta(minutes=5)).strftime('%Y-%m-%d %H:%M:%S'),
+            (now + timedelta(hours=24)).strftime('%Y-%m-%d %H:%M:%S'),
+        )
+        rows = conn.execute(f'''
+            SELECT item_type, title, message, link, notify_at FROM notification_queue
+            WHERE source_type IN ({placeholders}) AND notify_at BETWEEN ? AND ?
+            ORDER BY notify_at, id LIMIT 30
+        ''', (*source_types, *window)).fetchall()
+        unread_count = conn.execute(f'''
+            SELECT COUNT(*) FROM notification_queue
+            WHERE source_type IN ({placeholders}) AND notify_at BETWEEN ? AND ?
+        ''', (*source_types, window[0], (now + timedelta(minutes=15)).strftime('%Y-%m-%d %H:%M:%S'))).fetchone()[0]
+        for row in rows:
+            at = datetime.strptime(row['notify_at'], '%Y-%m-%d %H:%M:%S')
+            items.append({
+                'type': row['item_type'],
+                'title': row['title'],
+                'message': row['message'],
+                'at': at,
+                'at_text': at.strftime('%Y-%m-%d %H:%M'),
+                'link': row['link'],
             })
-
-    # Prayer reminders from location-based prayer API.
-    latitude = settings.get('notif_latitude', '').strip()
-    longitude = settings.get('notif_longitude', '').strip()
-    if latitude and longitude and (
-        setting_is_true(settings, 'notif_prayer_before_start', 'true')
-        or setting_is_true(settings, 'notif_prayer_before_end', 'true')
-    ):
-        try:
-            method = int(settings.get('notif_prayer_method', '4') or '4')
-            todays = fetch_prayer_timings(date.today(), latitude, longitude, method)
-            tomorrow = fetch_prayer_timings(date.today() + timedelta(days=1), latitude, longitude, method)
-            prayer_order = ['Fajr', 'Dhuhr', 'Asr', 'Maghrib', 'Isha']
-            prayer_starts = {name: combine_date_and_time(date.today(), todays[name]) for name in prayer_order}
-            prayer_ends = {
-                'Fajr': prayer_starts['Dhuhr'],
-                'Dhuhr': prayer_starts['Asr'],
-                'Asr': prayer_starts['Maghrib'],
-                'Maghrib': prayer_starts['Isha'],
-                'Isha': combine_date_and_time(date.today() + timedelta(days=1), tomorrow['Fajr'])
-            }
-            prayer_log = conn.execute('SELECT * FROM prayer_logs WHERE prayer_date=?', (date.today().isoformat(),)).fetchone()
-            completed_map = {
-                'Fajr': bool(prayer_log['fajr']) if prayer_log else False,
-                'Dhuhr': bool(prayer_log['dhuhr']) if prayer_log else False,
-                'Asr': bool(prayer_log['asr']) if prayer_log else False,
-                'Maghrib': bool(prayer_log['maghrib']) if prayer_log else False,
-                'Isha': bool(prayer_log['isha']) if prayer_log else False,
-            }
-
-            for prayer_name in prayer_order:
-                if completed_map[prayer_name]:
-                    continue
-                if setting_is_true(settings, 'notif_prayer_before_start', 'true'):
-                    start_notify = prayer_starts[prayer_name] - timedelta(minutes=10)
-                    if now - timedelta(minutes=5) <= start_notify <= now + timedelta(hours=24):
-                        notifications.append({
-                            'type': 'prayer',
-                            'title': f'{prayer_name} starts soon',
-                            'message': f'10 minutes until {prayer_name}',
-                            'at': start_notify,
-                            'link': '/deen'
-                        })
-                if setting_is_true(settings, 'notif_prayer_before_end', 'true'):
-                    end_notify = prayer_ends[prayer_name] - timedelta(minutes=15)
-                    if now - timedelta(minutes=5) <= end_notify <= now + timedelta(hours=24):
-                        notifications.append({
-                            'type': 'prayer',
-                            'title': f'{prayer_name} window ending soon',
-                            'message': f'15 minutes left before {prayer_name} time ends',
-                            'at': end_notify,
-                            'link': '/deen'
-                        })
-        except Exception:
-            pass
-
-    if setting_is_true(settings, 'notif_todos_upcoming', 'true'):
-        todo_rows = conn.execute(
-            'SELECT id, title, due_date, due_time FROM todos WHERE status != "completed" AND due_date IS NOT NULL ORDER BY due_date, due_time'
-        ).fetchall()
-        for row in todo_rows:
-            due_time = row['due_time'] if row['due_time'] else '09:00'
-            due_dt = combine_date_and_time(datetime.strptime(row['due_date'], '%Y-%m-%d').date(), due_time)
-            if now - timedelta(minutes=5) <= due_dt <= now + timedelta(hours=24):
-                notifications.append({
-                    'type': 'todo',
-                    'title': 'Upcoming todo',
-                    'message': f"{row['title']} due at {due_dt.strftime('%H:%M')} on {row['due_date']}",
-                    'at': due_dt,
-                    'link': '/todos'
-                })
-
-    if setting_is_true(settings, 'notif_special_dates', 'true'):
-        date_rows = conn.execute(
-            'SELECT title, event_date, event_type FROM important_dates WHERE event_date >= date("now", "-1 day") ORDER BY event_date LIMIT 60'
-        ).fetchall()
-        for row in date_rows:
-            event_day = datetime.strptime(row['event_date'], '%Y-%m-%d').date()
-            reminder_dt = datetime(event_day.year, event_day.month, event_day.day) - timedelta(hours=24)
-            if now - timedelta(minutes=5) <= reminder_dt <= now + timedelta(hours=24):
-                notifications.append({
-                    'type': 'date',
-                    'title': 'Special date reminder',
-                    'message': f"{row['title']} is tomorrow",
-                    'at': reminder_dt,
-                    'link': '/important-dates'
-                })
-
     conn.close()
 
-    notifications.sort(key=lambda item: item['at'])
-    unread_count = sum(1 for item in notifications if item['at'] <= now + timedelta(minutes=15))
-    for item in notifications:
-        item['at_text'] = item['at'].strftime('%Y-%m-%d %H:%M')
-
     return {
         'notifications_enabled': True,
-        'notifications_items': notifications[:30],
+        'notifications_items': items,
         'notifications_unread_count': unread_count,
         'notifications_settings': settings,
     }
@@ -378,6 +1103,76 @@ def is_habit_due_on(habit, day_obj):
     }
     return bool(configured & day_tokens)
 
+HABIT_ALL_DAYS_MASK = 0b1111111
+
+def habit_due_mask(habit):
+    # Bit n set = due on weekday n (Mon=0). Same token rules as is_habit_due_on.
+    if habit['frequency_type'] != 'specific_days' or not habit['days_of_week']:
+        return HABIT_ALL_DAYS_MASK
+    configured = {token.strip().lower() for token in habit['days_of_week'].split(',') if token.strip()}
+    mask = 0
+    for weekday in range(7):
+        sample = date(2024, 1, 1) + timedelta(days=weekday)
+        if configured & {str(weekday), sample.strftime('%a').lower(), sample.strftime('%A').lower()}:
+            mask |= 1 << weekday
+    return mask
+
+def _habit_due_by_mask(mask, day_obj):
+    return bool(mask >> day_obj.weekday() & 1)
+
+def recompute_habit_streak(conn, habit):
+    mask = habit_due_mask(habit)
+    today = date.today()
+    completed_dates = {
+        row['log_date'] for row in conn.execute(
+            'SELECT log_date FROM habit_logs WHERE habit_id=? AND completed=1 AND log_date <= ?',
+            (habit['id'], today.isoformat())
+        ).fetchall()
+    }
+    streak = 0
+    end_day = None
+    if mask:
+        for day_iso in sorted(completed_dates, reverse=True):
+            day_obj = datetime.strptime(day_iso, '%Y-%m-%d').date()
+            if _habit_due_by_mask(mask, day_obj):
+                end_day = day_obj
+                break
+        cursor = end_day
+        while cursor and cursor.isoformat() in completed_dates:
+            streak += 1
+            cursor -= timedelta(days=1)
+            while not _habit_due_by_mask(mask, cursor):
+                cursor -= timedelta(days=1)
+    row = {
+        'habit_id': habit['id'],
+        'current_streak': streak,
+        'streak_end_date': end_day.isoformat() if end_day else None,
+        'due_mask': mask,
+    }
+    conn.execute('''
+        INSERT OR REPLACE INTO habit_streaks (habit_id, current_streak, streak_end_date, due_mask, updated_at)
+        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ''', (row['habit_id'], row['current_streak'], row['streak_end_date'], row['due_mask']))
+    return row
+
+def current_habit_streak(streak_row, today_status=None, today=None):
+    # The stored run ends at streak_end_date; it is still live only if no due
+    # day was missed between then and today (today itself may still be open).
+    today = today or date.today()
+    mask = streak_row['due_mask'] if streak_row else 0
+    if not mask or not streak_row['streak_end_date']:
+        return 0
+    if today_status == 0 and _habit_due_by_mask(mask, today):
+        return 0
+    end_day = datetime.strptime(streak_row['streak_end_date'], '%Y-%m-%d').date()
+    gap_days = (today - end_day).days - 1
+    if gap_days >= 7:
+        return 0
+    for offset in range(1, gap_days + 1):
+        if _habit_due_by_mask(mask, end_day + timedelta(days=offset)):
+            return 0
+    return streak_row['current_streak']
+
 def get_wake_time_for_date(conn, log_date):
     sleep_log = conn.execute('SELECT wake_time FROM sleep_logs WHERE sleep_date=?', (log_date,)).fetchone()
     if sleep_log and sleep_log['wake_time']:
@@ -387,10 +1182,25 @@ def get_wake_time_for_date(conn, log_date):
 
 @app.context_processor
 def inject_settings():
-    settings = get_settings()
-    context = {'app_settings': settings, 'today_iso': date.today().isoformat()}
-    context.update(build_notifications_context(settings))
-    return context
+    return {'app_settings': get_settings(), 'today_iso': date.today().isoformat()}
+
+@app.route('/api/notifications')
+def api_notifications():
+    context = build_notifications_context(get_settings())
+    response = jsonify({
+        'enabled': context['notifications_enabled'],
+        'unread_count': context['notifications_unread_count'],
+        'items': [{
+            'type': item['type'],
+            'title': item['title'],
+            'message': item['message'],
+            'link': item['link'],
+            'at_text': item['at_text'],
+        } for item in context['notifications_items']],
+    })
+    response.headers['Cache-Control'] = 'no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
 
 def build_dashboard_payload():
     conn = get_db()
@@ -465,55 +1275,93 @@ def build_dashboard_payload():
         'recent_journal': recent_journal,
     }
 
-def build_weekly_review_payload():
+def count_weekdays_in_range(start_day, end_day):
+    # How many times each weekday (Mon=0) occurs in [start_day, end_day].
+    total_days = (end_day - start_day).days + 1
+    counts = [total_days // 7] * 7
+    for offset in range(total_days % 7):
+        counts[(start_day.weekday() + offset) % 7] += 1
+    return counts
+
+def build_review_payload(start, end):
     conn = get_db()
-    today = date.today()
-    start = today - timedelta(days=6)
     start_iso = start.isoformat()
-    end_iso = today.isoformat()
+    end_iso = end.isoformat()
 
-    journal_count = conn.execute('SELECT COUNT(*) as c FROM journal_entries WHERE entry_date BETWEEN ? AND ?', (start_iso, end_iso)).fetchone()['c']
-    completed_todos = conn.execute('SELECT COUNT(*) as c FROM todos WHERE completed_at IS NOT NULL AND date(completed_at) BETWEEN ? AND ?', (start_iso, end_iso)).fetchone()['c']
+    totals = conn.execute('''
+        SELECT
+            (SELECT COUNT(*) FROM journal_entries WHERE entry_date BETWEEN :start AND :end) AS journal_count,
+            (SELECT COUNT(*) FROM todos WHERE completed_at IS NOT NULL AND date(completed_at) BETWEEN :start AND :end) AS completed_todos,
+            (SELECT AVG(COALESCE(total_hours, 0)) FROM sleep_logs WHERE sleep_date BETWEEN :start AND :end) AS avg_sleep,
+            (SELECT SUM(step_count) FROM daily_steps WHERE log_date BETWEEN :start AND :end) AS steps_total,
+            (SELECT COUNT(*) FROM water_logs
+                WHERE log_date BETWEEN :start AND :end
+                  AND COALESCE(target_ml, 0) > 0 AND COALESCE(total_ml, 0) >= COALESCE(target_ml, 0)) AS water_goal_days,
+            (SELECT COUNT(*) * 5 FROM prayer_logs WHERE prayer_date BETWEEN :start AND :end) AS prayer_total,
+            (SELECT SUM((COALESCE(fajr, 0) != 0) + (COALESCE(dhuhr, 0) != 0) + (COALESCE(asr, 0) != 0)
+                        + (COALESCE(maghrib, 0) != 0) + (COALESCE(isha, 0) != 0))
+                FROM prayer_logs WHERE prayer_date BETWEEN :start AND :end) AS prayer_done
+    ''', {'start': start_iso, 'end': end_iso}).fetchone()
+
+    # Cardio sessions saved without a duration fall back to their interval sets,
+    # mirroring recompute_cardio_session_metrics without queries per session.
     workout_rows = conn.execute('''
-        SELECT ws.*, wt.name as workout_name, wt.is_cardio
+        WITH interval_seconds AS (
+            SELECT wel.session_id,
+                   SUM(COALESCE(wel.time_seconds, 0)
+                       + CASE WHEN wt.name = 'HIIT Cardio' THEN CAST(COALESCE(wel.incline, 0) AS INTEGER) ELSE 0 END) AS seconds
+            FROM workout_exercise_logs wel
+            JOIN workout_sessions ws ON ws.id = wel.session_id
+            JOIN workout_types wt ON wt.id = ws.workout_type_id
+            WHERE wel.set_type = 'interval' AND ws.session_date BETWEEN :start AND :end
+            GROUP BY wel.session_id
+        )
+        SELECT ws.id, wt.is_cardio, ws.duration_minutes, iv.seconds AS interval_seconds
         FROM workout_sessions ws
         JOIN workout_types wt ON wt.id = ws.workout_type_id
-        WHERE ws.session_date BETWEEN ? AND ?
-        ORDER BY ws.session_date DESC
-    ''', (start_iso, end_iso)).fetchall()
-    profile = conn.execute('SELECT * FROM user_profile WHERE id=1').fetchone()
-    hydrated_workouts = [hydrate_cardio_session_metrics(conn, row, profile=profile, persist=False) for row in workout_rows]
-    workouts_count = len(hydrated_workouts)
-    cardio_minutes = sum(float(row.get('duration_minutes') or 0) for row in hydrated_workouts if row.get('is_cardio'))
-
-    sleep_logs = conn.execute('SELECT total_hours FROM sleep_logs WHERE sleep_date BETWEEN ? AND ?', (start_iso, end_iso)).fetchall()
-    avg_sleep = round(sum(float(row['total_hours'] or 0) for row in sleep_logs) / len(sleep_logs), 1) if sleep_logs else 0
-
-    steps_total = conn.execute('SELECT SUM(step_count) as total FROM daily_steps WHERE log_date BETWEEN ? AND ?', (start_iso, end_iso)).fetchone()['total'] or 0
-
-    water_logs = conn.execute('SELECT log_date, target_ml, total_ml FROM water_logs WHERE log_date BETWEEN ? AND ?', (start_iso, end_iso)).fetchall()
-    water_goal_days = sum(1 for row in water_logs if (row['total_ml'] or 0) >= (row['target_ml'] or 0) and (row['target_ml'] or 0) > 0)
-
-    prayer_logs = conn.execute('SELECT fajr, dhuhr, asr, maghrib, isha FROM prayer_logs WHERE prayer_date BETWEEN ? AND ?', (start_iso, end_iso)).fetchall()
-    prayer_total = len(prayer_logs) * 5
-    prayer_done = 0
-    for row in prayer_logs:
-        prayer_done += sum(1 for key in ['fajr', 'dhuhr', 'asr', 'maghrib', 'isha'] if row[key])
-    prayer_rate = round((prayer_done / prayer_total) * 100, 1) if prayer_total else 0
+        LEFT JOIN interval_seconds iv ON iv.session_id = ws.id
+        WHERE ws.session_date BETWEEN :start AND :end
+    ''', {'start': start_iso, 'end': end_iso}).fetchall()
 
     habit_rows = conn.execute('SELECT * FROM habits WHERE is_active=1').fetchall()
-    habit_due = 0
-    habit_done = 0
-    current_day = start
-    while current_day <= today:
-        day_logs = conn.execute('SELECT habit_id, completed FROM habit_logs WHERE log_date=?', (current_day.isoformat(),)).fetchall()
-        day_map = {row['habit_id']: row['completed'] for row in day_logs}
-        for habit in habit_rows:
-            if is_habit_due_on(habit, current_day):
-                habit_due += 1
-                if day_map.get(habit['id']) == 1:
-                    habit_done += 1
-        current_day += timedelta(days=1)
+    habit_done_rows = conn.execute('''
+        SELECT hl.habit_id, (CAST(strftime('%w', hl.log_date) AS INTEGER) + 6) % 7 AS weekday, COUNT(*) AS done
+        FROM habit_logs hl
+        JOIN habits h ON h.id = hl.habit_id
+        WHERE h.is_active=1 AND hl.completed=1 AND hl.log_date BETWEEN ? AND ?
+        GROUP BY hl.habit_id, weekday
+    ''', (start_iso, end_iso)).fetchall()
+    conn.close()
+
+    journal_count = totals['journal_count']
+    completed_todos = totals['completed_todos']
+    avg_sleep = round(totals['avg_sleep'], 1) if totals['avg_sleep'] is not None else 0
+    steps_total = totals['steps_total'] or 0
+    water_goal_days = totals['water_goal_days']
+    prayer_total = totals['prayer_total']
+    prayer_rate = round(((totals['prayer_done'] or 0) / prayer_total) * 100, 1) if prayer_total else 0
+    workouts_count = len(workout_rows)
+    cardio_minutes = 0.0
+    for row in workout_rows:
+        if not row['is_cardio']:
+            continue
+        if row['duration_minutes'] not in (None, 0, 0.0):
+            cardio_minutes += float(row['duration_minutes'])
+        elif row['interval_seconds']:
+            cardio_minutes += round(row['interval_seconds'] / 60, 1)
+
+    weekday_counts = count_weekdays_in_range(start, end)
+    habit_masks = {habit['id']: habit_due_mask(habit) for habit in habit_rows}
+    habit_due = sum(
+        weekday_counts[weekday]
+        for mask in habit_masks.values()
+        for weekday in range(7)
+        if mask >> weekday & 1
+    )
+    habit_done = sum(
+        row['done'] for row in habit_done_rows
+        if habit_masks.get(row['habit_id'], 0) >> row['weekday'] & 1
+    )
     habit_rate = round((habit_done / habit_due) * 100, 1) if habit_due else 0
 
     wins = []
@@ -548,7 +1396,6 @@ def build_weekly_review_payload():
     if cardio_minutes < 90:
         next_steps.append('Schedule fixed cardio blocks before the week starts')
 
-    conn.close()
     return {
         'start_date': start_iso,
         'end_date': end_iso,
@@ -566,6 +1413,10 @@ def build_weekly_review_payload():
         'next_steps': next_steps,
     }
 
+def build_weekly_review_payload():
+    today = date.today()
+    return build_review_payload(today - timedelta(days=6), today)
+
 def get_streak(conn, table, date_col, check_func=None):
     streak = 0
     d = date.today()
@@ -596,6 +1447,183 @@ def is_better_strength_set(candidate, current):
         return candidate_weight > current_weight
     return int(candidate['reps'] or 0) > int(current['reps'] or 0)
 
+# exercise_session_best keeps one row per (exercise, session): the heaviest
+# working set (progress series) and the best Epley estimate (strength standards).
+# exercise_pr_sets keeps each set that beat the session's running best 1RM,
+# which is every set that can become an all-time PR on the timeline.
+def _store_exercise_session_best(conn, set_rows):
+    bests = {}
+    pr_sets = []
+    for row in set_rows:
+        key = (row['exercise_id'], row['session_id'])
+        entry = bests.setdefault(key, {'session_date': row['session_date'], 'best': None, 'max_one_rm': None, 'max_epley_one_rm': None})
+        if is_better_strength_set(row, entry['best']):
+            entry['best'] = row
+        reps = int(row['reps'] or 0)
+        if reps > 0:
+            one_rm = round(calc_1rm(float(row['weight_kg']), reps), 1)
+            if entry['max_one_rm'] is None or one_rm > entry['max_one_rm']:
+                entry['max_one_rm'] = one_rm
+                pr_sets.append((row['log_id'], row['exercise_id'], row['session_id'], row['session_date'], one_rm, float(row['weight_kg']), reps))
+            if entry['max_epley_one_rm'] is None or row['epley_one_rm'] > entry['max_epley_one_rm']:
+                entry['max_epley_one_rm'] = row['epley_one_rm']
+    conn.executemany('''
+        INSERT OR REPLACE INTO exercise_session_best (
+            exercise_id, session_id, session_date, best_weight_kg, best_reps, best_one_rm, max_epley_one_rm
+        ) VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [
+        (
+            exercise_id, session_id, entry['session_date'],
+            float(entry['best']['weight_kg']),
+            entry['best']['reps'],
+            round(calc_1rm(float(entry['best']['weight_kg']), int(entry['best']['reps'])), 1) if entry['best']['reps'] else None,
+            entry['max_epley_one_rm'],
+        )
+        for (exercise_id, session_id), entry in bests.items()
+    ])
+    conn.executemany('''
+        INSERT OR REPLACE INTO exercise_pr_sets (log_id, exercise_id, session_id, session_date, one_rm, weight_kg, reps)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', pr_sets)
+
+# epley_one_rm is the strength standards' historical formula, kept in SQL so
+# the stored values round exactly as the old per-lift queries did.
+EXERCISE_SESSION_BEST_SETS_SQL = '''
+    SELECT wel.id AS log_id, wel.session_id, wel.exercise_id, ws.session_date, wel.weight_kg, wel.reps,
+           ROUND(wel.weight_kg * (1 + wel.reps / 30.0), 1) AS epley_one_rm
+    FROM workout_exercise_logs wel
+    JOIN workout_sessions ws ON ws.id = wel.session_id
+    JOIN exercises e ON e.id = wel.exercise_id
+    WHERE e.is_cardio=0 AND wel.set_type='working' AND wel.weight_kg > 0
+'''
+
+def refresh_exercise_session_best(conn, session_ids):
+    session_ids = [int(session_id) for session_id in session_ids]
+    if not session_ids:
+        return
+    placeholders = ','.join('?' for _ in session_ids)
+    conn.execute(f'DELETE FROM exercise_session_best WHERE session_id IN ({placeholders})', session_ids)
+    conn.execute(f'DELETE FROM exercise_pr_sets WHERE session_id IN ({placeholders})', session_ids)
+    set_rows = conn.execute(
+        EXERCISE_SESSION_BEST_SETS_SQL + f' AND wel.session_id IN ({placeholders}) ORDER BY wel.session_id, wel.id',
+        session_ids
+    ).fetchall()
+    _store_exercise_session_best(conn, set_rows)
+
+def rebuild_exercise_session_best(conn):
+    conn.execute('DELETE FROM exercise_session_best')
+    conn.execute('DELETE FROM exercise_pr_sets')
+    _store_exercise_session_best(conn, conn.execute(EXERCISE_SESSION_BEST_SETS_SQL + ' ORDER BY wel.session_id, wel.id').fetchall())
+    bump_cache_version(conn, 'exercise_session_best')
+
+def ensure_exercise_session_best(conn):
+    if not get_cache_version(conn, 'exercise_session_best'):
+        rebuild_exercise_session_best(conn)
+        conn.commit()
+
+# exercise_last_performance holds, per normalized exercise name, the log row the
+# session form shows as "last time": the latest interval set (cardio) and the best
+# working set from the most recent session date (strength).
+def refresh_exercise_last_performance(conn, name_keys=None):
+    name_filter = ''
+    params = []
+    if name_keys is None:
+        conn.execute('DELETE FROM exercise_last_performance')
+    else:
+        params = sorted({key for key in name_keys if key})
+        if not params:
+            return
+        placeholders = ','.join('?' for _ in params)
+        name_filter = f' AND e.name_key IN ({placeholders})'
+        conn.execute(f'DELETE FROM exercise_last_performance WHERE name_key IN ({placeholders})', params)
+
+    latest = {}
+    interval_rows = conn.execute(f'''
+        SELECT e.name_key, wel.id, ws.session_date
+        FROM workout_exercise_logs wel
+        JOIN exercises e ON e.id = wel.exercise_id
+        JOIN workout_sessions ws ON ws.id = wel.session_id
+        WHERE wel.set_type='interval'{name_filter}
+        ORDER BY e.name_key, ws.session_date DESC, wel.id DESC
+    ''', params).fetchall()
+    for row in interval_rows:
+        latest.setdefault((row['name_key'], 'interval'), row)
+
+    working_rows = conn.execute(f'''
+        SELECT e.name_key, wel.id, ws.session_date, wel.weight_kg, wel.reps
+        FROM workout_exercise_logs wel
+        JOIN exercises e ON e.id = wel.exercise_id
+        JOIN workout_sessions ws ON ws.id = wel.session_id
+        JOIN (
+            SELECT e.name_key, MAX(ws.session_date) AS latest_date
+            FROM workout_exercise_logs wel
+            JOIN exercises e ON e.id = wel.exercise_id
+            JOIN workout_sessions ws ON ws.id = wel.session_id
+            WHERE wel.set_type='working'{name_filter}
+            GROUP BY e.name_key
+        ) last ON last.name_key = e.name_key AND last.latest_date = ws.session_date
+        WHERE wel.set_type='working'
+        ORDER BY e.name_key, wel.id DESC
+    ''', params).fetchall()
+    for row in working_rows:
+        key = (row['name_key'], 'working')
+        if is_better_strength_set(row, latest.get(key)):
+            latest[key] = row
+
+    conn.executemany(
+        'INSERT OR REPLACE INTO exercise_last_performance (name_key, set_type, log_id, session_date, updated_at) VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)',
+        [(name_key, set_type, row['id'], row['session_date']) for (name_key, set_type), row in latest.items()]
+    )
+
+def session_exercise_name_keys(conn, session_ids):
+    session_ids = [int(session_id) for session_id in session_ids]
+    if not session_ids:
+        return []
+    placeholders = ','.join('?' for _ in session_ids)
+    return [row['name_key'] for row in conn.execute(f'''
+        SELECT DISTINCT e.name_key
+        FROM workout_exercise_logs wel
+        JOIN exercises e ON e.id = wel.exercise_id
+        WHERE wel.session_id IN ({placeholders})
+    ''', session_ids).fetchall()]
+
+def rebuild_exercise_last_performance(conn):
+    refresh_exercise_last_performance(conn)
+    bump_cache_version(conn, 'exercise_last_performance')
+
+def ensure_exercise_last_performance(conn):
+    if not get_cache_version(conn, 'exercise_last_performance'):
+        rebuild_exercise_last_performance(conn)
+        conn.commit()
+
+def load_exercise_progress_series(conn):
+    rows = conn.execute('''
+        SELECT esb.exercise_id, e.name, e.muscle_group, esb.session_date, esb.best_weight_kg AS weight_kg, esb.best_reps AS reps, esb.best_one_rm
+        FROM exercise_session_best esb
+        JOIN exercises e ON e.id = esb.exercise_id
+        WHERE e.is_cardio=0
+        ORDER BY esb.exercise_id, esb.session_date, esb.session_id
+    ''').fetchall()
+    best_by_exercise = {}
+    exercise_meta = {}
+    for row in rows:
+        exercise_meta[row['exercise_id']] = row
+        best_logs_by_date = best_by_exercise.setdefault(row['exercise_id'], {})
+        if is_better_strength_set(row, best_logs_by_date.get(row['session_date'])):
+            best_logs_by_date[row['session_date']] = row
+    grouped = {}
+    for exercise_id, best_logs_by_date in best_by_exercise.items():
+        meta = exercise_meta[exercise_id]
+        group = normalize_muscle_group(meta['muscle_group'])
+        if group in {'Uncategorized', 'Core'}:
+            continue
+        grouped.setdefault(group, {})[meta['name']] = [
+            {'date': session_date, '1rm': log['best_one_rm']}
+            for session_date, log in sorted(best_logs_by_date.items())
+            if log['reps']
+        ]
+    return grouped
+
 VALID_MUSCLE_GROUPS = {
     'Chest', 'Back', 'Shoulders', 'Arms', 'Legs', 'Glutes', 'Core', 'Cardio', 'Full Body', 'Uncategorized'
 }
@@ -1081,34 +2109,12 @@ def infer_juz_number_from_reference(surah_number, ayah_number):
     return current
 
 def build_gym_progress_payload(conn):
-    exercises_with_data = conn.execute('''
-        SELECT DISTINCT e.id, e.name, e.workout_type_id, e.muscle_group FROM exercises e
-        JOIN workout_exercise_logs wel ON wel.exercise_id=e.id WHERE e.is_cardio=0
-    ''').fetchall()
-
+    ensure_exercise_session_best(conn)
     grouped_progress_data = {}
-    for ex in exercises_with_data:
-        logs = conn.execute('''
-            SELECT ws.session_date, wel.weight_kg, wel.reps FROM workout_exercise_logs wel
-            JOIN workout_sessions ws ON wel.session_id=ws.id
-            WHERE wel.exercise_id=? AND wel.set_type='working' AND wel.weight_kg > 0
-            ORDER BY ws.session_date
-        ''', (ex['id'],)).fetchall()
-        if logs:
-            best_logs_by_date = {}
-            for log in logs:
-                if is_better_strength_set(log, best_logs_by_date.get(log['session_date'])):
-                    best_logs_by_date[log['session_date']] = log
-            exercise_series = [
-                {'date': session_date, '1rm': round(calc_1rm(log['weight_kg'], log['reps']), 1)}
-                for session_date, log in sorted(best_logs_by_date.items())
-                if log['reps']
-            ]
+    for muscle_group, exercises in load_exercise_progress_series(conn).items():
+        for exercise_name, exercise_series in exercises.items():
             if exercise_series:
-                muscle_group = normalize_muscle_group(ex['muscle_group'])
-                if muscle_group in {'Uncategorized', 'Core'}:
-                    continue
-                grouped_progress_data.setdefault(muscle_group, {})[ex['name']] = exercise_series
+                grouped_progress_data.setdefault(muscle_group, {})[exercise_name] = exercise_series
 
     muscle_group_summaries = []
     for muscle_group, exercises in grouped_progress_data.items():
@@ -1129,7 +2135,7 @@ def build_gym_progress_payload(conn):
 
     # Strength standards: auto-estimated from profile, but overridable manually per exercise.
     profile = conn.execute('SELECT * FROM user_profile WHERE id=1').fetchone()
-    latest_weight_row = conn.execute('SELECT weight_kg FROM body_stats ORDER BY log_date DESC, id DESC LIMIT 1').fetchone()
+    latest_weight_row = latest_weight_entry(load_weight_index(conn))
     body_weight = float(latest_weight_row['weight_kg']) if latest_weight_row and latest_weight_row['weight_kg'] else None
     age = int(profile['age']) if profile and profile['age'] else None
     height_cm = float(profile['height_cm']) if profile and profile['height_cm'] else None
@@ -1225,12 +2231,11 @@ def build_gym_progress_payload(conn):
 
     # PR timeline events (new all-time best 1RM points per exercise).
     pr_rows = conn.execute('''
-        SELECT ws.session_date, e.name as exercise_name, e.muscle_group, wel.weight_kg, wel.reps
-        FROM workout_exercise_logs wel
-        JOIN workout_sessions ws ON ws.id = wel.session_id
-        JOIN exercises e ON e.id = wel.exercise_id
-        WHERE e.is_cardio=0 AND wel.set_type='working' AND wel.weight_kg > 0 AND wel.reps > 0
-        ORDER BY ws.session_date, wel.id
+        SELECT ps.session_date, e.name as exercise_name, e.muscle_group, ps.one_rm, ps.weight_kg, ps.reps
+        FROM exercise_pr_sets ps
+        JOIN exercises e ON e.id = ps.exercise_id
+        WHERE e.is_cardio=0
+        ORDER BY ps.session_date, ps.log_id
     ''').fetchall()
     pr_timeline = []
     best_1rm_by_exercise = {}
@@ -1239,7 +2244,7 @@ def build_gym_progress_payload(conn):
         group = normalize_muscle_group(row['muscle_group'])
         if group in {'Uncategorized', 'Core'}:
             continue
-        one_rm = round(calc_1rm(float(row['weight_kg']), int(row['reps'])), 1)
+        one_rm = row['one_rm']
         previous_best = best_1rm_by_exercise.get(exercise_name)
         if previous_best is None or one_rm > previous_best:
             best_1rm_by_exercise[exercise_name] = one_rm
@@ -1318,15 +2323,18 @@ def build_gym_progress_payload(conn):
         }
         
         strength_standards = {}
+        standard_names = list(standards_benchmarks.keys())
+        best_1rm_by_name = {
+            row['name']: row['one_rm'] for row in conn.execute(f'''
+                SELECT e.name, MAX(esb.max_epley_one_rm) as one_rm
+                FROM exercise_session_best esb
+                JOIN exercises e ON e.id = esb.exercise_id
+                WHERE e.name IN ({','.join('?' for _ in standard_names)})
+                GROUP BY e.name
+            ''', standard_names).fetchall()
+        }
         for exercise_name, multipliers in standards_benchmarks.items():
-            one_rm_row = conn.execute('''
-                SELECT MAX(ROUND(wel.weight_kg * (1 + wel.reps / 30.0), 1)) as one_rm
-                FROM workout_exercise_logs wel
-                JOIN exercises e ON e.id = wel.exercise_id
-                WHERE e.name = ? AND wel.set_type = 'working' AND wel.weight_kg > 0 AND wel.reps > 0
-            ''', (exercise_name,)).fetchone()
-            
-            current_1rm = round(float(one_rm_row['one_rm']), 1) if one_rm_row and one_rm_row['one_rm'] else 0
+            current_1rm = round(float(best_1rm_by_name[exercise_name]), 1) if best_1rm_by_name.get(exercise_name) else 0
             novice_target = round(body_weight * multipliers['novice'], 1)
             intermediate_target = round(body_weight * multipliers['intermediate'], 1)
             advanced_target = round(body_weight * multipliers['advanced'], 1)
@@ -1415,15 +2423,57 @@ def estimate_met_calories(weight_kg, met_value, duration_minutes):
     calories_per_min = (float(met_value) * 3.5 * float(weight_kg)) / 200
     return round(calories_per_min * float(duration_minutes), 1)
 
+# Sorted (log_date -> weight) index over body_stats shared by gym, diet and water.
+# One entry per date, holding the row with the highest id, which is what
+# "ORDER BY log_date DESC, id DESC LIMIT 1" picks. Cached per process and
+# invalidated through cache_versions['body_stats'].
+def load_weight_index(conn):
+    if has_app_context():
+        cached = g.get('_weight_index')
+        if cached is not None:
+            return cached
+    version = get_cache_version(conn, 'body_stats')
+    cached_version, index = _WEIGHT_INDEX_CACHE['snapshot']
+    if index is None or cached_version != version:
+        dates = []
+        weights = []
+        for row in conn.execute('SELECT log_date, weight_kg FROM body_stats ORDER BY log_date, id').fetchall():
+            if dates and dates[-1] == row['log_date']:
+                weights[-1] = row['weight_kg']
+            else:
+                dates.append(row['log_date'])
+                weights.append(row['weight_kg'])
+        index = {'dates': dates, 'weights': weights}
+        _WEIGHT_INDEX_CACHE['snapshot'] = (version, index)
+    if has_app_context():
+        g._weight_index = index
+    return index
+
+def invalidate_weight_index(conn):
+    # Call inside the writing transaction, like invalidate_settings_cache.
+    bump_cache_version(conn, 'body_stats')
+    if has_app_context():
+        g.pop('_weight_index', None)
+
+def weight_as_of(index, target_date):
+    position = bisect_right(index['dates'], target_date)
+    return index['weights'][position - 1] if position else None
+
+def weights_as_of(index, target_dates):
+    return {target_date: weight_as_of(index, target_date) for target_date in target_dates}
+
+def latest_weight_entry(index):
+    if not index['dates']:
+        return None
+    return {'log_date': index['dates'][-1], 'weight_kg': index['weights'][-1]}
+
 def get_effective_weight_for_date(conn, target_date):
-    row = conn.execute(
-        'SELECT weight_kg FROM body_stats WHERE log_date <= ? ORDER BY log_date DESC, id DESC LIMIT 1',
-        (target_date,)
-    ).fetchone()
-    if row and row['weight_kg']:
-        return float(row['weight_kg'])
-    fallback = conn.execute('SELECT weight_kg FROM body_stats ORDER BY log_date DESC, id DESC LIMIT 1').fetchone()
-    return float(fallback['weight_kg']) if fallback and fallback['weight_kg'] else None
+    index = load_weight_index(conn)
+    weight = weight_as_of(index, target_date)
+    if weight:
+        return float(weight)
+    latest = latest_weight_entry(index)
+    return float(latest['weight_kg']) if latest and latest['weight_kg'] else None
 
 def get_diet_settings(conn):
     defaults = {
@@ -1457,6 +2507,55 @@ def get_awake_hours_for_date(conn, target_date, override_value=None):
 
     return 16.0, 'default estimate'
 
+# Resolve "weight on or before" and "awake hours" for a run of dates in one pass:
+# weights come from the shared as-of index, sleep from one query over
+# [start, end]. Semantics match get_effective_weight_for_date and
+# get_awake_hours_for_date exactly.
+def resolve_diet_series(conn, dates, override_value=None):
+    dates = sorted(set(dates))
+    if not dates:
+        return {}
+    start, end = dates[0], dates[-1]
+
+    weight_index = load_weight_index(conn)
+    latest_weight = latest_weight_entry(weight_index)
+    fallback_weight = float(latest_weight['weight_kg']) if latest_weight and latest_weight['weight_kg'] else None
+    day_weights = weights_as_of(weight_index, dates)
+
+    override_hours = None
+    if override_value not in (None, ''):
+        try:
+            override_hours = float(override_value)
+        except (TypeError, ValueError):
+            pass
+    sleep_by_date = {}
+    latest_sleep_awake = None
+    if override_hours is None:
+        sleep_by_date = {
+            row['sleep_date']: row['total_hours']
+            for row in conn.execute(
+                'SELECT sleep_date, total_hours FROM sleep_logs WHERE sleep_date BETWEEN ? AND ?', (start, end)
+            ).fetchall()
+        }
+        latest_sleep = conn.execute('SELECT total_hours FROM sleep_logs ORDER BY sleep_date DESC LIMIT 1').fetchone()
+        if latest_sleep and latest_sleep['total_hours'] is not None:
+            latest_sleep_awake = max(0.0, 24.0 - float(latest_sleep['total_hours']))
+
+    resolved = {}
+    for day in dates:
+        weight = float(day_weights[day]) if day_weights[day] else fallback_weight
+
+        if override_hours is not None:
+            awake = (override_hours, 'manual override')
+        elif sleep_by_date.get(day) is not None:
+            awake = (max(0.0, 24.0 - float(sleep_by_date[day])), 'sleep log')
+        elif latest_sleep_awake is not None:
+            awake = (latest_sleep_awake, 'latest sleep log')
+        else:
+            awake = (16.0, 'default estimate')
+        resolved[day] = {'weight_kg': weight, 'awake_hours': awake[0], 'awake_source': awake[1]}
+    return resolved
+
 def calculate_maintenance_calories(weight_kg, body_fat_pct, awake_hours):
     if not weight_kg:
         return None
@@ -1471,10 +2570,30 @@ def calculate_protein_target(weight_kg):
         return None
     return round(float(weight_kg) * 1.8, 1)
 
-def build_diet_payload(conn, selected_date):
+DIET_CHART_DAY_OPTIONS = (30, 90, 180, 365)
+DIET_CHART_DEFAULT_DAYS = 90
+
+def build_diet_payload(conn, selected_date, chart_days=DIET_CHART_DEFAULT_DAYS):
     settings = get_diet_settings(conn)
-    selected_weight = get_effective_weight_for_date(conn, selected_date)
-    awake_hours, awake_source = get_awake_hours_for_date(conn, selected_date, settings.get('diet_awake_hours_override'))
+    chart_end = datetime.strptime(selected_date, '%Y-%m-%d').date()
+    chart_start = (chart_end - timedelta(days=chart_days - 1)).isoformat()
+    chart_rows = conn.execute('''
+        SELECT log_date,
+               ROUND(SUM(calories), 1) as calories,
+               ROUND(SUM(protein_g), 1) as protein_g
+        FROM diet_food_entries
+        WHERE log_date BETWEEN ? AND ?
+        GROUP BY log_date
+        ORDER BY log_date ASC
+    ''', (chart_start, selected_date)).fetchall()
+    series = resolve_diet_series(
+        conn,
+        [row['log_date'] for row in chart_rows] + [selected_date],
+        settings.get('diet_awake_hours_override')
+    )
+    selected_weight = series[selected_date]['weight_kg']
+    awake_hours = series[selected_date]['awake_hours']
+    awake_source = series[selected_date]['awake_source']
     maintenance_calories = calculate_maintenance_calories(selected_weight, settings.get('diet_body_fat_pct'), awake_hours)
     protein_target = calculate_protein_target(selected_weight)
 
@@ -1507,20 +2626,12 @@ def build_diet_payload(conn, selected_date):
     }
     net_calories = round(daily_totals['calories'] - maintenance_calories, 1) if maintenance_calories is not None else None
 
-    chart_rows = conn.execute('''
-        SELECT log_date,
-               ROUND(SUM(calories), 1) as calories,
-               ROUND(SUM(protein_g), 1) as protein_g
-        FROM diet_food_entries
-        GROUP BY log_date
-        ORDER BY log_date ASC
-    ''').fetchall()
     deficit_chart = []
     protein_chart = []
     for row in chart_rows:
         log_date = row['log_date']
-        day_weight = get_effective_weight_for_date(conn, log_date)
-        day_awake_hours, _ = get_awake_hours_for_date(conn, log_date, settings.get('diet_awake_hours_override'))
+        day_weight = series[log_date]['weight_kg']
+        day_awake_hours = series[log_date]['awake_hours']
         day_maintenance = calculate_maintenance_calories(day_weight, settings.get('diet_body_fat_pct'), day_awake_hours)
         day_protein_target = calculate_protein_target(day_weight)
         calories = float(row['calories'] or 0)
@@ -1550,7 +2661,9 @@ def build_diet_payload(conn, selected_date):
         'net_calories': net_calories,
         'saved_meals': [dict(row) for row in saved_meals],
         'deficit_chart': deficit_chart,
-        'protein_chart': protein_chart
+        'protein_chart': protein_chart,
+        'chart_days': chart_days,
+        'chart_day_options': DIET_CHART_DAY_OPTIONS
     }
 
 def add_months(dt, months):
@@ -1699,56 +2812,215 @@ def build_gym_schedule_payload(conn, month_value=None):
         'calendar_weeks': weeks,
     }
 
+def iter_recurring_occurrences(row, start_date, end_date):
+    if not row['is_active'] or not row['next_due_date']:
+        return
+    anchor = date.fromisoformat(row['next_due_date'])
+    if row['end_date']:
+        end_date = min(end_date, date.fromisoformat(row['end_date']))
+    if row['cadence'] == 'weekly':
+        # Jump straight to the first due date inside the window.
+        skipped = max(0, -(-(start_date - anchor).days // 7))
+        cursor = anchor + timedelta(days=7 * skipped)
+        while cursor <= end_date:
+            yield cursor
+            cursor += timedelta(days=7)
+        return
+    step = 12 if row['cadence'] == 'yearly' else 1
+    # Offsets are taken from the anchor so a 31st keeps landing on month end.
+    offset = max(0, ((start_date.year - anchor.year) * 12 + start_date.month - anchor.month) // step * step)
+    cursor = add_months(anchor, offset)
+    while cursor < start_date:
+        offset += step
+        cursor = add_months(anchor, offset)
+    while cursor <= end_date:
+        yield cursor
+        offset += step
+        cursor = add_months(anchor, offset)
+
 def expand_recurring_occurrences(start_date, end_date, recurring_rows):
-    month_map = defaultdict(lambda: {'income': 0.0, 'expense': 0.0, 'items': []})
+    month_map = {}
+    month = start_date.replace(day=1)
+    while month <= end_date:
+        month_map[month.strftime('%Y-%m')] = {'income': 0.0, 'expense': 0.0}
+        month = add_months(month, 1)
     for row in recurring_rows:
-        if not row['is_active']:
-            continue
-        next_due = date.fromisoformat(row['next_due_date']) if row['next_due_date'] else None
-        if not next_due:
-            continue
-        row_end = date.fromisoformat(row['end_date']) if row['end_date'] else None
-        cursor = next_due
-        while cursor <= end_date:
-            if cursor >= start_date and (row_end is None or cursor <= row_end):
-                month_key = cursor.strftime('%Y-%m')
-                amount = float(row['amount'] or 0)
-                month_map[month_key][row['type']] += amount
-                month_map[month_key]['items'].append({
-                    'name': row['name'],
-                    'type': row['type'],
-                    'amount': amount,
-                    'date': cursor.isoformat(),
-                    'cadence': row['cadence'],
-                })
-            if row['cadence'] == 'weekly':
-                cursor += timedelta(days=7)
-            elif row['cadence'] == 'yearly':
-                cursor = add_months(cursor, 12)
-            else:
-                cursor = add_months(cursor, 1)
-            if row_end and cursor > row_end:
-                break
+        amount = float(row['amount'] or 0)
+        for due in iter_recurring_occurrences(row, start_date, end_date):
+            month_map[due.strftime('%Y-%m')][row['type']] += amount
     return month_map
 
-def build_financial_payload(conn, history_days, edit_txn_id=None):
-    cutoff_date = (date.today() - timedelta(days=history_days - 1)).isoformat()
-    txns = conn.execute('''
+def load_recurring_projection(conn, start_date, end_date, recurring_rows):
+    version = get_cache_version(conn, 'recurring_payments')
+    cached_version, projections = _RECURRING_PROJECTION_CACHE['snapshot']
+    if cached_version != version:
+        projections = {}
+        _RECURRING_PROJECTION_CACHE['snapshot'] = (version, projections)
+    key = (start_date, end_date)
+    if key not in projections:
+        projections[key] = expand_recurring_occurrences(start_date, end_date, recurring_rows)
+    return projections[key]
+
+def invalidate_recurring_projection(conn):
+    bump_cache_version(conn, 'recurring_payments')
+
+FINANCE_TRANSPORT_CATEGORIES = {'Transport', 'Commute', 'Octopus Top Up'}
+TRANSACTION_PAGE_SIZE = 50
+TRANSACTION_PAGE_MAX = 200
+
+def _finance_month_bounds(month):
+    start = date.fromisoformat(f'{month}-01')
+    return start.isoformat(), add_months(start, 1).isoformat()
+
+def refresh_finance_rollups(conn, dates=None):
+    day_filter = ''
+    month_filter = ''
+    day_params = []
+    month_params = []
+    if dates is None:
+        conn.execute('DELETE FROM finance_daily_balance')
+        conn.execute('DELETE FROM finance_monthly_category')
+    else:
+        day_params = sorted({str(value)[:10] for value in dates if value})
+        if not day_params:
+            return
+        months = sorted({value[:7] for value in day_params})
+        day_placeholders = ','.join('?' for _ in day_params)
+        month_placeholders = ','.join('?' for _ in months)
+        day_filter = f' WHERE transaction_date IN ({day_placeholders})'
+        month_filter = ' WHERE ' + ' OR '.join('(transaction_date>=? AND transaction_date<?)' for _ in months)
+        for month in months:
+            month_params.extend(_finance_month_bounds(month))
+        conn.execute(f'DELETE FROM finance_daily_balance WHERE balance_date IN ({day_placeholders})', day_params)
+        conn.execute(f'DELETE FROM finance_monthly_category WHERE month IN ({month_placeholders})', months)
+
+    conn.execute(f'''
+        INSERT INTO finance_daily_balance (balance_date, income, expense, txn_count)
+        SELECT transaction_date,
+               SUM(CASE WHEN type='income' THEN amount ELSE 0 END),
+               SUM(CASE WHEN type='expense' THEN amount ELSE 0 END),
+               COUNT(*)
+        FROM transactions{day_filter}
+        GROUP BY transaction_date
+    ''', day_params)
+    conn.execute(f'''
+        INSERT INTO finance_monthly_category (month, type, category_id, account_id, transport_mode, amount, txn_count)
+        SELECT substr(transaction_date, 1, 7), COALESCE(type, ''), COALESCE(category_id, 0), COALESCE(account_id, 0),
+               COALESCE(transport_mode, ''), SUM(amount), COUNT(*)
+        FROM transactions{month_filter}
+        GROUP BY 1, 2, 3, 4, 5
+    ''', month_params)
+
+def rebuild_finance_rollups(conn):
+    refresh_finance_rollups(conn)
+    bump_cache_version(conn, 'finance_rollups')
+
+def ensure_finance_rollups(conn):
+    if not get_cache_version(conn, 'finance_rollups'):
+        rebuild_finance_rollups(conn)
+        conn.commit()
+
+def load_finance_window_spend(conn, cutoff_date):
+    # Whole months come from the rollup; only the partial first month is read raw.
+    cutoff = date.fromisoformat(cutoff_date)
+    first_full_month = cutoff if cutoff.day == 1 else add_months(cutoff.replace(day=1), 1)
+    return conn.execute('''
+        SELECT s.month, s.transport_mode, SUM(s.amount) AS amount, fc.name AS cat_name, fa.name AS account_name
+        FROM (
+            SELECT month, category_id, account_id, transport_mode, amount
+            FROM finance_monthly_category
+            WHERE type='expense' AND month>=?
+            UNION ALL
+            SELECT substr(transaction_date, 1, 7), COALESCE(category_id, 0), COALESCE(account_id, 0), COALESCE(transport_mode, ''), amount
+            FROM transactions
+            WHERE type='expense' AND transaction_date>=? AND transaction_date<?
+        ) s
+        LEFT JOIN financial_categories fc ON fc.id = s.category_id
+        LEFT JOIN financial_accounts fa ON fa.id = s.account_id
+        GROUP BY s.month, s.category_id, s.account_id, s.transport_mode
+        ORDER BY s.month
+    ''', (first_full_month.strftime('%Y-%m'), cutoff_date, first_full_month.isoformat())).fetchall()
+
+def parse_transaction_filters(args):
+    # Raises ValueError on malformed input so API callers get a 400.
+    filters = {}
+    history_days = args.get('history_days')
+    if history_days:
+        days = int(history_days)
+        if days < 1:
+            raise ValueError('history_days must be positive')
+        filters['since'] = (date.today() - timedelta(days=days - 1)).isoformat()
+    for key in ('category_id', 'account_id'):
+        if args.get(key):
+            filters[key] = int(args[key])
+    if args.get('type'):
+        if args['type'] not in ('income', 'expense'):
+            raise ValueError('type must be income or expense')
+        filters['type'] = args['type']
+    for key in ('min_amount', 'max_amount'):
+        if args.get(key):
+            filters[key] = float(args[key])
+    return filters
+
+def parse_transaction_cursor(value):
+    if not value:
+        return None
+    cursor_date, _, cursor_id = value.partition(':')
+    return date.fromisoformat(cursor_date).isoformat(), int(cursor_id)
+
+def load_transaction_page(conn, filters, cursor=None, limit=TRANSACTION_PAGE_SIZE):
+    clauses = []
+    params = []
+    if filters.get('since'):
+        clauses.append('t.transaction_date>=?')
+        params.append(filters['since'])
+    for key in ('category_id', 'account_id', 'type'):
+        if key in filters:
+            clauses.append(f't.{key}=?')
+            params.append(filters[key])
+    if 'min_amount' in filters:
+        clauses.append('t.amount>=?')
+        params.append(filters['min_amount'])
+    if 'max_amount' in filters:
+        clauses.append('t.amount<=?')
+        params.append(filters['max_amount'])
+
+    if set(filters) <= {'since'}:
+        total = conn.execute(
+            'SELECT COALESCE(SUM(txn_count), 0) AS c FROM finance_daily_balance WHERE balance_date>=?',
+            (filters.get('since') or '',)
+        ).fetchone()['c']
+    else:
+        total = conn.execute(f"SELECT COUNT(*) AS c FROM transactions t WHERE {' AND '.join(clauses)}", params).fetchone()['c']
+
+    if cursor:
+        # Keyset on the (transaction_date, id) order served by idx_transactions_transaction_date.
+        clauses.append('(t.transaction_date, t.id) < (?, ?)')
+        params.extend(cursor)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    rows = conn.execute(f'''
         SELECT t.*, fc.name as cat_name, fc.type as cat_type, fa.name as account_name, fa.account_type
         FROM transactions t
         LEFT JOIN financial_categories fc ON t.category_id=fc.id
         LEFT JOIN financial_accounts fa ON t.account_id=fa.id
-        WHERE t.transaction_date>=?
+        {where}
         ORDER BY t.transaction_date DESC, t.id DESC
-    ''', (cutoff_date,)).fetchall()
-    chart_txns = conn.execute('''
-        SELECT t.*, fc.name as cat_name, fc.type as cat_type, fa.name as account_name, fa.account_type
-        FROM transactions t
-        LEFT JOIN financial_categories fc ON t.category_id=fc.id
-        LEFT JOIN financial_accounts fa ON t.account_id=fa.id
-        WHERE t.transaction_date>=?
-        ORDER BY t.transaction_date ASC, t.id ASC
-    ''', (cutoff_date,)).fetchall()
+        LIMIT ?
+    ''', (*params, limit + 1)).fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = f"{rows[-1]['transaction_date']}:{rows[-1]['id']}"
+    return rows, next_cursor, total
+
+def build_financial_payload(conn, history_days, edit_txn_id=None):
+    ensure_finance_rollups(conn)
+    cutoff_date = (date.today() - timedelta(days=history_days - 1)).isoformat()
+    daily_rows = conn.execute(
+        'SELECT balance_date, income, expense, txn_count FROM finance_daily_balance WHERE balance_date>=? ORDER BY balance_date',
+        (cutoff_date,)
+    ).fetchall()
+    txns, txn_next_cursor, txn_total = load_transaction_page(conn, {'since': cutoff_date})
     cats = conn.execute('SELECT * FROM financial_categories ORDER BY type, name').fetchall()
     accounts = conn.execute('SELECT * FROM financial_accounts WHERE is_active=1 ORDER BY account_type, name').fetchall()
     goals = conn.execute('SELECT * FROM savings_goals ORDER BY is_completed, created_at DESC').fetchall()
@@ -1771,22 +3043,20 @@ def build_financial_payload(conn, history_days, edit_txn_id=None):
     projection_setting = conn.execute("SELECT setting_value FROM app_settings WHERE setting_key='finance_projection_months'").fetchone()
     projection_months = int(projection_setting['setting_value']) if projection_setting and str(projection_setting['setting_value']).isdigit() else 6
 
-    income_total = sum(float(t['amount'] or 0) for t in txns if t['type'] == 'income')
-    expense_total = sum(float(t['amount'] or 0) for t in txns if t['type'] == 'expense')
+    income_total = sum(float(row['income'] or 0) for row in daily_rows)
+    expense_total = sum(float(row['expense'] or 0) for row in daily_rows)
     actual_balance = income_total - expense_total
     liquid_balance = sum(float(a['current_balance'] or 0) for a in accounts)
 
     category_spend = defaultdict(float)
     monthly_category = defaultdict(lambda: defaultdict(float))
     transport_spend = defaultdict(float)
-    for row in chart_txns:
-        if row['type'] != 'expense':
-            continue
+    for row in load_finance_window_spend(conn, cutoff_date):
         category_name = row['cat_name'] or 'Uncategorized'
         amount = float(row['amount'] or 0)
         category_spend[category_name] += amount
-        monthly_category[row['transaction_date'][:7]][category_name] += amount
-        if category_name in {'Transport', 'Commute', 'Octopus Top Up'} or (row['account_name'] or '') == 'Octopus Card':
+        monthly_category[row['month']][category_name] += amount
+        if category_name in FINANCE_TRANSPORT_CATEGORIES or (row['account_name'] or '') == 'Octopus Card':
             transport_spend[(row['transport_mode'] or 'general').title()] += amount
 
     budget_total = sum(float(row['monthly_amount'] or 0) for row in budgets)
@@ -1796,7 +3066,7 @@ def build_financial_payload(conn, history_days, edit_txn_id=None):
 
     start_month = date.today().replace(day=1)
     end_month = add_months(start_month, max(projection_months - 1, 0))
-    recurring_month_map = expand_recurring_occurrences(start_month, add_months(end_month, 1) - timedelta(days=1), recurring)
+    recurring_month_map = load_recurring_projection(conn, start_month, add_months(end_month, 1) - timedelta(days=1), recurring)
     expected_month_map = defaultdict(float)
     for row in expected:
         if row['is_received']:
@@ -1837,20 +3107,18 @@ def build_financial_payload(conn, history_days, edit_txn_id=None):
         })
 
     week_start = get_week_start()
-    meal_rows = conn.execute('''
-        SELECT mpe.*, mpd.name as dish_name
+    weekly_meal_plan_cost = float(conn.execute('''
+        SELECT SUM(mpd.cost_per_serving * COALESCE(NULLIF(mpe.servings, 0), 1)) AS total
         FROM meal_plan_entries mpe
         JOIN meal_plan_dishes mpd ON mpd.id = mpe.dish_id
         WHERE mpe.planned_date BETWEEN ? AND ?
-        ORDER BY mpe.planned_date, CASE mpe.meal_type WHEN 'breakfast' THEN 1 WHEN 'lunch' THEN 2 WHEN 'dinner' THEN 3 ELSE 4 END
-    ''', (week_start.isoformat(), (week_start + timedelta(days=6)).isoformat())).fetchall()
-    weekly_meal_plan_cost = 0.0
-    for row in meal_rows:
-        ingredient_total = conn.execute('SELECT SUM(COALESCE(estimated_cost,0) * COALESCE(?,1)) as total FROM meal_plan_ingredients WHERE dish_id=?', (float(row['servings'] or 1), row['dish_id'])).fetchone()['total'] or 0
-        weekly_meal_plan_cost += float(ingredient_total)
+    ''', (week_start.isoformat(), (week_start + timedelta(days=6)).isoformat())).fetchone()['total'] or 0)
 
     chart_payload = {
-        'transactions': [dict(t) for t in chart_txns],
+        'daily_balance': [
+            {'date': row['balance_date'], 'income': round(float(row['income'] or 0), 2), 'expense': round(float(row['expense'] or 0), 2)}
+            for row in daily_rows
+        ],
         'category_spend': [{'label': k, 'amount': round(v, 2)} for k, v in sorted(category_spend.items(), key=lambda item: item[1], reverse=True)],
         'monthly_category': {
             month: {cat: round(val, 2) for cat, val in data.items()}
@@ -1871,6 +3139,8 @@ def build_financial_payload(conn, history_days, edit_txn_id=None):
 
     return {
         'transactions': txns,
+        'txn_total': txn_total,
+        'txn_next_cursor': txn_next_cursor,
         'categories': cats,
         'accounts': accounts,
         'income_total': income_total,
@@ -1888,7 +3158,6 @@ def build_financial_payload(conn, history_days, edit_txn_id=None):
         'disposable_income': disposable_income,
         'currency': currency_setting['setting_value'] if currency_setting else '$',
         'today': date.today().isoformat(),
-        'chart_transactions': [dict(t) for t in chart_txns],
         'history_days': history_days,
         'edit_txn': edit_txn,
         'projection_months': projection_months,
@@ -1914,7 +3183,7 @@ def build_meal_plan_payload(conn, week_start_iso=None):
             ingredients_by_dish[row['dish_id']].append(dict(row))
 
     entry_rows = conn.execute('''
-        SELECT mpe.*, mpd.name as dish_name, mpd.notes as dish_notes
+        SELECT mpe.*, mpd.name as dish_name, mpd.notes as dish_notes, mpd.cost_per_serving, mpd.calories_per_serving
         FROM meal_plan_entries mpe
         JOIN meal_plan_dishes mpd ON mpd.id = mpe.dish_id
         WHERE mpe.planned_date BETWEEN ? AND ?
@@ -1928,20 +3197,15 @@ def build_meal_plan_payload(conn, week_start_iso=None):
     for row in entry_rows:
         item = dict(row)
         ingredients = ingredients_by_dish.get(row['dish_id'], [])
-        total_cost = 0.0
-        total_calories = 0.0
         servings = float(row['servings'] or 1)
+        total_cost = float(row['cost_per_serving'] or 0) * servings
+        total_calories = float(row['calories_per_serving'] or 0) * servings
         for ing in ingredients:
-            qty = float(ing['quantity'] or 0) * servings
-            cost = float(ing['estimated_cost'] or 0) * servings
-            calories = float(ing['calories'] or 0) * servings
-            total_cost += cost
-            total_calories += calories
             if ing.get('add_to_grocery'):
                 bucket = grocery_map[ing['ingredient_name']]
-                bucket['quantity'] += qty
+                bucket['quantity'] += float(ing['quantity'] or 0) * servings
                 bucket['unit'] = ing.get('unit') or bucket['unit']
-                bucket['estimated_cost'] += cost
+                bucket['estimated_cost'] += float(ing['estimated_cost'] or 0) * servings
                 bucket['sources'].append(row['dish_name'])
         item['ingredients'] = ingredients
         item['total_cost'] = round(total_cost, 2)
@@ -2027,37 +3291,88 @@ def calculate_cardio_session_metrics(conn, session_id, session_date, profile=Non
         'weight_kg': weight_kg,
     }
 
-def hydrate_cardio_session_metrics(conn, session_row, profile=None, persist=False):
-    session = dict(session_row)
-    if not session.get('is_cardio'):
-        return session
-
-    needs_duration = session.get('duration_minutes') in (None, 0, 0.0)
-    needs_calories = float(session.get('calories_burned') or 0) <= 0
-    if not (needs_duration or needs_calories):
-        return session
-
-    metrics = calculate_cardio_session_metrics(conn, session['id'], session['session_date'], profile=profile)
-    if not metrics:
-        return session
-
-    if needs_duration:
-        session['duration_minutes'] = metrics['duration_minutes']
-    if needs_calories:
-        session['calories_burned'] = metrics['calories_burned']
-
-    if persist and (needs_duration or needs_calories):
-        conn.execute('''
-            UPDATE workout_sessions
-            SET duration_minutes=?, calories_burned=?
-            WHERE id=?
-        ''', (
-            session.get('duration_minutes'),
-            session.get('calories_burned') or 0,
-            session['id'],
-        ))
+# Cardio sessions saved without a duration or calorie figure get them filled from
+# their interval sets. This happens at write time (gym_session_save), in the
+# background after weight/profile changes, and via `flask backfill-cardio-metrics`
+# for legacy rows, so the gym pages only read.
+_CARDIO_RECOMPUTE = {
+    'thread': None,
+    'wake': threading.Event(),
+    'lock': threading.Lock(),
+    'last_run': None,
+    'last_error': None,
+    'last_updated': 0,
+}
 
-    return session
+def recompute_cardio_session_metrics(conn, session_ids=None):
+    query = '''
+        SELECT ws.id, ws.session_date, ws.duration_minutes, ws.calories_burned
+        FROM workout_sessions ws
+        JOIN workout_types wt ON wt.id = ws.workout_type_id
+        WHERE wt.is_cardio=1
+          AND (ws.duration_minutes IS NULL OR ws.duration_minutes = 0 OR COALESCE(ws.calories_burned, 0) <= 0)
+    '''
+    params = []
+    if session_ids is not None:
+        params = [int(session_id) for session_id in session_ids]
+        if not params:
+            return 0
+        query += f" AND ws.id IN ({','.join('?' for _ in params)})"
+    rows = conn.execute(query, params).fetchall()
+    if not rows:
+        return 0
+    profile = conn.execute('SELECT * FROM user_profile WHERE id=1').fetchone()
+    updates = []
+    for row in rows:
+        metrics = calculate_cardio_session_metrics(conn, row['id'], row['session_date'], profile=profile)
+        if not metrics:
+            continue
+        duration = row['duration_minutes']
+        calories = row['calories_burned']
+        if duration in (None, 0, 0.0):
+            duration = metrics['duration_minutes']
+        if float(calories or 0) <= 0:
+            calories = metrics['calories_burned']
+        if (duration, calories or 0) != (row['duration_minutes'], row['calories_burned'] or 0):
+            updates.append((duration, calories or 0, row['id']))
+    if updates:
+        conn.executemany('UPDATE workout_sessions SET duration_minutes=?, calories_burned=? WHERE id=?', updates)
+    return len(updates)
+
+def _cardio_recompute_loop():
+    while True:
+        _CARDIO_RECOMPUTE['wake'].wait()
+        _CARDIO_RECOMPUTE['wake'].clear()
+        conn = get_db()
+        try:
+            _CARDIO_RECOMPUTE['last_updated'] = recompute_cardio_session_metrics(conn)
+            conn.commit()
+            _CARDIO_RECOMPUTE['last_error'] = None
+        except Exception as exc:
+            conn.rollback()
+            _CARDIO_RECOMPUTE['last_error'] = str(exc)
+        finally:
+            conn.close()
+        _CARDIO_RECOMPUTE['last_run'] = datetime.now()
+
+def request_cardio_metrics_recompute():
+    # Call after committing the weight/profile change so the worker sees it.
+    with _CARDIO_RECOMPUTE['lock']:
+        thread = _CARDIO_RECOMPUTE['thread']
+        if not (thread and thread.is_alive()):
+            thread = threading.Thread(target=_cardio_recompute_loop, name='cardio-metrics', daemon=True)
+            _CARDIO_RECOMPUTE['thread'] = thread
+            thread.start()
+    _CARDIO_RECOMPUTE['wake'].set()
+
+@app.cli.command('backfill-cardio-metrics')
+def backfill_cardio_metrics_command():
+    """Fill missing duration/calories on existing cardio sessions."""
+    conn = get_db()
+    updated = recompute_cardio_session_metrics(conn)
+    conn.commit()
+    conn.close()
+    print(f'Updated cardio metrics for {updated} session(s).')
 
 # ===== DASHBOARD =====
 @app.route('/')
@@ -2149,28 +3464,27 @@ def habits():
     all_habits = conn.execute("SELECT *, COALESCE(NULLIF(category, ''), 'General') as category FROM habits WHERE is_active=1 ORDER BY category, name").fetchall()
     end = date.today()
     start = end - timedelta(days=13)
-    habit_logs = {}
-    for h in all_habits:
-        logs = conn.execute('SELECT log_date, completed FROM habit_logs WHERE habit_id=? AND log_date BETWEEN ? AND ? ORDER BY log_date',
-            (h['id'], start.isoformat(), end.isoformat())).fetchall()
-        habit_logs[h['id']] = {l['log_date']: l['completed'] for l in logs}
+    habit_logs = {h['id']: {} for h in all_habits}
+    log_rows = conn.execute('''
+        SELECT hl.habit_id, hl.log_date, hl.completed
+        FROM habit_logs hl
+        JOIN habits h ON h.id = hl.habit_id
+        WHERE h.is_active=1 AND hl.log_date BETWEEN ? AND ?
+        ORDER BY hl.log_date
+    ''', (start.isoformat(), end.isoformat())).fetchall()
+    for row in log_rows:
+        habit_logs[row['habit_id']][row['log_date']] = row['completed']
+    streak_rows = {row['habit_id']: row for row in conn.execute('SELECT * FROM habit_streaks').fetchall()}
     habit_streaks = {}
+    backfilled = False
     for h in all_habits:
-        streak = 0
-        d = date.today()
-        while True:
-            if not is_habit_due_on(h, d):
-                d -= timedelta(days=1)
-                continue
-            ds = d.isoformat()
-            if habit_logs.get(h['id'], {}).get(ds) == 1:
-                streak += 1
-                d -= timedelta(days=1)
-            elif d == date.today() and ds not in habit_logs.get(h['id'], {}):
-                d -= timedelta(days=1)
-            else:
-                break
-        habit_streaks[h['id']] = streak
+        streak_row = streak_rows.get(h['id'])
+        if streak_row is None or streak_row['due_mask'] != habit_due_mask(h):
+            streak_row = recompute_habit_streak(conn, h)
+            backfilled = True
+        habit_streaks[h['id']] = current_habit_streak(streak_row, habit_logs[h['id']].get(end.isoformat()), end)
+    if backfilled:
+        conn.commit()
     date_range = [(start + timedelta(days=i)).isoformat() for i in range(14)]
     conn.close()
     return render_template('habits.html', habits=all_habits, habit_logs=habit_logs, date_range=date_range, habit_streaks=habit_streaks)
@@ -2185,9 +3499,15 @@ def habits_toggle():
         conn.execute('UPDATE habit_logs SET completed=? WHERE habit_id=? AND log_date=?', (0 if ex['completed'] else 1, hid, ld))
     else:
         conn.execute('INSERT INTO habit_logs (habit_id,log_date,completed) VALUES (?,?,1)', (hid, ld))
+    habit = conn.execute('SELECT * FROM habits WHERE id=?', (hid,)).fetchone()
+    streak = 0
+    if habit:
+        streak_row = recompute_habit_streak(conn, habit)
+        today_log = conn.execute('SELECT completed FROM habit_logs WHERE habit_id=? AND log_date=?', (hid, date.today().isoformat())).fetchone()
+        streak = current_habit_streak(streak_row, today_log['completed'] if today_log else None)
     conn.commit()
     conn.close()
-    return jsonify({'success': True})
+    return jsonify({'success': True, 'streak': streak})
 
 @app.route('/habits/add', methods=['POST'])
 def habits_add():
@@ -2234,9 +3554,6 @@ def gym():
     cutoff_date = (date.today() - timedelta(days=history_days - 1)).isoformat()
     wt = conn.execute('SELECT * FROM workout_types WHERE COALESCE(is_active, 1)=1 ORDER BY id').fetchall()
     recent = conn.execute('SELECT ws.*, wt.name as workout_name, wt.is_cardio FROM workout_sessions ws JOIN workout_types wt ON ws.workout_type_id=wt.id WHERE ws.session_date >= ? ORDER BY ws.session_date DESC LIMIT 50', (cutoff_date,)).fetchall()
-    profile = conn.execute('SELECT * FROM user_profile WHERE id=1').fetchone()
-    recent = [hydrate_cardio_session_metrics(conn, row, profile=profile, persist=True) for row in recent]
-    conn.commit()
     body = conn.execute('SELECT * FROM body_stats WHERE log_date >= ? ORDER BY log_date DESC LIMIT 60', (cutoff_date,)).fetchall()
     steps = conn.execute('SELECT * FROM daily_steps WHERE log_date >= ? ORDER BY log_date DESC LIMIT 60', (cutoff_date,)).fetchall()
     weight_entries_count = conn.execute('SELECT COUNT(*) as c FROM body_stats').fetchone()['c']
@@ -2440,6 +3757,7 @@ def gym_measurements_save():
             'INSERT OR REPLACE INTO app_settings (setting_key,setting_value) VALUES (?,?)',
             (f'measurement_{key}', raw_value)
         )
+    invalidate_settings_cache(conn)
     conn.commit()
     conn.close()
     flash('Body measurements saved.', 'success')
@@ -2562,7 +3880,6 @@ def gym_vo2_save():
 @app.route('/gym/session/<int:session_id>')
 def gym_session_detail(session_id):
     conn = get_db()
-    profile = conn.execute('SELECT * FROM user_profile WHERE id=1').fetchone()
     session = conn.execute('''
         SELECT ws.*, wt.name as workout_name, wt.is_cardio
         FROM workout_sessions ws
@@ -2573,8 +3890,6 @@ def gym_session_detail(session_id):
         conn.close()
         flash('Session not found.', 'error')
         return redirect(url_for('gym'))
-    session = hydrate_cardio_session_metrics(conn, session, profile=profile, persist=True)
-    conn.commit()
 
     exercise_logs = conn.execute('''
         SELECT e.name as exercise_name, e.muscle_group, wel.*
@@ -2596,7 +3911,11 @@ def gym_session_detail(session_id):
 @app.route('/gym/session/delete/<int:session_id>', methods=['POST'])
 def gym_session_delete(session_id):
     conn = get_db()
+    name_keys = session_exercise_name_keys(conn, [session_id])
     conn.execute('DELETE FROM workout_sessions WHERE id=?', (session_id,))
+    conn.execute('DELETE FROM exercise_session_best WHERE session_id=?', (session_id,))
+    conn.execute('DELETE FROM exercise_pr_sets WHERE session_id=?', (session_id,))
+    refresh_exercise_last_performance(conn, name_keys)
     conn.commit()
     conn.close()
     flash('Workout session deleted.', 'success')
@@ -2809,294 +4128,366 @@ def gym_session_new(wt_id):
             default_name = 'Swim'
         elif wt['name'] == 'Fitness Test':
             default_name = 'Test Result'
-        conn.execute('INSERT INTO exercises (name,workout_type_id,is_cardio,order_index,is_active) VALUES (?,?,?,?,1)',
-            (default_name, wt_id, 1, 1))
+        conn.execute('INSERT INTO exercises (name,workout_type_id,muscle_group,is_cardio,order_index,is_active) VALUES (?,?,?,?,?,1)',
+            (default_name, wt_id, 'Cardio', 1, 1))
         conn.commit()
         exercises = conn.execute('SELECT * FROM exercises WHERE workout_type_id=? AND is_active=1 ORDER BY order_index', (wt_id,)).fetchall()
     stretches = conn.execute('SELECT * FROM workout_stretches WHERE workout_type_id=? AND is_active=1 ORDER BY order_index, name', (wt_id,)).fetchall()
     profile = conn.execute('SELECT * FROM user_profile WHERE id=1').fetchone()
-    latest_weight = conn.execute('SELECT weight_kg, log_date FROM body_stats ORDER BY log_date DESC, id DESC LIMIT 1').fetchone()
+    latest_weight = latest_weight_entry(load_weight_index(conn))
+    ensure_exercise_last_performance(conn)
+    last_rows = conn.execute('''
+        SELECT e.id AS exercise_id, elp.session_date, wt.name AS workout_name,
+               wel.time_seconds, wel.incline, wel.speed, wel.reps, wel.weight_kg
+        FROM exercises e
+        JOIN exercise_last_performance elp ON elp.name_key = e.name_key AND elp.set_type = ?
+        JOIN workout_exercise_logs wel ON wel.id = elp.log_id
+        JOIN workout_sessions ws ON ws.id = wel.session_id
+        JOIN workout_types wt ON wt.id = ws.workout_type_id
+        WHERE e.workout_type_id=? AND e.is_active=1
+    ''', ('interval' if wt['is_cardio'] else 'working', wt_id)).fetchall()
     last_performance = {}
-    for exercise in exercises:
-        params = (exercise['name'].strip().lower(),)
-        if wt and wt['is_cardio']:
-            row = conn.execute('''
-                SELECT ws.session_date, wt.name as workout_name, wel.time_seconds, wel.incline, wel.speed
-                FROM workout_exercise_logs wel
-                JOIN exercises e ON e.id = wel.exercise_id
-                JOIN workout_sessions ws ON ws.id = wel.session_id
-                JOIN workout_types wt ON wt.id = ws.workout_type_id
-                WHERE lower(trim(e.name)) = ? AND wel.set_type='interval'
-                ORDER BY ws.session_date DESC, wel.id DESC
-                LIMIT 1
-            ''', params).fetchone()
-            if row:
-                summary = f"{row['speed'] or 0} km/h · {row['incline'] or 0}% · {row['time_seconds'] or 0}s"
-                if row['workout_name'] == 'HIIT Cardio':
-                    summary = f"{int(row['time_seconds'] or 0)}s sprint · {int(float(row['incline'] or 0))}s rest"
-                last_performance[exercise['id']] = {
-                    'summary': summary,
-                    'date': row['session_date'],
-                    'workout_name': row['workout_name']
-                }
+    for row in last_rows:
+        if wt['is_cardio']:
+            summary = f"{row['speed'] or 0} km/h · {row['incline'] or 0}% · {row['time_seconds'] or 0}s"
+            if row['workout_name'] == 'HIIT Cardio':
+                summary = f"{int(row['time_seconds'] or 0)}s sprint · {int(float(row['incline'] or 0))}s rest"
         else:
-            rows = conn.execute('''
-                SELECT ws.session_date, wt.name as workout_name, wel.reps, wel.weight_kg
-                FROM workout_exercise_logs wel
-                JOIN exercises e ON e.id = wel.exercise_id
-                JOIN workout_sessions ws ON ws.id = wel.session_id
-                JOIN workout_types wt ON wt.id = ws.workout_type_id
-                WHERE lower(trim(e.name)) = ? AND wel.set_type='working'
-                ORDER BY ws.session_date DESC, wel.id DESC
-            ''', params).fetchall()
-            latest_row = None
-            latest_session_date = None
-            for row in rows:
-                if latest_session_date is None:
-                    latest_session_date = row['session_date']
-                if row['session_date'] != latest_session_date:
-                    break
-                if is_better_strength_set(row, latest_row):
-                    latest_row = row
-            if latest_row:
-                one_rm = round(calc_1rm(latest_row['weight_kg'] or 0, latest_row['reps'] or 0), 1) if latest_row['weight_kg'] and latest_row['reps'] else 0
-                summary = f"{latest_row['weight_kg'] or 0}kg x {latest_row['reps'] or 0}"
-                if one_rm:
-                    summary += f" · est. 1RM {one_rm}kg"
-                last_performance[exercise['id']] = {
-                    'summary': summary,
-                    'date': latest_row['session_date'],
-                    'workout_name': latest_row['workout_name']
-                }
+            one_rm = round(calc_1rm(row['weight_kg'] or 0, row['reps'] or 0), 1) if row['weight_kg'] and row['reps'] else 0
+            summary = f"{row['weight_kg'] or 0}kg x {row['reps'] or 0}"
+            if one_rm:
+                summary += f" · est. 1RM {one_rm}kg"
+        last_performance[row['exercise_id']] = {
+            'summary': summary,
+            'date': row['session_date'],
+            'workout_name': row['workout_name']
+        }
     conn.close()
     return render_template('gym_session.html', workout_type=wt, exercises=exercises, today=selected_date,
         profile=profile, latest_weight=latest_weight, stretches=stretches, last_performance=last_performance)
 
+GYM_SET_TYPES = ('warmup', 'working', 'interval')
+GYM_SESSION_JSON_FIELDS = (
+    'workout_type_id', 'session_date', 'duration_minutes', 'notes',
+    'fitness_test_name', 'fitness_distance_m', 'fitness_beep_level',
+    'fitness_beep_shuttles', 'fitness_time_minutes', 'fitness_result_notes',
+)
+GYM_EXERCISE_JSON_FIELDS = ('elapsed_seconds', 'distance_km', 'distance_m', 'swim_min', 'swim_sec', 'swim_laps', 'swim_stroke')
+GYM_LOG_COLUMNS = ('session_id', 'exercise_id', 'set_number', 'set_type', 'reps', 'weight_kg',
+                   'time_seconds', 'incline', 'speed', 'distance_km', 'notes')
+
+def _optional_number(raw, cast):
+    if raw is None or raw == '':
+        return None
+    return cast(raw)
+
+def gym_session_fields_from_json(payload):
+    # Flatten a JSON session into the same key -> [values] shape the form posts,
+    # so both transports go through one parser.
+    fields = {}
+
+    def add(key, value):
+        if isinstance(value, bool):
+            value = '1' if value else ''
+        fields.setdefault(key, []).append('' if value is None else str(value))
+
+    for key in GYM_SESSION_JSON_FIELDS:
+        if payload.get(key) is not None:
+            add(key, payload[key])
+    for exercise in payload.get('exercises') or []:
+        eid = exercise.get('exercise_id')
+        add('exercise_id', eid)
+        for key in GYM_EXERCISE_JSON_FIELDS:
+            if exercise.get(key) is not None:
+                add(f'{key}_{eid}', exercise[key])
+        for index, entry in enumerate(exercise.get('sets') or [], start=1):
+            add(f'set_num_{eid}', entry.get('set_number') or index)
+            add(f'set_type_{eid}', entry.get('set_type') or 'working')
+            add(f'reps_{eid}', entry.get('reps'))
+            add(f'weight_{eid}', entry.get('weight_kg'))
+            add(f'time_{eid}', entry.get('time_seconds'))
+            add(f'incline_{eid}', entry.get('incline'))
+            add(f'speed_{eid}', entry.get('speed'))
+    for stretch in payload.get('stretches') or []:
+        stretch_id = stretch.get('stretch_id')
+        add('stretch_id', stretch_id)
+        if stretch.get('completed'):
+            add(f'stretch_done_{stretch_id}', True)
+        if stretch.get('notes'):
+            add(f'stretch_notes_{stretch_id}', stretch['notes'])
+        for index, amount in enumerate(stretch.get('values') or [], start=1):
+            add(f'stretch_value_{stretch_id}', amount)
+            add(f'stretch_set_num_{stretch_id}', index)
+    return fields
+
+def parse_gym_session_sets(fields, exercise_id):
+    def column(name):
+        return fields.get(f'{name}_{exercise_id}') or []
+
+    set_types = column('set_type')
+    reps, weights, times = column('reps'), column('weight'), column('time')
+    inclines, speeds = column('incline'), column('speed')
+
+    def at(values, index):
+        return values[index] if index < len(values) else None
+
+    records = []
+    for index, raw_number in enumerate(column('set_num')):
+        set_type = at(set_types, index) or 'working'
+        if set_type not in GYM_SET_TYPES:
+            raise ValueError(f'Unknown set type: {set_type}')
+        records.append({
+            'exercise_id': int(exercise_id),
+            'set_number': int(raw_number),
+            'set_type': set_type,
+            'reps': _optional_number(at(reps, index), int),
+            'weight_kg': _optional_number(at(weights, index), float),
+            'time_seconds': _optional_number(at(times, index), int),
+            'incline': _optional_number(at(inclines, index), float),
+            'speed': _optional_number(at(speeds, index), float),
+        })
+    return records
+
+def _gym_session_save_error(message, wt_id=None):
+    if request.is_json:
+        return jsonify({'success': False, 'error': message}), 400
+    flash(message, 'error')
+    if wt_id:
+        return redirect(url_for('gym_session_new', wt_id=wt_id))
+    return redirect(url_for('gym'))
+
 @app.route('/gym/session/save', methods=['POST'])
 def gym_session_save():
-    d = request.form
+    if request.is_json:
+        fields = gym_session_fields_from_json(request.get_json(silent=True) or {})
+    else:
+        fields = request.form.to_dict(flat=False)
+
+    def field(key):
+        values = fields.get(key)
+        return values[0] if values else None
+
     conn = get_db()
-    cur = conn.cursor()
-    workout_type = conn.execute('SELECT * FROM workout_types WHERE id=?', (d['workout_type_id'],)).fetchone()
-    is_outdoor_run = workout_type and workout_type['name'] == 'Outdoor Run'
-    is_hiit_cardio = workout_type and workout_type['name'] == 'HIIT Cardio'
-    is_swimming = workout_type and workout_type['name'] == 'Swimming'
-    is_fitness_test = workout_type and workout_type['name'] == 'Fitness Test'
+    workout_type = conn.execute('SELECT * FROM workout_types WHERE id=?', (field('workout_type_id'),)).fetchone()
+    if not workout_type:
+        conn.close()
+        return _gym_session_save_error('Workout type not found.')
+    session_date = field('session_date')
+    try:
+        session_date = datetime.strptime(session_date or '', '%Y-%m-%d').date().isoformat()
+    except ValueError:
+        conn.close()
+        return _gym_session_save_error('Invalid session date.', workout_type['id'])
+    is_outdoor_run = workout_type['name'] == 'Outdoor Run'
+    is_hiit_cardio = workout_type['name'] == 'HIIT Cardio'
+    is_swimming = workout_type['name'] == 'Swimming'
+    is_fitness_test = workout_type['name'] == 'Fitness Test'
     profile = conn.execute('SELECT * FROM user_profile WHERE id=1').fetchone()
-    latest_weight = conn.execute('SELECT weight_kg FROM body_stats ORDER BY log_date DESC, id DESC LIMIT 1').fetchone()
+    latest_weight = latest_weight_entry(load_weight_index(conn))
     current_weight = latest_weight['weight_kg'] if latest_weight else None
+    session_notes = field('notes')
+    exercise_ids = fields.get('exercise_id') or []
+    log_rows = []
+    stretch_rows = []
+    vo2_row = None
     total_calories = 0
     total_cardio_seconds = 0
 
-    cur.execute('INSERT INTO workout_sessions (workout_type_id,session_date,duration_minutes,calories_burned,notes) VALUES (?,?,?,?,?)',
-        (d['workout_type_id'], d['session_date'], d.get('duration_minutes') or None, 0, d.get('notes')))
-    sid = cur.lastrowid
+    # Parse and validate everything before writing so a bad value leaves no partial session.
+    try:
+        if is_outdoor_run:
+            # Outdoor run: single log entry per exercise using elapsed time, distance, pace
+            for eid in exercise_ids:
+                elapsed_s = _optional_number(field(f'elapsed_seconds_{eid}'), int)
+                distance = _optional_number(field(f'distance_km_{eid}'), float)
+                # avg pace in sec/km (calculated from inputs, or submitted directly)
+                pace_sec_km = None
+                if elapsed_s is not None and distance and distance > 0:
+                    pace_sec_km = round(elapsed_s / distance, 1)
+                log_rows.append({
+                    'exercise_id': int(eid), 'set_number': 1, 'set_type': 'interval',
+                    'time_seconds': elapsed_s, 'distance_km': distance,
+                    'speed': round(pace_sec_km / 60, 4) if pace_sec_km else None,  # store pace as min/km in speed col
+                })
+                if elapsed_s:
+                    total_cardio_seconds += elapsed_s
+                if current_weight and distance is not None:
+                    # ~1.036 kcal per kg per km for running
+                    total_calories += distance * float(current_weight) * 1.036
+        elif is_hiit_cardio:
+            for eid in exercise_ids:
+                for record in parse_gym_session_sets(fields, eid):
+                    # Sprint seconds live in time_seconds, rest seconds in incline.
+                    record.update(set_type='interval', reps=None, weight_kg=None, speed=None)
+                    log_rows.append(record)
+                    sprint_seconds = record['time_seconds'] or 0
+                    rest_seconds = int(record['incline']) if record['incline'] is not None else 0
+                    total_cardio_seconds += sprint_seconds + rest_seconds
+                    if current_weight and (sprint_seconds > 0 or rest_seconds > 0):
+                        total_calories += estimate_hiit_interval_calories(current_weight, sprint_seconds, rest_seconds)
+        elif is_swimming:
+            for eid in exercise_ids[:1]:
+                swim_min = _safe_int(field(f'swim_min_{eid}')) or 0
+                swim_sec = _safe_int(field(f'swim_sec_{eid}')) or 0
+                elapsed_seconds = max((swim_min * 60) + swim_sec, 0)
+                distance_m = _safe_float(field(f'distance_m_{eid}'))
+                laps = _safe_int(field(f'swim_laps_{eid}'))
+                stroke = (field(f'swim_stroke_{eid}') or '').strip()
+                swim_notes = []
+                if stroke:
+                    swim_notes.append(stroke)
+                if laps:
+                    swim_notes.append(f'{laps} laps')
+                log_rows.append({
+                    'exercise_id': int(eid), 'set_number': 1, 'set_type': 'interval',
+                    'time_seconds': elapsed_seconds if elapsed_seconds else None,
+                    'distance_km': round(distance_m / 1000, 4) if distance_m else None,
+                    'notes': ' · '.join(swim_notes) if swim_notes else None,
+                })
+                if elapsed_seconds:
+                    total_cardio_seconds += elapsed_seconds
+                    if current_weight:
+                        total_calories += estimate_met_calories(current_weight, 8.3, elapsed_seconds / 60)
+        elif is_fitness_test:
+            test_name = (field('fitness_test_name') or 'Custom Test').strip()
+            distance_m = _safe_float(field('fitness_distance_m'))
+            beep_level = _safe_float(field('fitness_beep_level'))
+            beep_shuttles = _safe_int(field('fitness_beep_shuttles'))
+            elapsed_minutes = _safe_float(field('fitness_time_minutes'))
+            result_notes = (field('fitness_result_notes') or '').strip()
+            if test_name == 'Cooper 12-Min' and elapsed_minutes is None:
+                elapsed_minutes = 12
+            elapsed_seconds = int(round(elapsed_minutes * 60)) if elapsed_minutes else None
+
+            summary_parts = [test_name]
+            if distance_m is not None:
+                summary_parts.append(f'{distance_m:g} m')
+            if beep_level is not None:
+                summary_parts.append(f'Level {beep_level:g}')
+            if beep_shuttles is not None:
+                summary_parts.append(f'{beep_shuttles} shuttles')
+            if elapsed_minutes is not None:
+                summary_parts.append(f'{elapsed_minutes:g} min')
+            if result_notes:
+                summary_parts.append(result_notes)
+
+            if exercise_ids:
+                log_rows.append({
+                    'exercise_id': int(exercise_ids[0]), 'set_number': 1, 'set_type': 'interval',
+                    'time_seconds': elapsed_seconds,
+                    'distance_km': round(distance_m / 1000, 4) if distance_m else None,
+                    'notes': ' | '.join(summary_parts),
+                })
 
-    if is_outdoor_run:
-        # Outdoor run: single log entry per exercise using elapsed time, distance, pace
-        exercise_ids = request.form.getlist('exercise_id')
-        for eid in exercise_ids:
-            elapsed_s = d.get(f'elapsed_seconds_{eid}') or None
-            distance = d.get(f'distance_km_{eid}') or None
-            # avg pace in sec/km (calculated from inputs, or submitted directly)
-            pace_sec_km = None
-            if elapsed_s and distance and float(distance) > 0:
-                pace_sec_km = round(float(elapsed_s) / float(distance), 1)
-            conn.execute(
-                'INSERT INTO workout_exercise_logs (session_id,exercise_id,set_number,set_type,time_seconds,distance_km,speed) VALUES (?,?,?,?,?,?,?)',
-                (sid, eid, 1, 'interval',
-                 int(elapsed_s) if elapsed_s else None,
-                 float(distance) if distance else None,
-                 round(pace_sec_km / 60, 4) if pace_sec_km else None)  # store pace as min/km in speed col
-            )
-            if elapsed_s:
-                total_cardio_seconds += int(elapsed_s)
-            if current_weight and distance:
-                # ~1.036 kcal per kg per km for running
-                total_calories += float(distance) * float(current_weight) * 1.036
-    elif is_hiit_cardio:
-        exercise_ids = request.form.getlist('exercise_id')
-        for eid in exercise_ids:
-            set_nums = request.form.getlist(f'set_num_{eid}')
-            for i, sn in enumerate(set_nums):
-                sprint_s = request.form.getlist(f'time_{eid}')[i] if request.form.getlist(f'time_{eid}') else None
-                rest_s = request.form.getlist(f'incline_{eid}')[i] if request.form.getlist(f'incline_{eid}') else None
-                conn.execute('INSERT INTO workout_exercise_logs (session_id,exercise_id,set_number,set_type,time_seconds,incline,speed) VALUES (?,?,?,?,?,?,?)',
-                    (sid, eid, int(sn), 'interval',
-                     int(sprint_s) if sprint_s else None,
-                     float(rest_s) if rest_s else None,
-                     None))
-                sprint_seconds = int(sprint_s) if sprint_s else 0
-                rest_seconds = int(float(rest_s)) if rest_s else 0
-                total_cardio_seconds += sprint_seconds + rest_seconds
-                if current_weight and (sprint_seconds > 0 or rest_seconds > 0):
-                    total_calories += estimate_hiit_interval_calories(current_weight, sprint_seconds, rest_seconds)
-    elif is_swimming:
-        exercise_ids = request.form.getlist('exercise_id')
-        for eid in exercise_ids[:1]:
-            swim_min = _safe_int(d.get(f'swim_min_{eid}')) or 0
-            swim_sec = _safe_int(d.get(f'swim_sec_{eid}')) or 0
-            elapsed_seconds = max((swim_min * 60) + swim_sec, 0)
-            distance_m = _safe_float(d.get(f'distance_m_{eid}'))
-            laps = _safe_int(d.get(f'swim_laps_{eid}'))
-            stroke = (d.get(f'swim_stroke_{eid}') or '').strip()
-            swim_notes = []
-            if stroke:
-                swim_notes.append(stroke)
-            if laps:
-                swim_notes.append(f'{laps} laps')
-            conn.execute('''
-                INSERT INTO workout_exercise_logs (
-                    session_id, exercise_id, set_number, set_type, time_seconds, distance_km, notes
-                ) VALUES (?,?,?,?,?,?,?)
-            ''', (
-                sid,
-                eid,
-                1,
-                'interval',
-                elapsed_seconds if elapsed_seconds else None,
-                round(distance_m / 1000, 4) if distance_m else None,
-                ' · '.join(swim_notes) if swim_notes else None,
-            ))
             if elapsed_seconds:
                 total_cardio_seconds += elapsed_seconds
-                if current_weight:
-                    total_calories += estimate_met_calories(current_weight, 8.3, elapsed_seconds / 60)
-    elif is_fitness_test:
-        exercise_ids = request.form.getlist('exercise_id')
-        test_name = (d.get('fitness_test_name') or 'Custom Test').strip()
-        distance_m = _safe_float(d.get('fitness_distance_m'))
-        beep_level = _safe_float(d.get('fitness_beep_level'))
-        beep_shuttles = _safe_int(d.get('fitness_beep_shuttles'))
-        elapsed_minutes = _safe_float(d.get('fitness_time_minutes'))
-        result_notes = (d.get('fitness_result_notes') or '').strip()
-        if test_name == 'Cooper 12-Min' and elapsed_minutes is None:
-            elapsed_minutes = 12
-        elapsed_seconds = int(round(elapsed_minutes * 60)) if elapsed_minutes else None
-
-        summary_parts = [test_name]
-        if distance_m is not None:
-            summary_parts.append(f'{distance_m:g} m')
-        if beep_level is not None:
-            summary_parts.append(f'Level {beep_level:g}')
-        if beep_shuttles is not None:
-            summary_parts.append(f'{beep_shuttles} shuttles')
-        if elapsed_minutes is not None:
-            summary_parts.append(f'{elapsed_minutes:g} min')
-        if result_notes:
-            summary_parts.append(result_notes)
-
-        if exercise_ids:
-            conn.execute('''
-                INSERT INTO workout_exercise_logs (
-                    session_id, exercise_id, set_number, set_type, time_seconds, distance_km, notes
-                ) VALUES (?,?,?,?,?,?,?)
-            ''', (
-                sid,
-                exercise_ids[0],
-                1,
-                'interval',
-                elapsed_seconds,
-                round(distance_m / 1000, 4) if distance_m else None,
-                ' | '.join(summary_parts),
-            ))
-
-        if elapsed_seconds:
-            total_cardio_seconds += elapsed_seconds
 
-        vo2_method = None
-        if test_name in {'Beep Test', 'Pacer Test'} and beep_level is not None:
-            vo2_method = 'beep'
-        elif test_name == 'Cooper 12-Min' and distance_m is not None:
-            vo2_method = 'cooper'
-
-        if vo2_method:
-            vo2_max = calculate_vo2_max(vo2_method, {
-                'distance_m': distance_m,
-                'beep_level': beep_level,
-                'beep_shuttles': beep_shuttles,
-            })
-            if vo2_max is not None:
-                conn.execute('''
-                    INSERT INTO vo2_tests (
-                        test_date, method, vo2_max, distance_m, beep_level, beep_shuttles, notes
-                    ) VALUES (?,?,?,?,?,?,?)
-                ''', (
-                    d['session_date'],
-                    vo2_method,
-                    vo2_max,
-                    distance_m,
-                    beep_level,
-                    beep_shuttles,
-                    f'Auto-logged from Fitness Test session: {test_name}',
-                ))
-                summary_parts.append(f'VO2 {vo2_max:.2f}')
-
-        summary_text = 'Test summary: ' + ' | '.join(summary_parts)
-        existing_notes = (d.get('notes') or '').strip()
-        conn.execute('UPDATE workout_sessions SET notes=? WHERE id=?', (
-            f'{existing_notes}\n{summary_text}'.strip() if existing_notes else summary_text,
-            sid,
-        ))
-    else:
-        exercise_ids = request.form.getlist('exercise_id')
-        for eid in exercise_ids:
-            set_nums = request.form.getlist(f'set_num_{eid}')
-            for i, sn in enumerate(set_nums):
-                set_type = request.form.getlist(f'set_type_{eid}')[i] if request.form.getlist(f'set_type_{eid}') else 'working'
-                reps = request.form.getlist(f'reps_{eid}')[i] if request.form.getlist(f'reps_{eid}') else None
-                weight = request.form.getlist(f'weight_{eid}')[i] if request.form.getlist(f'weight_{eid}') else None
-                time_s = request.form.getlist(f'time_{eid}')[i] if request.form.getlist(f'time_{eid}') else None
-                incline = request.form.getlist(f'incline_{eid}')[i] if request.form.getlist(f'incline_{eid}') else None
-                speed = request.form.getlist(f'speed_{eid}')[i] if request.form.getlist(f'speed_{eid}') else None
-                conn.execute('INSERT INTO workout_exercise_logs (session_id,exercise_id,set_number,set_type,reps,weight_kg,time_seconds,incline,speed) VALUES (?,?,?,?,?,?,?,?,?)',
-                    (sid, eid, int(sn), set_type,
-                     int(reps) if reps else None, float(weight) if weight else None,
-                     int(time_s) if time_s else None, float(incline) if incline else None,
-                     float(speed) if speed else None))
-                if workout_type and workout_type['is_cardio'] and time_s:
-                    total_cardio_seconds += int(time_s)
-                if workout_type and workout_type['is_cardio'] and current_weight and time_s and speed:
-                    total_calories += estimate_treadmill_interval_calories(
-                        current_weight,
-                        float(speed),
-                        float(incline) if incline else 0,
-                        int(time_s),
-                        profile['age'] if profile and profile['age'] else None,
-                        profile['height_cm'] if profile and profile['height_cm'] else None,
-                    )
-
-    stretch_ids = sorted({sid for sid in request.form.getlist('stretch_id') if sid}, key=int)
-    for stretch_id in stretch_ids:
-        stretch = conn.execute('SELECT tracking_type FROM workout_stretches WHERE id=?', (stretch_id,)).fetchone()
-        completed = 1 if request.form.get(f'stretch_done_{stretch_id}') else 0
-        values = request.form.getlist(f'stretch_value_{stretch_id}')
-        set_numbers = request.form.getlist(f'stretch_set_num_{stretch_id}')
-        notes = request.form.get(f'stretch_notes_{stretch_id}') or None
-        saved_any = False
-        for index, raw_value in enumerate(values):
-            amount = raw_value or None
-            duration = int(amount) if amount and stretch and stretch['tracking_type'] == 'seconds' else None
-            if amount:
-                conn.execute('INSERT INTO session_stretch_logs (session_id,stretch_id,set_number,completed,amount,duration_seconds,notes) VALUES (?,?,?,?,?,?,?)',
-                    (sid, int(stretch_id), int(set_numbers[index]) if index < len(set_numbers) else index + 1,
-                     completed, int(amount), duration, notes))
+            vo2_method = None
+            if test_name in {'Beep Test', 'Pacer Test'} and beep_level is not None:
+                vo2_method = 'beep'
+            elif test_name == 'Cooper 12-Min' and distance_m is not None:
+                vo2_method = 'cooper'
+
+            if vo2_method:
+                vo2_max = calculate_vo2_max(vo2_method, {
+                    'distance_m': distance_m,
+                    'beep_level': beep_level,
+                    'beep_shuttles': beep_shuttles,
+                })
+                if vo2_max is not None:
+                    vo2_row = (session_date, vo2_method, vo2_max, distance_m, beep_level, beep_shuttles,
+                               f'Auto-logged from Fitness Test session: {test_name}')
+                    summary_parts.append(f'VO2 {vo2_max:.2f}')
+
+            summary_text = 'Test summary: ' + ' | '.join(summary_parts)
+            existing_notes = (session_notes or '').strip()
+            session_notes = f'{existing_notes}\n{summary_text}'.strip() if existing_notes else summary_text
+        else:
+            for eid in exercise_ids:
+                for record in parse_gym_session_sets(fields, eid):
+                    log_rows.append(record)
+                    time_s = record['time_seconds']
+                    if workout_type['is_cardio'] and time_s:
+                        total_cardio_seconds += time_s
+                    if workout_type['is_cardio'] and current_weight and time_s and record['speed']:
+                        total_calories += estimate_treadmill_interval_calories(
+                            current_weight,
+                            record['speed'],
+                            record['incline'] or 0,
+                            time_s,
+                            profile['age'] if profile and profile['age'] else None,
+                            profile['height_cm'] if profile and profile['height_cm'] else None,
+                        )
+
+        stretch_ids = sorted({int(stretch_id) for stretch_id in fields.get('stretch_id') or [] if stretch_id})
+        tracking_types = {}
+        if stretch_ids:
+            placeholders = ','.join('?' for _ in stretch_ids)
+            tracking_types = {
+                row['id']: row['tracking_type']
+                for row in conn.execute(f'SELECT id, tracking_type FROM workout_stretches WHERE id IN ({placeholders})', stretch_ids).fetchall()
+            }
+        for stretch_id in stretch_ids:
+            completed = 1 if field(f'stretch_done_{stretch_id}') else 0
+            set_numbers = fields.get(f'stretch_set_num_{stretch_id}') or []
+            notes = field(f'stretch_notes_{stretch_id}') or None
+            saved_any = False
+            for index, raw_value in enumerate(fields.get(f'stretch_value_{stretch_id}') or []):
+                amount = _optional_number(raw_value, int)
+                if amount is None:
+                    continue
+                duration = amount if tracking_types.get(stretch_id) == 'seconds' else None
+                set_number = int(set_numbers[index]) if index < len(set_numbers) else index + 1
+                stretch_rows.append((stretch_id, set_number, completed, amount, duration, notes))
                 saved_any = True
-        if not saved_any and (completed or notes):
-            conn.execute('INSERT INTO session_stretch_logs (session_id,stretch_id,set_number,completed,amount,duration_seconds,notes) VALUES (?,?,?,?,?,?,?)',
-                (sid, int(stretch_id), 1, completed, None, None, notes))
+            if not saved_any and (completed or notes):
+                stretch_rows.append((stretch_id, 1, completed, None, None, notes))
+    except (TypeError, ValueError):
+        conn.close()
+        return _gym_session_save_error('Some set values are not valid.', workout_type['id'])
 
-    computed_duration = d.get('duration_minutes') or None
-    if workout_type and workout_type['is_cardio'] and total_cardio_seconds > 0:
+    computed_duration = field('duration_minutes') or None
+    if workout_type['is_cardio'] and total_cardio_seconds > 0:
         computed_duration = round(total_cardio_seconds / 60, 1)
         if float(computed_duration).is_integer():
             computed_duration = int(computed_duration)
+    calories_burned = round(total_calories, 1) if total_calories > 0 else 0
 
-    if computed_duration is not None or total_calories > 0:
-        conn.execute('UPDATE workout_sessions SET duration_minutes=?, calories_burned=? WHERE id=?',
-            (computed_duration, round(total_calories, 1) if total_calories > 0 else 0, sid))
+    cur = conn.cursor()
+    cur.execute('INSERT INTO workout_sessions (workout_type_id,session_date,duration_minutes,calories_burned,notes) VALUES (?,?,?,?,?)',
+        (workout_type['id'], session_date, computed_duration, calories_burned, session_notes))
+    sid = cur.lastrowid
+    if log_rows:
+        conn.executemany(
+            f"INSERT INTO workout_exercise_logs ({','.join(GYM_LOG_COLUMNS)}) VALUES ({','.join('?' for _ in GYM_LOG_COLUMNS)})",
+            [(sid,) + tuple(row.get(column) for column in GYM_LOG_COLUMNS[1:]) for row in log_rows]
+        )
+    if stretch_rows:
+        conn.executemany(
+            'INSERT INTO session_stretch_logs (session_id,stretch_id,set_number,completed,amount,duration_seconds,notes) VALUES (?,?,?,?,?,?,?)',
+            [(sid,) + row for row in stretch_rows]
+        )
+    if vo2_row:
+        conn.execute('''
+            INSERT INTO vo2_tests (
+                test_date, method, vo2_max, distance_m, beep_level, beep_shuttles, notes
+            ) VALUES (?,?,?,?,?,?,?)
+        ''', vo2_row)
+    if workout_type['is_cardio']:
+        recompute_cardio_session_metrics(conn, [sid])
+    refresh_exercise_session_best(conn, [sid])
+    refresh_exercise_last_performance(conn, session_exercise_name_keys(conn, [sid]))
     conn.commit()
     conn.close()
+    if request.is_json:
+        return jsonify({
+            'success': True,
+            'session_id': sid,
+            'sets_logged': len(log_rows),
+            'stretches_logged': len(stretch_rows),
+            'calories_burned': calories_burned,
+            'duration_minutes': computed_duration,
+        })
     if total_calories > 0:
         flash(f'Workout saved! Estimated calories burned: {round(total_calories, 1)} kcal', 'success')
     else:
@@ -3113,8 +4504,10 @@ def body_stats_add():
     else:
         conn.execute('INSERT INTO body_stats (log_date,weight_kg,body_fat_percentage,notes) VALUES (?,?,?,?)',
             (d['log_date'], float(d['weight_kg']), float(d['body_fat']) if d.get('body_fat') else None, d.get('notes')))
+    invalidate_weight_index(conn)
     conn.commit()
     conn.close()
+    request_cardio_metrics_recompute()
     flash('Weight logged!', 'success')
     return redirect(url_for('gym'))
 
@@ -3122,8 +4515,10 @@ def body_stats_add():
 def body_stats_delete(entry_id):
     conn = get_db()
     conn.execute('DELETE FROM body_stats WHERE id=?', (entry_id,))
+    invalidate_weight_index(conn)
     conn.commit()
     conn.close()
+    request_cardio_metrics_recompute()
     flash('Weight entry deleted.', 'success')
     return redirect(url_for('gym'))
 
@@ -3165,34 +4560,15 @@ def gym_profile_save():
             (float(d['height_cm']) if d.get('height_cm') else None, int(d['age']) if d.get('age') else None))
     conn.commit()
     conn.close()
+    request_cardio_metrics_recompute()
     flash('Profile saved!', 'success')
     return redirect(url_for('gym'))
 
 @app.route('/gym/progress-data')
 def gym_progress_data():
     conn = get_db()
-    exercises = conn.execute('SELECT DISTINCT e.id, e.name, e.muscle_group FROM exercises e JOIN workout_exercise_logs wel ON wel.exercise_id=e.id WHERE e.is_cardio=0').fetchall()
-    result = {}
-    for ex in exercises:
-        logs = conn.execute('''
-            SELECT ws.session_date, wel.weight_kg, wel.reps
-            FROM workout_exercise_logs wel JOIN workout_sessions ws ON wel.session_id=ws.id
-            WHERE wel.exercise_id=? AND wel.set_type='working' AND wel.weight_kg > 0
-            ORDER BY ws.session_date
-        ''', (ex['id'],)).fetchall()
-        if logs:
-            best_logs_by_date = {}
-            for log in logs:
-                if is_better_strength_set(log, best_logs_by_date.get(log['session_date'])):
-                    best_logs_by_date[log['session_date']] = log
-            group = normalize_muscle_group(ex['muscle_group'])
-            if group in {'Uncategorized', 'Core'}:
-                continue
-            result.setdefault(group, {})[ex['name']] = [
-                {'date': session_date, '1rm': round(calc_1rm(log['weight_kg'], log['reps']), 1)}
-                for session_date, log in sorted(best_logs_by_date.items())
-                if log['reps']
-            ]
+    ensure_exercise_session_best(conn)
+    result = load_exercise_progress_series(conn)
     conn.close()
     return jsonify(result)
 
@@ -3208,18 +4584,42 @@ def financial():
     conn.close()
     return render_template('financial.html', **payload)
 
+@app.route('/api/financial/transactions')
+def api_financial_transactions():
+    try:
+        filters = parse_transaction_filters(request.args)
+        cursor = parse_transaction_cursor(request.args.get('cursor'))
+        limit = min(max(int(request.args.get('limit') or TRANSACTION_PAGE_SIZE), 1), TRANSACTION_PAGE_MAX)
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+    conn = get_db()
+    ensure_finance_rollups(conn)
+    rows, next_cursor, total = load_transaction_page(conn, filters, cursor, limit)
+    conn.close()
+    return jsonify({
+        'items': [dict(row) for row in rows],
+        'next_cursor': next_cursor,
+        'total': total,
+    })
+
 @app.route('/financial/add', methods=['POST'])
 def financial_add():
     d = request.form
     conn = get_db()
+    transaction_date = d.get('transaction_date') or date.today().isoformat()
+    touched_dates = [transaction_date]
     if d.get('transaction_id'):
+        previous = conn.execute('SELECT transaction_date FROM transactions WHERE id=?', (d['transaction_id'],)).fetchone()
+        if previous:
+            touched_dates.append(previous['transaction_date'])
         conn.execute('UPDATE transactions SET transaction_date=?, type=?, category_id=?, account_id=?, transport_mode=?, amount=?, description=?, notes=? WHERE id=?',
-            (d.get('transaction_date') or date.today().isoformat(), d['type'], d.get('category_id') or None, d.get('account_id') or None,
+            (transaction_date, d['type'], d.get('category_id') or None, d.get('account_id') or None,
              d.get('transport_mode') or 'general', d['amount'], d['description'], d.get('notes'), d['transaction_id']))
     else:
         conn.execute('INSERT INTO transactions (transaction_date,type,category_id,account_id,transport_mode,amount,description,notes) VALUES (?,?,?,?,?,?,?,?)',
-            (d.get('transaction_date') or date.today().isoformat(), d['type'], d.get('category_id') or None, d.get('account_id') or None,
+            (transaction_date, d['type'], d.get('category_id') or None, d.get('account_id') or None,
              d.get('transport_mode') or 'general', d['amount'], d['description'], d.get('notes')))
+    refresh_finance_rollups(conn, touched_dates)
     conn.commit()
     conn.close()
     return redirect(url_for('financial'))
@@ -3227,7 +4627,10 @@ def financial_add():
 @app.route('/financial/delete/<int:txn_id>', methods=['POST'])
 def financial_delete(txn_id):
     conn = get_db()
+    previous = conn.execute('SELECT transaction_date FROM transactions WHERE id=?', (txn_id,)).fetchone()
     conn.execute('DELETE FROM transactions WHERE id=?', (txn_id,))
+    if previous:
+        refresh_finance_rollups(conn, [previous['transaction_date']])
     conn.commit()
     conn.close()
     return redirect(url_for('financial'))
@@ -3290,6 +4693,7 @@ def financial_account_save():
     projection_months = request.form.get('finance_projection_months')
     if projection_months and str(projection_months).isdigit():
         conn.execute('INSERT OR REPLACE INTO app_settings (setting_key, setting_value) VALUES (?, ?)', ('finance_projection_months', str(int(projection_months))))
+    invalidate_settings_cache(conn)
     conn.commit()
     conn.close()
     return redirect(url_for('financial'))
@@ -3313,6 +4717,7 @@ def financial_recurring_add():
         1 if d.get('auto_add') else 0,
         d.get('notes') or None,
     ))
+    invalidate_recurring_projection(conn)
     conn.commit()
     conn.close()
     return redirect(url_for('financial'))
@@ -3323,6 +4728,7 @@ def financial_recurring_toggle(rid):
     row = conn.execute('SELECT is_active FROM recurring_payments WHERE id=?', (rid,)).fetchone()
     if row:
         conn.execute('UPDATE recurring_payments SET is_active=? WHERE id=?', (0 if row['is_active'] else 1, rid))
+        invalidate_recurring_projection(conn)
     conn.commit()
     conn.close()
     return redirect(url_for('financial'))
@@ -3347,7 +4753,14 @@ def financial_budget_add():
 def diet():
     conn = get_db()
     selected_date = request.args.get('date') or date.today().isoformat()
-    payload = build_diet_payload(conn, selected_date)
+    try:
+        selected_date = datetime.strptime(selected_date, '%Y-%m-%d').date().isoformat()
+    except ValueError:
+        selected_date = date.today().isoformat()
+    chart_days = request.args.get('chart_days', default=DIET_CHART_DEFAULT_DAYS, type=int)
+    if chart_days not in DIET_CHART_DAY_OPTIONS:
+        chart_days = DIET_CHART_DEFAULT_DAYS
+    payload = build_diet_payload(conn, selected_date, chart_days)
     conn.close()
     return render_template('diet.html', today=date.today().isoformat(), **payload)
 
@@ -3461,6 +4874,7 @@ def diet_settings_save():
     conn = get_db()
     for key in ['diet_height_cm', 'diet_body_fat_pct', 'diet_sex', 'diet_awake_hours_override']:
         conn.execute('INSERT OR REPLACE INTO app_settings (setting_key,setting_value) VALUES (?,?)', (key, d.get(key, '')))
+    invalidate_settings_cache(conn)
     conn.commit()
     conn.close()
     return redirect(url_for('diet', date=d.get('selected_date') or date.today().isoformat()))
@@ -3507,6 +4921,7 @@ def meal_plan_dish_add():
             float(calories[idx]) if idx < len(calories) and calories[idx] else 0,
             1 if str(idx) in grocery_flags else 0,
         ))
+    refresh_meal_plan_dish_totals(conn, [dish_id])
     conn.commit()
     conn.close()
     return redirect(url_for('meal_plan'))
@@ -3543,7 +4958,7 @@ def meal_plan_entry_toggle(entry_id):
 def meal_plan_entry_eat(entry_id):
     conn = get_db()
     entry = conn.execute('''
-        SELECT mpe.*, mpd.name as dish_name
+        SELECT mpe.*, mpd.name as dish_name, mpd.cost_per_serving, mpd.calories_per_serving
         FROM meal_plan_entries mpe
         JOIN meal_plan_dishes mpd ON mpd.id = mpe.dish_id
         WHERE mpe.id=?
@@ -3553,10 +4968,9 @@ def meal_plan_entry_eat(entry_id):
         flash('Meal plan entry not found.', 'error')
         return redirect(url_for('meal_plan'))
 
-    ingredients = conn.execute('SELECT * FROM meal_plan_ingredients WHERE dish_id=?', (entry['dish_id'],)).fetchall()
     servings = float(entry['servings'] or 1)
-    total_calories = sum(float(row['calories'] or 0) * servings for row in ingredients)
-    total_cost = sum(float(row['estimated_cost'] or 0) * servings for row in ingredients)
+    total_calories = float(entry['calories_per_serving'] or 0) * servings
+    total_cost = float(entry['cost_per_serving'] or 0) * servings
     protein_est = round(total_calories * 0.08 / 4, 1) if total_calories else 0
     carbs_est = round(total_calories * 0.50 / 4, 1) if total_calories else 0
     fat_est = round(total_calories * 0.25 / 9, 1) if total_calories else 0
@@ -3743,13 +5157,16 @@ def todos_add():
             else:
                 conn.execute('UPDATE todos SET title=?, description=?, priority=?, due_date=?, due_time=?, category=? WHERE id=?',
                     (d['title'], d.get('description'), d.get('priority','medium'), d.get('due_date') or None, d.get('due_time') or None, d.get('category'), d['todo_id']))
+            saved_todo_id = int(d['todo_id'])
         else:
             if has_parent_column:
-                conn.execute('INSERT INTO todos (title,description,priority,due_date,due_time,category,parent_todo_id) VALUES (?,?,?,?,?,?,?)',
+                cur = conn.execute('INSERT INTO todos (title,description,priority,due_date,due_time,category,parent_todo_id) VALUES (?,?,?,?,?,?,?)',
                     (d['title'], d.get('description'), d.get('priority','medium'), d.get('due_date') or None, d.get('due_time') or None, d.get('category'), parent_todo_id))
             else:
-                conn.execute('INSERT INTO todos (title,description,priority,due_date,due_time,category) VALUES (?,?,?,?,?,?)',
+                cur = conn.execute('INSERT INTO todos (title,description,priority,due_date,due_time,category) VALUES (?,?,?,?,?,?)',
                     (d['title'], d.get('description'), d.get('priority','medium'), d.get('due_date') or None, d.get('due_time') or None, d.get('category')))
+            saved_todo_id = cur.lastrowid
+        sync_todo_notifications(conn, [saved_todo_id])
         conn.commit()
     except Exception:
         conn.rollback()
@@ -3761,6 +5178,7 @@ def todos_add():
 def todos_complete(tid):
     conn = get_db()
     conn.execute('UPDATE todos SET status="completed", completed_at=datetime("now") WHERE id=?', (tid,))
+    sync_todo_notifications(conn, [tid])
     conn.commit()
     conn.close()
     return redirect(url_for('todos'))
@@ -3769,6 +5187,7 @@ def todos_complete(tid):
 def todos_reopen(tid):
     conn = get_db()
     conn.execute('UPDATE todos SET status="pending", completed_at=NULL WHERE id=?', (tid,))
+    sync_todo_notifications(conn, [tid])
     conn.commit()
     conn.close()
     return redirect(url_for('todos'))
@@ -3791,6 +5210,7 @@ def todos_delete(tid):
         ''', (tid,))
     else:
         conn.execute('DELETE FROM todos WHERE id=?', (tid,))
+    prune_todo_notifications(conn)
     conn.commit()
     conn.close()
     return redirect(url_for('todos'))
@@ -4006,11 +5426,8 @@ def nap_delete(nap_id):
 
 # ===== WATER =====
 def _get_hydration_weight_kg(conn, log_date):
-    row = conn.execute(
-        'SELECT weight_kg FROM body_stats WHERE log_date <= ? ORDER BY log_date DESC LIMIT 1',
-        (log_date,)
-    ).fetchone()
-    return float(row['weight_kg']) if row and row['weight_kg'] else 80.0
+    weight = weight_as_of(load_weight_index(conn), log_date)
+    return float(weight) if weight else 80.0
 
 def _build_even_slots(start_dt, end_dt, total_ml, start_index):
     if end_dt <= start_dt or total_ml <= 0:
@@ -4046,18 +5463,19 @@ def _build_water_plan(conn, log_date, wake_time, is_fasting, sweat_factor):
         lon = (settings.get('notif_longitude') or '').strip()
         method = int(settings.get('notif_prayer_method', '4') or '4')
 
-        try:
-            if lat and lon:
+        iftar_dt = combine_date_and_time(day, '19:00')
+        fajr_next_dt = combine_date_and_time(day + timedelta(days=1), '05:00')
+        prayer_times_note = 'Iftar and Fajr assumed at 19:00 and 05:00: set a prayer location in Settings for real times.'
+        if lat and lon:
+            try:
                 todays = fetch_prayer_timings(day, lat, lon, method)
                 tomorrow = fetch_prayer_timings(day + timedelta(days=1), lat, lon, method)
-                iftar_dt = combine_date_and_time(day, todays.get('Maghrib') or '19:00')
-                fajr_next_dt = combine_date_and_time(day + timedelta(days=1), tomorrow.get('Fajr') or '05:00')
-            else:
-                iftar_dt = combine_date_and_time(day, '19:00')
-                fajr_next_dt = combine_date_and_time(day + timedelta(days=1), '05:00')
-        except Exception:
-            iftar_dt = combine_date_and_time(day, '19:00')
-            fajr_next_dt = combine_date_and_time(day + timedelta(days=1), '05:00')
+                iftar_dt = combine_date_and_time(day, todays['Maghrib'])
+                fajr_next_dt = combine_date_and_time(day + timedelta(days=1), tomorrow['Fajr'])
+                prayer_times_note = None
+            except (LookupError, ValueError, TypeError) as exc:
+                app.logger.warning('Water plan for %s: no prayer times (%s)', log_date, exc)
+                prayer_times_note = f'Iftar and Fajr assumed at 19:00 and 05:00 because prayer times are unavailable: {exc}.'
 
         sleep_row = conn.execute('SELECT sleep_time FROM sleep_logs WHERE sleep_date=?', (log_date,)).fetchone()
         sleep_time = sleep_row['sleep_time'] if sleep_row and sleep_row['sleep_time'] else '23:30'
@@ -4078,6 +5496,8 @@ def _build_water_plan(conn, log_date, wake_time, is_fasting, sweat_factor):
             'Iftar to bed: 60% of target, steady sipping every hour.',
             'Suhoor window: 40% of target with electrolytes for retention.',
         ]
+        if prayer_times_note:
+            phase_summary.append(prayer_times_note)
         mode_label = 'Fasting Mode'
     else:
         awake_hours = float(settings.get('hydration_awake_hours') or 16)
@@ -4179,6 +5599,7 @@ def _create_water_schedule(conn, log_date, wake_time, is_fasting, sweat_factor=F
         (log_date, wake_time, 1 if is_fasting else 0, total))
     conn.execute('UPDATE water_logs SET sweat_factor=? WHERE log_date=?', (1 if sweat_factor else 0, log_date))
     conn.executemany('INSERT OR IGNORE INTO water_hourly (log_date,hour_label,slot_index,target_ml,completed) VALUES (?,?,?,?,?)', slots)
+    sync_water_notifications(conn, log_date)
     conn.commit()
 
 @app.route('/water/toggle', methods=['POST'])
@@ -4194,6 +5615,7 @@ def water_toggle():
         # Update total
         total = conn.execute('SELECT SUM(target_ml) as t FROM water_hourly WHERE log_date=? AND completed=1', (ld,)).fetchone()['t'] or 0
         conn.execute('UPDATE water_logs SET total_ml=? WHERE log_date=?', (total, ld))
+        sync_water_notifications(conn, ld)
         conn.commit()
     conn.close()
     return jsonify({'success': True})
@@ -4235,6 +5657,7 @@ def water_wake_time():
     target_date = d.get('log_date') or date.today().isoformat()
     conn = get_db()
     conn.execute("INSERT OR REPLACE INTO app_settings (setting_key,setting_value) VALUES ('wake_time',?)", (wt,))
+    invalidate_settings_cache(conn)
     existing = conn.execute('SELECT is_fasting, sweat_factor FROM water_logs WHERE log_date=?', (target_date,)).fetchone()
     conn.execute('DELETE FROM water_hourly WHERE log_date=?', (target_date,))
     conn.execute('DELETE FROM water_logs WHERE log_date=?', (target_date,))
@@ -4255,6 +5678,7 @@ def water_delete(log_date):
     conn = get_db()
     conn.execute('DELETE FROM water_hourly WHERE log_date=?', (log_date,))
     conn.execute('DELETE FROM water_logs WHERE log_date=?', (log_date,))
+    conn.execute("DELETE FROM notification_queue WHERE source_type='water' AND queue_date=?", (log_date,))
     conn.commit()
     conn.close()
     flash('Water log deleted.', 'success')
@@ -4277,8 +5701,11 @@ def notifications_settings_save():
     conn = get_db()
     for key, val in settings_payload.items():
         conn.execute('INSERT OR REPLACE INTO app_settings (setting_key,setting_value) VALUES (?,?)', (key, val))
+    invalidate_settings_cache(conn)
+    invalidate_notification_queue(conn)
     conn.commit()
     conn.close()
+    request_prayer_prefetch()
     flash('Notification settings saved.', 'success')
     return redirect(request.referrer or url_for('dashboard'))
 
@@ -4373,6 +5800,8 @@ def deen_prayers_save():
     conn.execute('INSERT OR REPLACE INTO prayer_logs (prayer_date,fajr,dhuhr,asr,maghrib,isha) VALUES (?,?,?,?,?,?)',
         (prayer_date, 1 if d.get('fajr') else 0, 1 if d.get('dhuhr') else 0,
          1 if d.get('asr') else 0, 1 if d.get('maghrib') else 0, 1 if d.get('isha') else 0))
+    if prayer_date == date.today().isoformat():
+        sync_prayer_notifications(conn, get_settings())
     conn.commit()
     conn.close()
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -4880,9 +6309,10 @@ def important_dates():
 def dates_add():
     d = request.form
     conn = get_db()
-    conn.execute('INSERT INTO important_dates (title,event_date,event_type,reminder_days_before,is_recurring,notes) VALUES (?,?,?,?,?,?)',
+    cur = conn.execute('INSERT INTO important_dates (title,event_date,event_type,reminder_days_before,is_recurring,notes) VALUES (?,?,?,?,?,?)',
         (d['title'], d['event_date'], d.get('event_type','other'), int(d.get('reminder_days',0)),
          1 if d.get('is_recurring') else 0, d.get('notes')))
+    sync_date_notifications(conn, [cur.lastrowid])
     conn.commit()
     conn.close()
     return redirect(url_for('important_dates'))
@@ -4891,6 +6321,7 @@ def dates_add():
 def dates_delete(did):
     conn = get_db()
     conn.execute('DELETE FROM important_dates WHERE id=?', (did,))
+    sync_date_notifications(conn, [did])
     conn.commit()
     conn.close()
     return redirect(url_for('important_dates'))
@@ -5074,6 +6505,7 @@ def chess_settings_save():
         return redirect(url_for('chess'))
     conn = get_db()
     conn.execute('INSERT OR REPLACE INTO app_settings (setting_key, setting_value) VALUES (?, ?)', ('chess_base_elo', str(base_elo)))
+    invalidate_settings_cache(conn)
     conn.commit()
     conn.close()
     flash('Chess settings saved.', 'success')
@@ -5092,6 +6524,7 @@ def settings():
         WHERE e.is_active=1 AND e.is_cardio=0
         ORDER BY e.name, wt.name
     ''').fetchall()
+    sync_cursor, sync_instance = load_sync_clock(conn)
     conn.close()
     exercises_for_benchmarks = []
     for row in benchmark_rows:
@@ -5107,7 +6540,13 @@ def settings():
             'intermediate_1rm': row['intermediate_1rm'],
             'advanced_1rm': row['advanced_1rm'],
         })
-    return render_template('settings.html', settings=get_settings(), exercises_for_benchmarks=exercises_for_benchmarks)
+    settings_values = get_settings()
+    return render_template(
+        'settings.html',
+        settings=settings_values,
+        exercises_for_benchmarks=exercises_for_benchmarks,
+        gym_sync={'instance': sync_instance, 'cursor': sync_cursor, 'sources': load_gym_sync_sources(settings_values)},
+    )
 
 @app.route('/settings/save', methods=['POST'])
 def settings_save():
@@ -5123,6 +6562,21 @@ def settings_save():
     ]
     journal_bool_keys = ['journal_night_after_midnight_to_yesterday']
 
+    timezone_value = (d.get('notif_timezone') or '').strip()
+    if timezone_value:
+        try:
+            ZoneInfo(timezone_value)
+        except (ZoneInfoNotFoundError, ValueError):
+            conn.close()
+            flash(f'Unknown timezone "{timezone_value}". Use an IANA name such as Asia/Riyadh.', 'error')
+            return redirect(url_for('settings'))
+    if 'notif_timezone' in d and timezone_value != (get_settings().get('notif_timezone') or ''):
+        # Offline timings were computed for the old zone.
+        conn.execute(
+            f"DELETE FROM prayer_times WHERE source IN ({','.join('?' for _ in OFFLINE_PRAYER_BACKENDS)})",
+            tuple(OFFLINE_PRAYER_BACKENDS),
+        )
+
     for key in notif_bool_keys + journal_bool_keys:
         val = 'true' if d.get(key) else 'false'
         conn.execute('INSERT OR REPLACE INTO app_settings (setting_key,setting_value) VALUES (?,?)', (key, val))
@@ -5131,9 +6585,13 @@ def settings_save():
         if key in notif_bool_keys or key in journal_bool_keys:
             continue
         db_key = 'currency_symbol' if key == 'currency' else key
-        conn.execute('INSERT OR REPLACE INTO app_settings (setting_key,setting_value) VALUES (?,?)', (db_key, d[key]))
+        value = timezone_value if key == 'notif_timezone' else d[key]
+        conn.execute('INSERT OR REPLACE INTO app_settings (setting_key,setting_value) VALUES (?,?)', (db_key, value))
+    invalidate_settings_cache(conn)
+    invalidate_notification_queue(conn)
     conn.commit()
     conn.close()
+    request_prayer_prefetch()
     flash('Settings saved!', 'success')
     return redirect(url_for('settings'))
 
@@ -5175,32 +6633,136 @@ def toggle_dark():
     cur = conn.execute("SELECT setting_value FROM app_settings WHERE setting_key='dark_mode'").fetchone()
     new_val = 'false' if cur and cur['setting_value'] == 'true' else 'true'
     conn.execute("INSERT OR REPLACE INTO app_settings (setting_key,setting_value) VALUES ('dark_mode',?)", (new_val,))
+    invalidate_settings_cache(conn)
     conn.commit()
     conn.close()
     return jsonify({'dark_mode': new_val})
 
 # ===== EXPORT =====
+EXPORT_TABLES = ['journal_entries','habits','habit_logs','workout_sessions','transactions','todos','sleep_logs','body_stats',
+                 'prayer_logs','quran_reading','goals','books','focus_sessions','water_logs','important_dates','reviews']
+EXPORT_FORMATS = {'json': 'application/json', 'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+EXPORT_BATCH_ROWS = 500
+
+def parse_export_since(value):
+    # Digits select rows by rowid, anything else is a created_at timestamp.
+    if not value:
+        return None, None
+    if value.isdigit():
+        return int(value), None
+    return None, datetime.fromisoformat(value).strftime('%Y-%m-%d %H:%M:%S')
+
+def export_table_cursor(conn, table, since_rowid=None, since_created=None):
+    clauses = []
+    params = []
+    if since_rowid is not None:
+        clauses.append('rowid>?')
+        params.append(since_rowid)
+    if since_created is not None:
+        columns = {row['name'] for row in conn.execute(f'PRAGMA table_info({table})').fetchall()}
+        if 'created_at' in columns:
+            clauses.append('created_at>=?')
+            params.append(since_created)
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ''
+    return conn.execute(f'SELECT * FROM {table}{where} ORDER BY rowid', params)
+
+def iter_export_rows(cursor):
+    columns = [column[0] for column in cursor.description]
+    while True:
+        rows = cursor.fetchmany(EXPORT_BATCH_ROWS)
+        if not rows:
+            return
+        yield columns, [dict(zip(columns, row)) for row in rows]
+
+def iter_export_chunks(conn, tables, fmt, since_rowid=None, since_created=None, single_table=False):
+    if fmt == 'json' and not single_table:
+        yield '{'
+    for table_index, table in enumerate(tables):
+        cursor = export_table_cursor(conn, table, since_rowid, since_created)
+        if fmt == 'json':
+            prefix = '' if single_table else f"{',' if table_index else ''}{json.dumps(table)}:"
+            yield prefix + '['
+            first = True
+            for _, rows in iter_export_rows(cursor):
+                yield ('' if first else ',') + ','.join(json.dumps(row) for row in rows)
+                first = False
+            yield ']'
+        elif fmt == 'ndjson':
+            for _, rows in iter_export_rows(cursor):
+                if single_table:
+                    yield ''.join(json.dumps(row) + '\n' for row in rows)
+                else:
+                    yield ''.join(json.dumps({'table': table, 'row': row}) + '\n' for row in rows)
+        else:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow([column[0] for column in cursor.description])
+            for columns, rows in iter_export_rows(cursor):
+                writer.writerows([row[column] for column in columns] for row in rows)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            if buffer.tell():
+                yield buffer.getvalue()
+    if fmt == 'json' and not single_table:
+        yield '}'
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    try:
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        chunks.close()
+
+def export_response(tables, download_name, single_table=False):
+    fmt = request.args.get('format', 'json')
+    if fmt not in EXPORT_FORMATS or (fmt == 'csv' and not single_table):
+        return jsonify({'error': 'Unsupported export format'}), 400
+    try:
+        since_rowid, since_created = parse_export_since(request.args.get('since'))
+    except ValueError:
+        return jsonify({'error': 'since must be a rowid or an ISO timestamp'}), 400
+    use_gzip = request.args.get('gzip') in ('1', 'true')
+
+    def generate():
+        conn = get_db()
+        # One read transaction so every table comes from the same snapshot.
+        if not conn.in_transaction:
+            conn.execute('BEGIN')
+        try:
+            for chunk in iter_export_chunks(conn, tables, fmt, since_rowid, since_created, single_table):
+                yield chunk.encode('utf-8')
+        finally:
+            conn.rollback()
+            conn.close()
+
+    body = generate()
+    filename = f'{download_name}.{fmt}'
+    mimetype = EXPORT_FORMATS[fmt]
+    if use_gzip:
+        body = gzip_chunks(body)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
 @app.route('/export/<table_name>')
 def export_data(table_name):
-    allowed = ['journal_entries','habits','habit_logs','workout_sessions','transactions','todos','sleep_logs',
-               'prayer_logs','quran_reading','goals','books','focus_sessions','water_logs','important_dates','reviews']
-    if table_name not in allowed:
+    if table_name not in EXPORT_TABLES:
         return jsonify({'error': 'Not allowed'}), 403
-    conn = get_db()
-    data = conn.execute(f'SELECT * FROM {table_name}').fetchall()
-    conn.close()
-    return jsonify([dict(r) for r in data])
+    return export_response([table_name], f'lifetracker-{table_name}-{date.today().isoformat()}', single_table=True)
 
 @app.route('/export/all')
 def export_all_data():
     conn = get_db()
     tables = [row['name'] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name").fetchall()]
-    payload = {}
-    for table in tables:
-        payload[table] = [dict(r) for r in conn.execute(f'SELECT * FROM {table}').fetchall()]
     conn.close()
-    return jsonify(payload)
-
+    return export_response(tables, f'lifetracker-export-{date.today().isoformat()}')
 
 @app.route('/backup/gym-progress')
 def backup_gym_progress():
@@ -5212,13 +6774,12 @@ def backup_gym_progress():
 
 @app.route('/backup/gym-sync')
 def backup_gym_sync():
+    try:
+        since = parse_sync_since(request.args.get('since'))
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
     conn = get_db()
-    payload = dump_tables(conn, GYM_SYNC_TABLES)
-    settings_rows = conn.execute(
-        f"SELECT setting_key, setting_value FROM app_settings WHERE setting_key IN ({','.join('?' for _ in GYM_SYNC_SETTING_KEYS)})",
-        tuple(GYM_SYNC_SETTING_KEYS),
-    ).fetchall()
-    payload['app_settings'] = [dict(row) for row in settings_rows]
+    payload = build_gym_sync_pack(conn, since)
     conn.close()
     return jsonify(payload)
 
@@ -5230,31 +6791,35 @@ def restore_gym_progress():
         flash('Please choose a Gym Progress JSON file first.', 'error')
         return redirect(url_for('settings'))
 
-    try:
-        incoming = json.loads(upload.read().decode('utf-8'))
-    except Exception:
-        flash('Invalid JSON file. Please upload a valid Gym Progress backup.', 'error')
-        return redirect(url_for('settings'))
-
-    if not isinstance(incoming, dict):
-        flash('Invalid backup format. Expected a JSON object of table data.', 'error')
-        return redirect(url_for('settings'))
-
+    started = time.perf_counter()
     conn = get_db()
     try:
         conn.execute('PRAGMA foreign_keys = OFF')
+        # The wipe is part of the restore, not a deletion to sync to other devices.
+        conn.execute('UPDATE sync_clock SET suppress_tombstones = 1 WHERE id = 1')
         for table in GYM_RESTORE_DELETE_ORDER:
             if table_exists(conn, table):
                 conn.execute(f'DELETE FROM {table}')
 
-        for table in GYM_PROGRESS_TABLES:
-            rows = incoming.get(table, [])
-            if not isinstance(rows, list):
-                continue
-            restore_table_rows(conn, table, rows)
-
-        conn.commit()
-        flash('Gym progress restored successfully.', 'success')
+        counts = bulk_restore_rows(conn, iter_backup_rows(upload.stream), set(GYM_PROGRESS_TABLES))
+        conn.execute('UPDATE sync_clock SET suppress_tombstones = 0 WHERE id = 1')
+        violations = foreign_key_violations(conn, GYM_PROGRESS_TABLES)
+        if violations:
+            conn.rollback()
+            detail = ', '.join(f'{table}: {count}' for table, count in violations.items())
+            flash(f'Backup has rows pointing at missing records ({detail}). Nothing was restored.', 'error')
+        else:
+            rebuild_exercise_session_best(conn)
+            rebuild_exercise_last_performance(conn)
+            invalidate_weight_index(conn)
+            conn.commit()
+            request_cardio_metrics_recompute()
+            report = format_restore_report(counts, started)
+            app.logger.info('Gym progress restore: %s', report)
+            flash(f'Gym progress restored successfully: {report}.', 'success')
+    except (ValueError, UnicodeDecodeError):
+        conn.rollback()
+        flash('Invalid JSON file. Please upload a valid Gym Progress backup.', 'error')
     except Exception:
         conn.rollback()
         flash('Could not restore gym progress from that file.', 'error')
@@ -5272,40 +6837,23 @@ def restore_gym_sync():
         flash('Please choose a gym sync JSON file first.', 'error')
         return redirect(url_for('settings'))
 
-    try:
-        incoming = json.loads(upload.read().decode('utf-8'))
-    except Exception:
-        flash('Invalid JSON file.', 'error')
-        return redirect(url_for('settings'))
-
-    if not isinstance(incoming, dict):
-        flash('Invalid sync payload format.', 'error')
-        return redirect(url_for('settings'))
-
+    started = time.perf_counter()
     conn = get_db()
     try:
-        conn.execute('DELETE FROM daily_steps')
-        conn.execute('DELETE FROM body_stats')
-        conn.execute(
-            f"DELETE FROM app_settings WHERE setting_key IN ({','.join('?' for _ in GYM_SYNC_SETTING_KEYS)})",
-            tuple(GYM_SYNC_SETTING_KEYS),
-        )
-
-        for table in GYM_SYNC_TABLES:
-            rows = incoming.get(table, [])
-            if isinstance(rows, list):
-                restore_table_rows(conn, table, rows)
-
-        settings_rows = incoming.get('app_settings', [])
-        if isinstance(settings_rows, list):
-            for row in settings_rows:
-                key = row.get('setting_key') if isinstance(row, dict) else None
-                value = row.get('setting_value') if isinstance(row, dict) else None
-                if key in GYM_SYNC_SETTING_KEYS:
-                    conn.execute('INSERT OR REPLACE INTO app_settings (setting_key, setting_value) VALUES (?, ?)', (key, value))
-
+        counts, unchanged, meta = merge_gym_sync_rows(conn, iter_backup_rows(upload.stream))
+        notes = record_gym_sync_source(conn, meta)
+        invalidate_settings_cache(conn)
+        invalidate_weight_index(conn)
         conn.commit()
-        flash('Gym sync import complete for weight, steps, and measurements.', 'success')
+        request_cardio_metrics_recompute()
+        report = format_restore_report(counts, started)
+        if unchanged:
+            report = f'{report}, {unchanged:,} unchanged'
+        app.logger.info('Gym sync import: %s', report)
+        flash(f"Gym sync import complete for weight, steps, and measurements: {'; '.join([report] + notes)}.", 'success')
+    except (ValueError, UnicodeDecodeError):
+        conn.rollback()
+        flash('Invalid JSON file.', 'error')
     except Exception:
         conn.rollback()
         flash('Could not import gym sync data.', 'error')
@@ -5316,13 +6864,48 @@ def restore_gym_sync():
 
 @app.route('/backup/database')
 def backup_database():
-    db_path = get_database_path()
-    return send_from_directory(
-        os.path.dirname(db_path),
-        os.path.basename(db_path),
-        as_attachment=True,
-        download_name=f"lifetracker-backup-{date.today().isoformat()}.db"
-    )
+    handle, path = tempfile.mkstemp(prefix='lifetracker-backup-', suffix='.db')
+    os.close(handle)
+    try:
+        write_snapshot(path)
+        size = os.path.getsize(path)
+    except Exception:
+        os.remove(path)
+        raise
+
+    snapshot = open(path, 'rb')
+
+    def stream():
+        while True:
+            chunk = snapshot.read(64 * 1024)
+            if not chunk:
+                break
+            yield chunk
+
+    # Windows can't unlink an open file, so remove the copy once the handle
+    # is closed; close runs even when the body is never read (HEAD, disconnect).
+    def discard_snapshot():
+        snapshot.close()
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    response = Response(stream(), mimetype='application/vnd.sqlite3')
+    response.call_on_close(discard_snapshot)
+    response.headers['Content-Length'] = str(size)
+    response.headers['Content-Disposition'] = f'attachment; filename="lifetracker-backup-{date.today().isoformat()}.db"'
+    return response
+
+@app.route('/api/db/pool-stats')
+def db_pool_stats():
+    return jsonify(get_pool_stats())
+
+if os.getenv('PRAYER_PREFETCH_ENABLED', 'true').lower() == 'true':
+    start_prayer_prefetcher()
+
+if os.getenv('DATABASE_SNAPSHOT_ENABLED', 'true').lower() == 'true':
+    start_snapshot_scheduler()
 
 if __name__ == '__main__':
     app.run(
@@ -2,33 +2,388 @@ import sqlite3
 from datetime import datetime, date
 import json
 import os
+import threading
+import time
+try:
+    import fcntl
+except ImportError:  # Windows dev boxes: fall back to the in-process lock only
+    fcntl = None
+from flask import g, has_app_context
 
 BASE_DIR = os.path.dirname(__file__)
 DATABASE = os.getenv('DATABASE_PATH', os.path.join(BASE_DIR, 'lifetracker.db'))
 FALLBACK_DATABASE = os.path.join(BASE_DIR, 'lifetracker.db')
 
+STORAGE_PROFILES = {
+    'wal': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 268435456,
+        'cache_size': -16000,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+        'wal_autocheckpoint': 1000,
+    },
+    'legacy': {
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+        'mmap_size': 0,
+        'cache_size': -2000,
+        'temp_store': 'DEFAULT',
+        'busy_timeout': 5000,
+        'wal_autocheckpoint': 1000,
+    },
+}
+
+
+def _load_storage_profile():
+    profile_name = os.getenv('DATABASE_PROFILE', 'wal').strip().lower()
+    profile = dict(STORAGE_PROFILES.get(profile_name, STORAGE_PROFILES['wal']))
+    overrides = {
+        'journal_mode': os.getenv('DATABASE_JOURNAL_MODE'),
+        'synchronous': os.getenv('DATABASE_SYNCHRONOUS'),
+        'mmap_size': os.getenv('DATABASE_MMAP_SIZE'),
+        'cache_size': os.getenv('DATABASE_CACHE_SIZE'),
+        'temp_store': os.getenv('DATABASE_TEMP_STORE'),
+        'busy_timeout': os.getenv('DATABASE_BUSY_TIMEOUT_MS'),
+        'wal_autocheckpoint': os.getenv('DATABASE_WAL_AUTOCHECKPOINT'),
+    }
+    for key, value in overrides.items():
+        if value is None or not value.strip():
+            continue
+        if isinstance(profile[key], int):
+            try:
+                profile[key] = int(value)
+            except ValueError:
+                continue
+        elif value.strip().isalpha():
+            profile[key] = value.strip().upper()
+    return profile
+
+
+STORAGE_PROFILE = _load_storage_profile()
+CHECKPOINT_INTERVAL_SECONDS = int(os.getenv('DATABASE_CHECKPOINT_INTERVAL', '300'))
+_checkpoint_lock = threading.Lock()
+_last_checkpoint = {'at': time.monotonic()}
+
+_pool = threading.local()
+_pool_stats = {'hits': 0, 'misses': 0, 'released': 0, 'discarded': 0}
+_pool_stats_lock = threading.Lock()
+
 
 def get_database_path():
     return DATABASE
 
-def get_db():
+
+class PooledConnection(sqlite3.Connection):
+    # Routes call conn.close() when they are done; for pooled connections that
+    # hands the connection back instead of tearing it down. Connections bound
+    # to the app context are released by close_request_db() at teardown.
+    request_bound = False
+
+    def close(self):
+        if self.request_bound:
+            return
+        release_db(self)
+
+    def close_physical(self):
+        sqlite3.Connection.close(self)
+
+
+def _count_pool(key):
+    with _pool_stats_lock:
+        _pool_stats[key] += 1
+
+
+def _open_connection():
     chosen_path = DATABASE
+    timeout = max(STORAGE_PROFILE['busy_timeout'], 0) / 1000.0
     db_dir = os.path.dirname(chosen_path)
     try:
         if db_dir:
             os.makedirs(db_dir, exist_ok=True)
-        conn = sqlite3.connect(chosen_path)
+        conn = sqlite3.connect(chosen_path, timeout=timeout, factory=PooledConnection)
     except (PermissionError, OSError, sqlite3.OperationalError):
         fallback_dir = os.path.dirname(FALLBACK_DATABASE)
         if fallback_dir:
             os.makedirs(fallback_dir, exist_ok=True)
-        conn = sqlite3.connect(FALLBACK_DATABASE)
+        conn = sqlite3.connect(FALLBACK_DATABASE, timeout=timeout, factory=PooledConnection)
     conn.row_factory = sqlite3.Row
+    apply_storage_profile(conn)
     conn.execute("PRAGMA foreign_keys = ON")
     return conn
 
-def init_db():
-    conn = get_db()
+
+def apply_storage_profile(conn, profile=None):
+    profile = profile or STORAGE_PROFILE
+    conn.execute(f"PRAGMA busy_timeout = {int(profile['busy_timeout'])}")
+    try:
+        conn.execute(f"PRAGMA journal_mode = {profile['journal_mode']}")
+    except sqlite3.OperationalError:
+        # Another connection holds a lock mid-switch; the mode is persistent,
+        # so whichever connection wins applies it for everyone.
+        pass
+    conn.execute(f"PRAGMA synchronous = {profile['synchronous']}")
+    conn.execute(f"PRAGMA mmap_size = {int(profile['mmap_size'])}")
+    conn.execute(f"PRAGMA cache_size = {int(profile['cache_size'])}")
+    conn.execute(f"PRAGMA temp_store = {profile['temp_store']}")
+    conn.execute(f"PRAGMA wal_autocheckpoint = {int(profile['wal_autocheckpoint'])}")
+
+
+def checkpoint_wal(conn, mode='PASSIVE'):
+    if mode not in ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE'):
+        mode = 'PASSIVE'
+    try:
+        row = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    with _checkpoint_lock:
+        _last_checkpoint['at'] = time.monotonic()
+    return {'busy': row[0], 'log_frames': row[1], 'checkpointed_frames': row[2]} if row else None
+
+
+def _maybe_checkpoint(conn):
+    if CHECKPOINT_INTERVAL_SECONDS <= 0 or STORAGE_PROFILE['journal_mode'] != 'WAL':
+        return
+    with _checkpoint_lock:
+        if time.monotonic() - _last_checkpoint['at'] < CHECKPOINT_INTERVAL_SECONDS:
+            return
+        _last_checkpoint['at'] = time.monotonic()
+    checkpoint_wal(conn)
+
+
+def _acquire_connection():
+    conn = getattr(_pool, 'conn', None)
+    if conn is not None:
+        _pool.conn = None
+        _count_pool('hits')
+        return conn
+    _count_pool('misses')
+    return _open_connection()
+
+
+def release_db(conn):
+    conn.request_bound = False
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+        conn.row_factory = sqlite3.Row
+        _maybe_checkpoint(conn)
+    except sqlite3.ProgrammingError:
+        # Already closed underneath us; nothing to return to the pool.
+        _count_pool('discarded')
+        return
+    if getattr(_pool, 'conn', None) is None:
+        _pool.conn = conn
+        _count_pool('released')
+    else:
+        conn.close_physical()
+        _count_pool('discarded')
+
+
+def get_db():
+    if has_app_context():
+        conn = g.get('_db_conn')
+        if conn is None:
+            conn = _acquire_connection()
+            conn.request_bound = True
+            g._db_conn = conn
+        return conn
+    return _acquire_connection()
+
+
+def close_request_db(exc=None):
+    conn = g.pop('_db_conn', None)
+    if conn is not None:
+        release_db(conn)
+
+
+def get_pool_stats():
+    with _pool_stats_lock:
+        stats = dict(_pool_stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+    stats['thread_has_idle_connection'] = getattr(_pool, 'conn', None) is not None
+    return stats
+
+def get_cache_version(conn, cache_key):
+    row = conn.execute('SELECT version FROM cache_versions WHERE cache_key=?', (cache_key,)).fetchone()
+    return row[0] if row else 0
+
+
+def bump_cache_version(conn, cache_key):
+    conn.execute('''
+        INSERT INTO cache_versions (cache_key, version, updated_at) VALUES (?, 1, CURRENT_TIMESTAMP)
+        ON CONFLICT(cache_key) DO UPDATE SET version=version + 1, updated_at=CURRENT_TIMESTAMP
+    ''', (cache_key,))
+
+
+# Secondary indexes for the hot date / foreign-key filters. Each entry records the
+# schema migration that introduced it so later releases can append without renumbering.
+SCHEMA_INDEXES = [
+    (3, 'idx_workout_exercise_logs_exercise_set_type', 'workout_exercise_logs', ('exercise_id', 'set_type')),
+    (3, 'idx_workout_exercise_logs_session_id', 'workout_exercise_logs', ('session_id',)),
+    (3, 'idx_workout_sessions_session_date', 'workout_sessions', ('session_date',)),
+    (3, 'idx_transactions_transaction_date', 'transactions', ('transaction_date',)),
+    (3, 'idx_habit_logs_habit_date', 'habit_logs', ('habit_id', 'log_date')),
+    (3, 'idx_body_stats_log_date_id', 'body_stats', ('log_date', 'id')),
+    (3, 'idx_water_hourly_log_date_slot', 'water_hourly', ('log_date', 'slot_index')),
+    (3, 'idx_diet_food_entries_log_date', 'diet_food_entries', ('log_date',)),
+    (3, 'idx_calendar_events_event_date', 'calendar_events', ('event_date',)),
+    (4, 'idx_exercises_name_key', 'exercises', ('name_key',)),
+    # Optional fifth element: WHERE clause of a partial index.
+    (8, 'idx_todos_open_due_date', 'todos', ('due_date', 'due_time'), "status != 'completed'"),
+    (8, 'idx_todos_status_completed_at', 'todos', ('status', 'completed_at')),
+]
+
+# Representative queries from the routes that lean on each index, used by
+# benchmark_schema_indexes() to show the plan change.
+SCHEMA_INDEX_PLAN_QUERIES = [
+    ('idx_workout_exercise_logs_exercise_set_type', 'gym_session_new',
+     "SELECT session_id, weight_kg, reps FROM workout_exercise_logs WHERE exercise_id=? AND set_type='working'", (1,)),
+    ('idx_workout_exercise_logs_session_id', 'gym_session_view',
+     "SELECT time_seconds, speed, incline FROM workout_exercise_logs WHERE session_id=? AND set_type='interval' ORDER BY set_number, id", (1,)),
+    ('idx_workout_sessions_session_date', 'gym',
+     'SELECT * FROM workout_sessions WHERE session_date >= ? ORDER BY session_date DESC LIMIT 50', ('2000-01-01',)),
+    ('idx_transactions_transaction_date', 'financial',
+     'SELECT * FROM transactions WHERE transaction_date >= ? ORDER BY transaction_date DESC, id DESC', ('2000-01-01',)),
+    ('idx_habit_logs_habit_date', 'habits',
+     'SELECT log_date FROM habit_logs WHERE habit_id=? AND completed=1 AND log_date <= ?', (1, '2100-01-01')),
+    ('idx_body_stats_log_date_id', 'diet',
+     'SELECT weight_kg FROM body_stats WHERE log_date <= ? ORDER BY log_date DESC, id DESC LIMIT 1', ('2100-01-01',)),
+    ('idx_water_hourly_log_date_slot', 'water',
+     'SELECT * FROM water_hourly WHERE log_date=? ORDER BY slot_index, hour_label', ('2000-01-01',)),
+    ('idx_diet_food_entries_log_date', 'diet',
+     'SELECT * FROM diet_food_entries WHERE log_date=?', ('2000-01-01',)),
+    ('idx_todos_open_due_date', 'calendar',
+     'SELECT * FROM todos WHERE status != "completed" AND due_date BETWEEN ? AND ? ORDER BY due_date, due_time', ('2000-01-01', '2100-01-01')),
+    ('idx_todos_open_due_date', 'calendar',
+     'SELECT id, title, due_date, due_time, priority, category FROM todos WHERE status != "completed" AND due_date >= ? ORDER BY due_date, due_time LIMIT 20', ('2000-01-01',)),
+    ('idx_todos_open_due_date', 'dashboard',
+     'SELECT COUNT(*) as c FROM todos WHERE status != "completed" AND due_date < ?', ('2100-01-01',)),
+    ('idx_todos_open_due_date', 'notifications',
+     'SELECT id, title, due_date, due_time FROM todos WHERE status != "completed" AND due_date IS NOT NULL', ()),
+    ('idx_todos_status_completed_at', 'todos',
+     'SELECT * FROM todos WHERE status="completed" AND (date(completed_at) >= ? OR completed_at IS NULL) ORDER BY completed_at DESC LIMIT 60', ('2000-01-01',)),
+    ('idx_calendar_events_event_date', 'calendar',
+     'SELECT * FROM calendar_events WHERE event_date BETWEEN ? AND ? ORDER BY event_date, event_time', ('2000-01-01', '2100-01-01')),
+    ('idx_exercises_name_key', 'gym_session_new',
+     'SELECT id FROM exercises WHERE name_key=?', ('bench press',)),
+]
+
+
+def _table_indexes(conn, table):
+    indexes = {}
+    for row in conn.execute(f'PRAGMA index_list({table})').fetchall():
+        name = row[1]
+        indexes[name] = tuple(col[2] for col in conn.execute(f'PRAGMA index_info({name})').fetchall())
+    return indexes
+
+
+def _index_where(conn, name):
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE type='index' AND name=?", (name,)).fetchone()
+    sql = row[0] if row and row[0] else ''
+    where_at = sql.upper().rfind(' WHERE ')
+    return sql[where_at + len(' WHERE '):].strip() if where_at >= 0 else None
+
+
+def _schema_index_entries():
+    for entry in SCHEMA_INDEXES:
+        yield (*entry[:4], entry[4] if len(entry) > 4 else None)
+
+
+def _covering_index(conn, table, columns, exclude=None):
+    for name, cols in _table_indexes(conn, table).items():
+        if name != exclude and cols[:len(columns)] == tuple(columns):
+            return name
+    return None
+
+
+def apply_schema_indexes(conn, up_to_version=None):
+    applied = []
+    for version, name, table, columns, where in _schema_index_entries():
+        if up_to_version is not None and version > up_to_version:
+            continue
+        existing = _table_indexes(conn, table)
+        if name in existing:
+            if existing[name] == tuple(columns) and _index_where(conn, name) == where:
+                continue
+            # Definition changed between versions: rebuild it.
+            conn.execute(f'DROP INDEX IF EXISTS {name}')
+        elif where is None and _covering_index(conn, table, columns):
+            # A UNIQUE constraint already provides the same leading columns.
+            continue
+        where_sql = f' WHERE {where}' if where else ''
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table}({", ".join(columns)}){where_sql}')
+        applied.append(name)
+    return applied
+
+
+def validate_schema_indexes(conn):
+    report = []
+    for version, name, table, columns, where in _schema_index_entries():
+        existing = _table_indexes(conn, table)
+        if existing.get(name) == tuple(columns) and _index_where(conn, name) == where:
+            status, provided_by = 'ok', name
+        else:
+            provided_by = None if where else _covering_index(conn, table, columns)
+            status = 'covered' if provided_by else 'missing'
+        report.append({
+            'name': name,
+            'table': table,
+            'columns': list(columns),
+            'where': where,
+            'version': version,
+            'status': status,
+            'provided_by': provided_by,
+        })
+    return report
+
+
+def _query_plan(conn, sql, params):
+    return ' | '.join(row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall())
+
+
+def _time_query(conn, sql, params, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        conn.execute(sql, params).fetchall()
+    return round((time.perf_counter() - started) * 1000 / repeat, 3)
+
+
+def benchmark_schema_indexes(db_path=None, repeat=20):
+    # Runs against an in-memory copy so dropping the suite never touches the live file.
+    source = sqlite3.connect(db_path or get_database_path())
+    conn = sqlite3.connect(':memory:')
+    try:
+        source.backup(conn)
+    finally:
+        source.close()
+    try:
+        for entry in SCHEMA_INDEXES:
+            conn.execute(f'DROP INDEX IF EXISTS {entry[1]}')
+        before = []
+        for name, route, sql, params in SCHEMA_INDEX_PLAN_QUERIES:
+            before.append((_query_plan(conn, sql, params), _time_query(conn, sql, params, repeat)))
+        apply_schema_indexes(conn)
+        results = []
+        for (name, route, sql, params), (plan_before, ms_before) in zip(SCHEMA_INDEX_PLAN_QUERIES, before):
+            plan_after = _query_plan(conn, sql, params)
+            results.append({
+                'index': name,
+                'route': route,
+                'plan_before': plan_before,
+                'plan_after': plan_after,
+                'ms_before': ms_before,
+                'ms_after': _time_query(conn, sql, params, repeat),
+                'uses_search': plan_after.startswith('SEARCH'),
+            })
+        return results
+    finally:
+        conn.close()
+
+
+def _migrate_base_schema(conn):
     c = conn.cursor()
 
     c.execute('''CREATE TABLE IF NOT EXISTS user_profile (
@@ -85,6 +440,14 @@ def init_db():
         FOREIGN KEY (habit_id) REFERENCES habits(id) ON DELETE CASCADE,
         UNIQUE(habit_id, log_date)
     )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS habit_streaks (
+        habit_id INTEGER PRIMARY KEY,
+        current_streak INTEGER NOT NULL DEFAULT 0,
+        streak_end_date DATE,
+        due_mask INTEGER NOT NULL DEFAULT 127,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (habit_id) REFERENCES habits(id) ON DELETE CASCADE
+    )''')
 
     c.execute('''CREATE TABLE IF NOT EXISTS shopping_items (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -215,6 +578,23 @@ def init_db():
     if 'distance_km' not in wel_cols:
         c.execute('ALTER TABLE workout_exercise_logs ADD COLUMN distance_km REAL')
 
+    c.execute('''CREATE TABLE IF NOT EXISTS exercise_session_best (
+        exercise_id INTEGER NOT NULL,
+        session_id INTEGER NOT NULL,
+        session_date DATE NOT NULL,
+        best_weight_kg REAL NOT NULL,
+        best_reps INTEGER,
+        best_one_rm REAL,
+        max_one_rm REAL,
+        max_one_rm_weight_kg REAL,
+        max_one_rm_reps INTEGER,
+        PRIMARY KEY (exercise_id, session_id),
+        FOREIGN KEY (session_id) REFERENCES workout_sessions(id) ON DELETE CASCADE,
+        FOREIGN KEY (exercise_id) REFERENCES exercises(id) ON DELETE CASCADE
+    )''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_exercise_session_best_pr ON exercise_session_best(exercise_id, max_one_rm)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_exercise_session_best_session ON exercise_session_best(session_id)')
+
     c.execute('''CREATE TABLE IF NOT EXISTS exercise_strength_benchmarks (
         exercise_id INTEGER PRIMARY KEY,
         beginner_1rm REAL,
@@ -731,6 +1111,44 @@ def init_db():
         ('hydration_ml_per_kg','32'),('hydration_awake_hours','16'),('hydration_sweat_extra_ml','750')
     ])
 
+    c.execute('''CREATE TABLE IF NOT EXISTS cache_versions (
+        cache_key TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    bump_cache_version(c, 'app_settings')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS prayer_times (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        latitude TEXT NOT NULL,
+        longitude TEXT NOT NULL,
+        method INTEGER NOT NULL,
+        prayer_date DATE NOT NULL,
+        fajr TEXT, dhuhr TEXT, asr TEXT, maghrib TEXT, isha TEXT,
+        source TEXT,
+        fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(latitude, longitude, method, prayer_date)
+    )''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS notification_queue (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        source_type TEXT NOT NULL,
+        source_key TEXT NOT NULL,
+        source_id INTEGER,
+        queue_date DATE,
+        item_type TEXT NOT NULL,
+        title TEXT NOT NULL,
+        message TEXT,
+        link TEXT,
+        notify_at TIMESTAMP NOT NULL,
+        UNIQUE(source_type, source_key)
+    )''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_notification_queue_notify_at ON notification_queue(notify_at)')
+    c.execute('''CREATE TABLE IF NOT EXISTS notification_queue_builds (
+        queue_date DATE PRIMARY KEY,
+        built_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+
     water_log_columns = [row[1] for row in c.execute("PRAGMA table_info(water_logs)").fetchall()]
     if 'sweat_factor' not in water_log_columns:
         c.execute('ALTER TABLE water_logs ADD COLUMN sweat_factor INTEGER DEFAULT 0')
@@ -751,18 +1169,6 @@ def init_db():
     if 'muscle_group' not in exercise_columns:
         c.execute("ALTER TABLE exercises ADD COLUMN muscle_group TEXT DEFAULT 'Uncategorized'")
 
-    # Backfill existing exercises with practical default groups.
-    c.execute("UPDATE exercises SET muscle_group='Chest' WHERE lower(name) LIKE '%bench%' OR lower(name) LIKE '%fly%'")
-    c.execute("UPDATE exercises SET muscle_group='Back' WHERE lower(name) LIKE '%row%' OR lower(name) LIKE '%pull up%' OR lower(name) LIKE '%lat pulldown%'")
-    c.execute("UPDATE exercises SET muscle_group='Shoulders' WHERE lower(name) LIKE '%shoulder%' OR lower(name) LIKE '%overhead press%' OR lower(name) LIKE '%lateral raise%'")
-    c.execute("UPDATE exercises SET muscle_group='Legs' WHERE lower(name) LIKE '%hamstring%' OR lower(name) LIKE '%leg curl%'")
-    c.execute("UPDATE exercises SET muscle_group='Arms' WHERE (lower(name) LIKE '%curl%' OR lower(name) LIKE '%tricep%' OR lower(name) LIKE '%bicep%') AND lower(name) NOT LIKE '%hamstring%' AND lower(name) NOT LIKE '%leg curl%'")
-    c.execute("UPDATE exercises SET muscle_group='Core' WHERE lower(name) LIKE '%crunch%' OR lower(name) LIKE '%plank%' OR lower(name) LIKE '%ab%'")
-    c.execute("UPDATE exercises SET muscle_group='Glutes' WHERE lower(name) LIKE '%hip thrust%' OR lower(name) LIKE '%glute%'")
-    c.execute("UPDATE exercises SET muscle_group='Legs' WHERE muscle_group='Uncategorized' AND (lower(name) LIKE '%squat%' OR lower(name) LIKE '%deadlift%' OR lower(name) LIKE '%lunge%' OR lower(name) LIKE '%leg%' OR lower(name) LIKE '%hamstring%')")
-    c.execute("UPDATE exercises SET muscle_group='Cardio' WHERE is_cardio=1")
-    c.execute("UPDATE exercises SET muscle_group='Uncategorized' WHERE muscle_group IS NULL OR trim(muscle_group)='' ")
-
     session_stretch_columns = [row[1] for row in c.execute("PRAGMA table_info(session_stretch_logs)").fetchall()]
     if 'set_number' not in session_stretch_columns:
         c.execute('ALTER TABLE session_stretch_logs ADD COLUMN set_number INTEGER DEFAULT 1')
@@ -780,11 +1186,381 @@ def init_db():
     )''')
 
     _populate_quran_surahs(c)
-    conn.commit()
-    conn.close()
-    print("Database initialized successfully!")
 
 
+def _migrate_exercise_muscle_groups(conn):
+    c = conn.cursor()
+    # Backfill existing exercises with practical default groups.
+    c.execute("UPDATE exercises SET muscle_group='Chest' WHERE lower(name) LIKE '%bench%' OR lower(name) LIKE '%fly%'")
+    c.execute("UPDATE exercises SET muscle_group='Back' WHERE lower(name) LIKE '%row%' OR lower(name) LIKE '%pull up%' OR lower(name) LIKE '%lat pulldown%'")
+    c.execute("UPDATE exercises SET muscle_group='Shoulders' WHERE lower(name) LIKE '%shoulder%' OR lower(name) LIKE '%overhead press%' OR lower(name) LIKE '%lateral raise%'")
+    c.execute("UPDATE exercises SET muscle_group='Legs' WHERE lower(name) LIKE '%hamstring%' OR lower(name) LIKE '%leg curl%'")
+    c.execute("UPDATE exercises SET muscle_group='Arms' WHERE (lower(name) LIKE '%curl%' OR lower(name) LIKE '%tricep%' OR lower(name) LIKE '%bicep%') AND lower(name) NOT LIKE '%hamstring%' AND lower(name) NOT LIKE '%leg curl%'")
+    c.execute("UPDATE exercises SET muscle_group='Core' WHERE lower(name) LIKE '%crunch%' OR lower(name) LIKE '%plank%' OR lower(name) LIKE '%ab%'")
+    c.execute("UPDATE exercises SET muscle_group='Glutes' WHERE lower(name) LIKE '%hip thrust%' OR lower(name) LIKE '%glute%'")
+    c.execute("UPDATE exercises SET muscle_group='Legs' WHERE muscle_group='Uncategorized' AND (lower(name) LIKE '%squat%' OR lower(name) LIKE '%deadlift%' OR lower(name) LIKE '%lunge%' OR lower(name) LIKE '%leg%' OR lower(name) LIKE '%hamstring%')")
+    c.execute("UPDATE exercises SET muscle_group='Cardio' WHERE is_cardio=1")
+    c.execute("UPDATE exercises SET muscle_group='Uncategorized' WHERE muscle_group IS NULL OR trim(muscle_group)='' ")
+
+
+def _migrate_schema_indexes(conn):
+    apply_schema_indexes(conn, 3)
+
+
+def _migrate_exercise_last_performance(conn):
+    c = conn.cursor()
+    # Virtual generated column so every writer (forms, restores) gets it for free;
+    # PRAGMA table_info hides it, which keeps restore_table_rows from inserting into it.
+    exercise_columns = {row[1] for row in c.execute('PRAGMA table_xinfo(exercises)').fetchall()}
+    if 'name_key' not in exercise_columns:
+        c.execute('ALTER TABLE exercises ADD COLUMN name_key TEXT GENERATED ALWAYS AS (lower(trim(name))) VIRTUAL')
+    c.execute('''CREATE TABLE IF NOT EXISTS exercise_last_performance (
+        name_key TEXT NOT NULL,
+        set_type TEXT NOT NULL,
+        log_id INTEGER NOT NULL,
+        session_date DATE NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (name_key, set_type)
+    )''')
+    apply_schema_indexes(conn, 4)
+
+
+def _migrate_finance_rollups(conn):
+    c = conn.cursor()
+    # Zero/'' stand in for NULL ids and modes so the primary key stays unique.
+    c.execute('''CREATE TABLE IF NOT EXISTS finance_monthly_category (
+        month TEXT NOT NULL,
+        type TEXT NOT NULL,
+        category_id INTEGER NOT NULL DEFAULT 0,
+        account_id INTEGER NOT NULL DEFAULT 0,
+        transport_mode TEXT NOT NULL DEFAULT '',
+        amount REAL NOT NULL DEFAULT 0,
+        txn_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (month, type, category_id, account_id, transport_mode)
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS finance_daily_balance (
+        balance_date DATE PRIMARY KEY,
+        income REAL NOT NULL DEFAULT 0,
+        expense REAL NOT NULL DEFAULT 0,
+        txn_count INTEGER NOT NULL DEFAULT 0
+    )''')
+
+
+def refresh_meal_plan_dish_totals(conn, dish_ids=None):
+    # Per-serving ingredient totals cached on the dish row.
+    dish_filter = ''
+    params = []
+    if dish_ids is not None:
+        params = sorted({int(dish_id) for dish_id in dish_ids})
+        if not params:
+            return
+        dish_filter = f" WHERE id IN ({','.join('?' for _ in params)})"
+    conn.execute(f'''
+        UPDATE meal_plan_dishes SET
+            cost_per_serving = (SELECT COALESCE(SUM(COALESCE(estimated_cost, 0)), 0) FROM meal_plan_ingredients WHERE dish_id = meal_plan_dishes.id),
+            calories_per_serving = (SELECT COALESCE(SUM(COALESCE(calories, 0)), 0) FROM meal_plan_ingredients WHERE dish_id = meal_plan_dishes.id)
+        {dish_filter}
+    ''', params)
+
+
+def _migrate_todo_indexes(conn):
+    # (status, due_date) never served the routes' status != 'completed' filters.
+    conn.execute('DROP INDEX IF EXISTS idx_todos_status_due_date')
+    apply_schema_indexes(conn, 8)
+
+
+def _migrate_exercise_pr_sets(conn):
+    c = conn.cursor()
+    # Every set that raised its exercise's 1RM within the session, so the PR
+    # timeline keeps back-to-back PR sets instead of one event per session.
+    c.execute('''CREATE TABLE IF NOT EXISTS exercise_pr_sets (
+        log_id INTEGER PRIMARY KEY,
+        exercise_id INTEGER NOT NULL,
+        session_id INTEGER NOT NULL,
+        session_date DATE NOT NULL,
+        one_rm REAL NOT NULL,
+        weight_kg REAL NOT NULL,
+        reps INTEGER NOT NULL,
+        FOREIGN KEY (session_id) REFERENCES workout_sessions(id) ON DELETE CASCADE,
+        FOREIGN KEY (exercise_id) REFERENCES exercises(id) ON DELETE CASCADE
+    )''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_exercise_pr_sets_session ON exercise_pr_sets(session_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_exercise_pr_sets_date ON exercise_pr_sets(session_date, log_id)')
+    # Strength standards score sets with plain Epley (single reps included).
+    best_columns = {row[1] for row in c.execute('PRAGMA table_info(exercise_session_best)').fetchall()}
+    if 'max_epley_one_rm' not in best_columns:
+        c.execute('ALTER TABLE exercise_session_best ADD COLUMN max_epley_one_rm REAL')
+    c.execute('DROP INDEX IF EXISTS idx_exercise_session_best_pr')
+    if sqlite3.sqlite_version_info >= (3, 35, 0):
+        for column in ('max_one_rm', 'max_one_rm_weight_kg', 'max_one_rm_reps'):
+            if column in best_columns:
+                c.execute(f'ALTER TABLE exercise_session_best DROP COLUMN {column}')
+    # Let the next progress read rebuild both tables from the logs.
+    c.execute("DELETE FROM cache_versions WHERE cache_key='exercise_session_best'")
+
+
+
+def _migrate_exercise_rename_trigger(conn):
+    # exercise_last_performance is keyed on name_key; a rename moves an
+    # exercise's history to another key, so drop the cache version and let
+    # the next session form rebuild it.
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS exercises_name_key_update AFTER UPDATE OF name ON exercises
+    WHEN NEW.name_key IS NOT OLD.name_key BEGIN
+        DELETE FROM cache_versions WHERE cache_key = 'exercise_last_performance';
+    END''')
+
+def _migrate_meal_plan_dish_totals(conn):
+    c = conn.cursor()
+    dish_columns = {row[1] for row in c.execute('PRAGMA table_info(meal_plan_dishes)').fetchall()}
+    if 'cost_per_serving' not in dish_columns:
+        c.execute('ALTER TABLE meal_plan_dishes ADD COLUMN cost_per_serving REAL NOT NULL DEFAULT 0')
+    if 'calories_per_serving' not in dish_columns:
+        c.execute('ALTER TABLE meal_plan_dishes ADD COLUMN calories_per_serving REAL NOT NULL DEFAULT 0')
+    refresh_meal_plan_dish_totals(conn)
+
+
+# Tables that carry sync stamps, keyed on the column that identifies a row
+# across instances (ids are per-database, so they can't be used).
+SYNC_TABLE_KEYS = {
+    'body_stats': 'sync_id',
+    'daily_steps': 'log_date',
+    'app_settings': 'setting_key',
+}
+SYNC_TIMESTAMP_SQL = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+
+def _create_sync_triggers(conn, table, key, suppressible=True):
+    # Every writer gets stamped: version comes from the shared sync_clock,
+    # updated_at is kept when the writer supplies one (sync imports) and set
+    # to now otherwise. The stamping UPDATE changes version, so the update
+    # trigger's WHEN clause skips it.
+    next_version = 'UPDATE sync_clock SET counter = counter + 1 WHERE id = 1;'
+    current_version = '(SELECT counter FROM sync_clock WHERE id = 1)'
+    key_value = f'COALESCE(NEW.{key}, lower(hex(randomblob(16))))' if key == 'sync_id' else f'NEW.{key}'
+    # sync_clock.suppress_tombstones only exists from migration 11 on.
+    suppressed = ' AND NOT (SELECT suppress_tombstones FROM sync_clock WHERE id = 1)' if suppressible else ''
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS {table}_sync_insert AFTER INSERT ON {table} BEGIN
+        {next_version}
+        UPDATE {table} SET {key} = {key_value},
+            updated_at = COALESCE(NEW.updated_at, {SYNC_TIMESTAMP_SQL}),
+            version = {current_version}
+        WHERE rowid = NEW.rowid;
+        DELETE FROM sync_tombstones WHERE table_name = '{table}' AND row_key = NEW.{key};
+    END''')
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS {table}_sync_update AFTER UPDATE ON {table}
+    WHEN NEW.version IS OLD.version BEGIN
+        {next_version}
+        UPDATE {table} SET
+            updated_at = CASE WHEN NEW.updated_at IS OLD.updated_at THEN {SYNC_TIMESTAMP_SQL} ELSE NEW.updated_at END,
+            version = {current_version}
+        WHERE rowid = NEW.rowid;
+    END''')
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS {table}_sync_delete AFTER DELETE ON {table}
+    WHEN OLD.{key} IS NOT NULL{suppressed} BEGIN
+        {next_version}
+        INSERT OR REPLACE INTO sync_tombstones (table_name, row_key, updated_at, version)
+        VALUES ('{table}', OLD.{key}, {SYNC_TIMESTAMP_SQL}, {current_version});
+    END''')
+
+
+def _migrate_sync_stamps(conn):
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS sync_clock (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        counter INTEGER NOT NULL DEFAULT 0,
+        instance_id TEXT NOT NULL
+    )''')
+    c.execute("INSERT OR IGNORE INTO sync_clock (id, counter, instance_id) VALUES (1, 1, lower(hex(randomblob(8))))")
+    c.execute('''CREATE TABLE IF NOT EXISTS sync_tombstones (
+        table_name TEXT NOT NULL,
+        row_key TEXT NOT NULL,
+        updated_at TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        PRIMARY KEY (table_name, row_key)
+    )''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_sync_tombstones_version ON sync_tombstones(version)')
+    for table, key in SYNC_TABLE_KEYS.items():
+        columns = {row[1] for row in c.execute(f'PRAGMA table_info({table})').fetchall()}
+        if key not in columns:
+            c.execute(f'ALTER TABLE {table} ADD COLUMN {key} TEXT')
+        if 'updated_at' not in columns:
+            c.execute(f'ALTER TABLE {table} ADD COLUMN updated_at TEXT')
+        if 'version' not in columns:
+            c.execute(f'ALTER TABLE {table} ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+        # Existing rows all start at version 1; settings get the epoch so any
+        # real edit on either side wins over an untouched default.
+        if 'created_at' in columns:
+            backfill = f"COALESCE(strftime('%Y-%m-%d %H:%M:%f', created_at), {SYNC_TIMESTAMP_SQL})"
+        else:
+            backfill = "'1970-01-01 00:00:00.000'"
+        c.execute(f'UPDATE {table} SET updated_at = {backfill}, version = 1 WHERE updated_at IS NULL')
+        if key == 'sync_id':
+            c.execute(f'UPDATE {table} SET sync_id = lower(hex(randomblob(16))) WHERE sync_id IS NULL')
+            c.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS idx_{table}_sync_id ON {table}(sync_id)')
+        c.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_version ON {table}(version)')
+        _create_sync_triggers(conn, table, key, suppressible=False)
+
+
+def _migrate_sync_tombstone_suppression(conn):
+    # Restores wipe and re-insert synced rows in one transaction; they raise
+    # suppress_tombstones meanwhile so the wipe isn't sent out as deletes.
+    clock_columns = {row[1] for row in conn.execute('PRAGMA table_info(sync_clock)').fetchall()}
+    if 'suppress_tombstones' not in clock_columns:
+        conn.execute('ALTER TABLE sync_clock ADD COLUMN suppress_tombstones INTEGER NOT NULL DEFAULT 0')
+    for table, key in SYNC_TABLE_KEYS.items():
+        conn.execute(f'DROP TRIGGER IF EXISTS {table}_sync_delete')
+        _create_sync_triggers(conn, table, key)
+
+
+# Ordered schema steps keyed on PRAGMA user_version. Append new steps; never
+# renumber or edit one that has shipped.
+MIGRATIONS = [
+    (1, _migrate_base_schema),
+    (2, _migrate_exercise_muscle_groups),
+    (3, _migrate_schema_indexes),
+    (4, _migrate_exercise_last_performance),
+    (5, _migrate_finance_rollups),
+    (6, _migrate_meal_plan_dish_totals),
+    (7, _migrate_sync_stamps),
+    (8, _migrate_todo_indexes),
+    (9, _migrate_exercise_pr_sets),
+    (10, _migrate_exercise_rename_trigger),
+    (11, _migrate_sync_tombstone_suppression),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+_migration_lock = threading.Lock()
+
+
+def get_schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def pending_migrations(conn):
+    current = get_schema_version(conn)
+    return [(version, step) for version, step in MIGRATIONS if version > current]
+
+
+class _SchemaFileLock:
+    # Serialises migrations across gunicorn workers sharing the database file.
+    def __init__(self, path):
+        self.path = path
+        self.handle = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self.handle = open(self.path, 'a')
+            fcntl.flock(self.handle, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self.handle is not None:
+            fcntl.flock(self.handle, fcntl.LOCK_UN)
+            self.handle.close()
+            self.handle = None
+
+
+def migrate_db(conn):
+    applied = []
+    with _migration_lock, _SchemaFileLock(get_database_path() + '.migrate.lock'):
+        # Another worker may have finished while we waited for the lock.
+        for version, step in pending_migrations(conn):
+            try:
+                step(conn)
+                conn.execute(f'PRAGMA user_version = {int(version)}')
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            applied.append(version)
+    return applied
+
+
+def init_db():
+    conn = get_db()
+    try:
+        if not pending_migrations(conn):
+            return []
+        applied = migrate_db(conn)
+    finally:
+        conn.close()
+    if applied:
+        print(f"Database initialized successfully! (schema v{SCHEMA_VERSION})")
+    return applied
+
+
+# Online snapshots. The backup API copies pages in small steps from a
+# dedicated connection, so the copy is transactionally consistent (WAL frames
+# included) and writers are never blocked for more than one step.
+SNAPSHOT_DIR = os.getenv('DATABASE_SNAPSHOT_DIR') or os.path.join(os.path.dirname(DATABASE), 'snapshots')
+SNAPSHOT_KEEP = int(os.getenv('DATABASE_SNAPSHOT_KEEP', '7'))
+SNAPSHOT_INTERVAL_SECONDS = int(os.getenv('DATABASE_SNAPSHOT_INTERVAL', '86400'))
+SNAPSHOT_STEP_PAGES = int(os.getenv('DATABASE_SNAPSHOT_STEP_PAGES', '256'))
+SNAPSHOT_PREFIX = 'lifetracker-'
+
+
+def write_snapshot(target_path, step_pages=None):
+    source = _open_connection()
+    try:
+        target = sqlite3.connect(target_path)
+        try:
+            source.backup(target, pages=step_pages or SNAPSHOT_STEP_PAGES, sleep=0.005)
+            # A standalone file: no -wal sidecar needed to open it elsewhere.
+            target.execute('PRAGMA journal_mode = DELETE')
+            check = target.execute('PRAGMA quick_check').fetchone()[0]
+            if check != 'ok':
+                raise sqlite3.DatabaseError(f'Snapshot failed quick_check: {check}')
+        finally:
+            target.close()
+    finally:
+        source.close_physical()
+    return target_path
+
+
+def list_snapshots(snapshot_dir=None):
+    snapshot_dir = snapshot_dir or SNAPSHOT_DIR
+    if not os.path.isdir(snapshot_dir):
+        return []
+    names = sorted(name for name in os.listdir(snapshot_dir) if name.startswith(SNAPSHOT_PREFIX) and name.endswith('.db'))
+    return [os.path.join(snapshot_dir, name) for name in names]
+
+
+def prune_snapshots(snapshot_dir=None, keep=None):
+    keep = SNAPSHOT_KEEP if keep is None else keep
+    removed = []
+    for path in list_snapshots(snapshot_dir)[:-keep] if keep > 0 else []:
+        os.remove(path)
+        removed.append(path)
+    return removed
+
+
+def take_snapshot(snapshot_dir=None, keep=None):
+    snapshot_dir = snapshot_dir or SNAPSHOT_DIR
+    os.makedirs(snapshot_dir, exist_ok=True)
+    path = os.path.join(snapshot_dir, f"{SNAPSHOT_PREFIX}{datetime.now().strftime('%Y%m%d-%H%M%S')}.db")
+    partial = path + '.partial'
+    try:
+        write_snapshot(partial)
+        os.replace(partial, path)
+    except Exception:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    prune_snapshots(snapshot_dir, keep)
+    return path
+
+
+def take_scheduled_snapshot(snapshot_dir=None, interval_seconds=None):
+    # Every worker runs the scheduler; the file lock plus the age check means
+    # only the first one through actually writes a snapshot.
+    snapshot_dir = snapshot_dir or SNAPSHOT_DIR
+    interval_seconds = SNAPSHOT_INTERVAL_SECONDS if interval_seconds is None else interval_seconds
+    os.makedirs(snapshot_dir, exist_ok=True)
+    with _SchemaFileLock(os.path.join(snapshot_dir, '.snapshot.lock')):
+        existing = list_snapshots(snapshot_dir)
+        if existing and time.time() - os.path.getmtime(existing[-1]) < interval_seconds:
+            return None
+        return take_snapshot(snapshot_dir)
+
 def _populate_quran_surahs(c):
     existing = c.execute('SELECT COUNT(*) FROM quran_surahs').fetchone()[0]
     if existing > 0:
@@ -859,4 +1635,12 @@ def reset_language_progress():
     conn.close()
 
 if __name__ == '__main__':
+    import sys
     init_db()
+    if '--benchmark-indexes' in sys.argv:
+        for result in benchmark_schema_indexes():
+            print(f"{result['index']} ({result['route']})")
+            print(f"  before: {result['plan_before']}  [{result['ms_before']} ms]")
+            print(f"  after:  {result['plan_after']}  [{result['ms_after']} ms]")
+    if '--snapshot' in sys.argv:
+        print(f"Snapshot written to {take_snapshot()}")
@@ -0,0 +1,58 @@
+"""The session form's "Last:" hint must follow an exercise through renames."""
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+_TMP = tempfile.mkdtemp(prefix='lifetracker-tests-')
+atexit.register(shutil.rmtree, _TMP, ignore_errors=True)
+os.environ.setdefault('DATABASE_PATH', os.path.join(_TMP, 'lifetracker.db'))
+os.environ.setdefault('UPLOAD_FOLDER', os.path.join(_TMP, 'uploads'))
+os.environ['PRAYER_PREFETCH_ENABLED'] = 'false'
+os.environ['DATABASE_SNAPSHOT_ENABLED'] = 'false'
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app as appmod  # noqa: E402
+
+
+def add_exercise(name):
+    with appmod.app.app_context():
+        conn = appmod.get_db()
+        wt_id = conn.execute('SELECT id FROM workout_types WHERE is_cardio=0 ORDER BY id LIMIT 1').fetchone()[0]
+        eid = conn.execute(
+            'INSERT INTO exercises (name, workout_type_id, muscle_group, is_cardio, order_index, is_active) VALUES (?, ?, ?, 0, 99, 1)',
+            (name, wt_id, 'Chest')
+        ).lastrowid
+        conn.commit()
+        conn.close()
+    return wt_id, eid
+
+
+def rename_exercise(eid, name):
+    with appmod.app.app_context():
+        conn = appmod.get_db()
+        conn.execute('UPDATE exercises SET name=? WHERE id=?', (name, eid))
+        conn.commit()
+        conn.close()
+
+
+def test_last_performance_hint_survives_rename():
+    appmod.init_db()
+    client = appmod.app.test_client()
+    wt_id, eid = add_exercise('Rename Test Press')
+    response = client.post('/gym/session/save', data={
+        'workout_type_id': str(wt_id),
+        'session_date': '2026-01-05',
+        'exercise_id': [str(eid)],
+        f'set_num_{eid}': ['1'],
+        f'set_type_{eid}': ['working'],
+        f'reps_{eid}': ['7'],
+        f'weight_{eid}': ['63.5'],
+    })
+    assert response.status_code in (200, 302)
+    assert 'Last: 63.5kg x 7' in client.get(f'/gym/session/new/{wt_id}').get_data(as_text=True)
+
+    rename_exercise(eid, 'Renamed Test Press')
+    assert 'Last: 63.5kg x 7' in client.get(f'/gym/session/new/{wt_id}').get_data(as_text=True)
@@ -0,0 +1,74 @@
+"""Gym sync tombstones across restores and packs from older clients."""
+import atexit
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+_TMP = tempfile.mkdtemp(prefix='lifetracker-tests-')
+atexit.register(shutil.rmtree, _TMP, ignore_errors=True)
+os.environ.setdefault('DATABASE_PATH', os.path.join(_TMP, 'lifetracker.db'))
+os.environ.setdefault('UPLOAD_FOLDER', os.path.join(_TMP, 'uploads'))
+os.environ['PRAYER_PREFETCH_ENABLED'] = 'false'
+os.environ['DATABASE_SNAPSHOT_ENABLED'] = 'false'
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app as appmod  # noqa: E402
+
+
+def run_sql(sql, params=()):
+    with appmod.app.app_context():
+        conn = appmod.get_db()
+        rows = [dict(row) for row in conn.execute(sql, params).fetchall()]
+        conn.commit()
+        conn.close()
+    return rows
+
+
+def upload(client, url, field, payload):
+    body = json.dumps(payload).encode('utf-8')
+    return client.post(url, data={field: (io.BytesIO(body), 'backup.json')}, content_type='multipart/form-data')
+
+
+def test_gym_restore_does_not_tombstone_restored_rows():
+    appmod.init_db()
+    client = appmod.app.test_client()
+    run_sql("INSERT INTO body_stats (log_date, weight_kg) VALUES ('2026-02-01', 80)")
+    run_sql("INSERT INTO daily_steps (log_date, step_count) VALUES ('2026-02-01', 6000)")
+    since = json.loads(client.get('/backup/gym-sync').data)['sync'][0]['cursor']
+    backup = json.loads(client.get('/backup/gym-progress').data)
+    # Backups taken before sync stamps existed carry no sync columns.
+    for table in ('body_stats', 'daily_steps'):
+        backup[table] = [
+            {col: value for col, value in row.items() if col not in ('sync_id', 'updated_at', 'version')}
+            for row in backup[table]
+        ]
+
+    upload(client, '/restore/gym-progress', 'gym_backup_file', backup)
+
+    assert run_sql("SELECT weight_kg FROM body_stats WHERE log_date='2026-02-01'") == [{'weight_kg': 80}]
+    assert json.loads(client.get(f'/backup/gym-sync?since={since}').data)['deleted'] == []
+    # Deletes outside a restore still produce tombstones.
+    run_sql("DELETE FROM daily_steps WHERE log_date='2026-02-01'")
+    deleted = json.loads(client.get(f'/backup/gym-sync?since={since}').data)['deleted']
+    assert [(row['table'], row['key']) for row in deleted] == [('daily_steps', '2026-02-01')]
+
+
+def test_unstamped_rows_do_not_resurrect_deleted_rows():
+    appmod.init_db()
+    client = appmod.app.test_client()
+    run_sql("INSERT INTO body_stats (log_date, weight_kg, sync_id) VALUES ('2026-03-01', 79, 'legacy-row')")
+    run_sql("INSERT INTO daily_steps (log_date, step_count) VALUES ('2026-03-01', 7000)")
+    run_sql("DELETE FROM body_stats WHERE sync_id='legacy-row'")
+    run_sql("DELETE FROM daily_steps WHERE log_date='2026-03-01'")
+
+    upload(client, '/restore/gym-sync', 'gym_sync_file', {
+        'body_stats': [{'sync_id': 'legacy-row', 'log_date': '2026-03-01', 'weight_kg': 79}],
+        'daily_steps': [{'log_date': '2026-03-01', 'step_count': 7000}],
+    })
+
+    assert run_sql("SELECT 1 FROM body_stats WHERE sync_id='legacy-row'") == []
+    assert run_sql("SELECT 1 FROM daily_steps WHERE log_date='2026-03-01'") == []
@@ -0,0 +1,175 @@
+"""Offline prayer-time calculator vs. calendar fixtures in the Aladhan format.
+
+Fixtures live in tests/fixtures/aladhan/ in the /v1/calendar response shape,
+and each file's "source" field says how it was produced. The checked-in set
+comes from the upstream PrayTimes.org implementation (praytimes 2.3.2 from
+PyPI), so it checks this port of the algorithm, not agreement with Aladhan:
+
+    pip install praytimes==2.3.2
+    python tests/test_prayer_times.py --generate
+
+To compare with Aladhan instead, replace them with live API captures:
+
+    python tests/test_prayer_times.py --record
+"""
+import atexit
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+from datetime import date, datetime
+from pathlib import Path
+from urllib.parse import urlencode
+from urllib.request import urlopen
+from zoneinfo import ZoneInfo
+
+import pytest
+
+_TMP = tempfile.mkdtemp(prefix='lifetracker-tests-')
+atexit.register(shutil.rmtree, _TMP, ignore_errors=True)
+os.environ.setdefault('DATABASE_PATH', os.path.join(_TMP, 'lifetracker.db'))
+os.environ.setdefault('UPLOAD_FOLDER', os.path.join(_TMP, 'uploads'))
+os.environ['PRAYER_PREFETCH_ENABLED'] = 'false'
+os.environ['DATABASE_SNAPSHOT_ENABLED'] = 'false'
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app as appmod  # noqa: E402
+
+FIXTURE_DIR = Path(__file__).resolve().parent / 'fixtures' / 'aladhan'
+TOLERANCE_MINUTES = 2
+
+CITIES = {
+    'makkah': (21.4225, 39.8262, 'Asia/Riyadh'),
+    'new_york': (40.7128, -74.0060, 'America/New_York'),
+    'london': (51.5074, -0.1278, 'Europe/London'),
+}
+METHODS = [2, 4]
+MONTHS = [(2026, 1), (2026, 6)]
+CASES = [
+    (city, method, year, month)
+    for city in CITIES
+    for method in METHODS
+    for year, month in MONTHS
+]
+
+
+def fixture_path(city, method, year, month):
+    return FIXTURE_DIR / f'{city}_method{method}_{year}_{month:02d}.json'
+
+
+def minutes(hhmm):
+    hours, mins = map(int, hhmm.split(':'))
+    return hours * 60 + mins
+
+
+def load_fixture_timings(monkeypatch, city, method, year, month):
+    # Go through the real Aladhan parser so the fixture format is checked too.
+    raw = fixture_path(city, method, year, month).read_bytes()
+    monkeypatch.setattr(appmod, 'urlopen', lambda url, timeout=None: io.BytesIO(raw))
+    latitude, longitude, _ = CITIES[city]
+    start = date(year, month, 1)
+    days = (date(year + month // 12, month % 12 + 1, 1) - start).days
+    return appmod.fetch_aladhan_prayer_timings(start, days, latitude, longitude, method)
+
+
+@pytest.mark.parametrize('city,method,year,month', CASES)
+def test_offline_timings_match_reference_fixtures(monkeypatch, city, method, year, month):
+    expected = load_fixture_timings(monkeypatch, city, method, year, month)
+    assert expected
+    latitude, longitude, tz_name = CITIES[city]
+    start = min(date.fromisoformat(day) for day in expected)
+    calculated = appmod.calculate_prayer_timings(start, len(expected), latitude, longitude, method, ZoneInfo(tz_name))
+    off = []
+    for day_iso, timings in expected.items():
+        for name in appmod.PRAYER_NAMES:
+            diff = abs(minutes(calculated[day_iso][name]) - minutes(timings[name]))
+            if diff > TOLERANCE_MINUTES:
+                off.append((day_iso, name, timings[name], calculated[day_iso][name]))
+    assert not off
+
+
+def test_umm_al_qura_isha_is_later_in_ramadan():
+    latitude, longitude, tz_name = CITIES['makkah']
+    zone = ZoneInfo(tz_name)
+    for day_obj, gap in [(date(2026, 3, 1), 120), (date(2026, 4, 1), 90)]:
+        timings = appmod.calculate_prayer_timings(day_obj, 1, latitude, longitude, 4, zone)[day_obj.isoformat()]
+        assert minutes(timings['Isha']) - minutes(timings['Maghrib']) == gap
+
+
+def test_calculator_needs_a_timezone(monkeypatch):
+    monkeypatch.delenv('PRAYER_TIMEZONE', raising=False)
+    with appmod.app.app_context():
+        with pytest.raises(LookupError):
+            appmod.calculate_prayer_timings(date(2026, 1, 1), 1, 21.4225, 39.8262, 4)
+
+
+def write_fixture(path, payload):
+    # One day per line keeps fixture diffs readable.
+    head = json.dumps({key: value for key, value in payload.items() if key != 'data'})
+    path.write_text(head[:-1] + ', "data": [\n' + ',\n'.join(json.dumps(entry) for entry in payload['data']) + '\n]}\n')
+
+
+def generate_fixtures():
+    import calendar
+    from praytimes import PrayTimes
+
+    method_names = {2: 'ISNA', 4: 'Makkah'}
+    FIXTURE_DIR.mkdir(parents=True, exist_ok=True)
+    for city, method, year, month in CASES:
+        latitude, longitude, tz_name = CITIES[city]
+        params = dict(PrayTimes.methods[method_names[method]]['params'])
+        # praytimes 2.3.2 subtracts minute-based Isha from Maghrib, so Isha is
+        # computed as Maghrib and the minutes are added after rounding.
+        isha_minutes = int(params['isha'].split()[0]) if 'min' in str(params['isha']) else None
+        if isha_minutes is not None:
+            params['isha'] = '0 min'
+        pt = PrayTimes()
+        # Its constructor always lands on Jafari, so set every option explicitly.
+        pt.settings = {'imsak': '10 min', 'dhuhr': '0 min', 'asr': 'Standard', 'highLats': 'AngleBased',
+                       'maghrib': '0 min', 'midnight': 'Standard', **params}
+        data = []
+        for day in range(1, calendar.monthrange(year, month)[1] + 1):
+            day_obj = date(year, month, day)
+            offset = datetime(year, month, day, 12, tzinfo=ZoneInfo(tz_name)).utcoffset().total_seconds() / 3600
+            times = pt.getTimes(day_obj, (latitude, longitude), offset, format='24h')
+            timings = {name: times[name.lower()] for name in ['Fajr', 'Sunrise', 'Dhuhr', 'Asr', 'Maghrib', 'Isha']}
+            if isha_minutes is not None:
+                isha = minutes(timings['Isha']) + isha_minutes
+                timings['Isha'] = f'{isha // 60 % 24:02d}:{isha % 60:02d}'
+            data.append({
+                'timings': timings,
+                'date': {'gregorian': {'date': day_obj.strftime('%d-%m-%Y')}},
+                'meta': {'latitude': latitude, 'longitude': longitude, 'timezone': tz_name, 'method': {'id': method}},
+            })
+        payload = {
+            'code': 200,
+            'status': 'OK',
+            'source': 'generated by tests/test_prayer_times.py --generate from praytimes 2.3.2 (PrayTimes.org), '
+                      'AngleBased high latitudes, Standard Asr; not a live api.aladhan.com capture',
+            'data': data,
+        }
+        write_fixture(fixture_path(city, method, year, month), payload)
+        print('generated', fixture_path(city, method, year, month).name)
+
+
+def record_fixtures():
+    FIXTURE_DIR.mkdir(parents=True, exist_ok=True)
+    for city, method, year, month in CASES:
+        latitude, longitude, _ = CITIES[city]
+        params = urlencode({'latitude': latitude, 'longitude': longitude, 'method': method})
+        with urlopen(f'https://api.aladhan.com/v1/calendar/{year}/{month}?{params}', timeout=30) as response:
+            payload = json.loads(response.read().decode('utf-8'))
+        payload['source'] = f'api.aladhan.com, recorded {datetime.now().date().isoformat()}'
+        write_fixture(fixture_path(city, method, year, month), payload)
+        print('recorded', fixture_path(city, method, year, month).name)
+
+
+if __name__ == '__main__':
+    if '--record' in sys.argv:
+        record_fixtures()
+    elif '--generate' in sys.argv:
+        generate_fixtures()
+    else:
+        sys.exit(pytest.main([__file__, '-q']))